@@ -0,0 +1,189 @@
+# Pool of ComfyUI backends with load-aware routing.
+#
+# Each backend is polled for /queue and /system_stats. A job goes to the
+# healthy backend that has every node class and model file its workflow needs
+# (checked once via /object_info/<class>) and would get through it soonest:
+# the jobs routed there and not finished yet (most of them wait in the
+# scheduler, as ComfyUI's own queue is capped at MAX_INFLIGHT), times the
+# backend's seconds per prompt. A backend that has not finished a prompt yet
+# only gets a job while idle, which measures it. Ties go to the backend with
+# fewer jobs, then to the one that last ran the same pipeline, whose models
+# are most likely still resident in VRAM. Backends that fail a poll or a request are ejected
+# and re-checked with backoff until they answer again.
+#
+# The backend list comes from COMFYUI_URLS (comma separated).
+
+import logging
+import math
+import threading
+import time
+from urllib.parse import quote
+
+import requests
+
+import comfy_client
+from comfy_client import get_client
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 2
+MAX_EJECT_BACKOFF = 60
+
+# Loader inputs that name a model file, e.g. UpscaleModelLoader.model_name
+MODEL_INPUTS = (
+    "model_name", "ckpt_name", "unet_name", "vae_name", "clip_name", "lora_name",
+    "sam_model", "grounding_dino_model",
+)
+
+
+def workflow_requirements(workflow):
+    # (class_type, input_name, value) tuples; input_name None only requires the node class
+    requirements = set()
+    for node in workflow.values():
+        class_type = node.get("class_type")
+        requirements.add((class_type, None, None))
+        for input_name, value in node.get("inputs", {}).items():
+            if input_name in MODEL_INPUTS and isinstance(value, str):
+                requirements.add((class_type, input_name, value))
+    return sorted(requirements, key=lambda r: (r[0], r[1] or "", r[2] or ""))
+
+
+class NoBackendAvailable(Exception):
+    pass
+
+
+class Backend:
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.healthy = True
+        self.queue_depth = 0
+        self.inflight = 0  # jobs routed here and not finished, in the scheduler or in ComfyUI
+        self.system_stats = {}
+        self.last_pipeline = None
+        self.failures = 0
+        self.retry_at = 0
+        self.object_info = {}
+
+    def to_dict(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "queue_depth": self.queue_depth,
+            "inflight": self.inflight,
+            "last_pipeline": self.last_pipeline,
+            "failures": self.failures,
+        }
+
+
+class BackendPool:
+    def __init__(self, urls, poll_interval=POLL_INTERVAL):
+        self.backends = [Backend(url) for url in urls]
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._thread = None
+        comfy_client.add_failure_listener(self.report_failure)
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._poll_loop, name="comfyui-backend-poller", daemon=True)
+            self._thread.start()
+        for backend in self.backends:
+            self.poll(backend)
+
+    def _poll_loop(self):
+        while True:
+            time.sleep(self.poll_interval)
+            now = time.time()
+            for backend in self.backends:
+                if backend.healthy or now >= backend.retry_at:
+                    self.poll(backend)
+
+    def poll(self, backend):
+        client = get_client(backend.url)
+        try:
+            queue_info = client.session.get(client.url("/queue"), timeout=5)
+            queue_info.raise_for_status()
+            queue_info = queue_info.json()
+            stats = client.session.get(client.url("/system_stats"), timeout=5)
+            stats.raise_for_status()
+            stats = stats.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            self._eject(backend, e)
+            return
+        with self._lock:
+            backend.queue_depth = len(queue_info.get("queue_running", [])) + len(queue_info.get("queue_pending", []))
+            backend.system_stats = stats
+            if not backend.healthy:
+                logger.info("ComfyUI backend %s is back, re-adding it", backend.url)
+                backend.object_info = {}
+            backend.healthy = True
+            backend.failures = 0
+
+    def _eject(self, backend, error):
+        with self._lock:
+            backend.failures += 1
+            backoff = min(self.poll_interval * 2 ** (backend.failures - 1), MAX_EJECT_BACKOFF)
+            backend.retry_at = time.time() + backoff
+            if backend.healthy:
+                logger.warning("Ejecting ComfyUI backend %s: %s", backend.url, error)
+            backend.healthy = False
+
+    def report_failure(self, url, error=None):
+        for backend in self.backends:
+            if backend.url == url.rstrip('/'):
+                self._eject(backend, error or "request failed")
+
+    def _class_info(self, backend, class_type):
+        if class_type not in backend.object_info:
+            client = get_client(backend.url)
+            try:
+                response = client.session.get(client.url(f"/object_info/{quote(class_type)}"), timeout=10)
+                response.raise_for_status()
+                backend.object_info[class_type] = response.json().get(class_type)
+            except (requests.exceptions.RequestException, ValueError) as e:
+                logger.warning("Error fetching object_info for %s from %s: %s", class_type, backend.url, e)
+                return None
+        return backend.object_info[class_type]
+
+    def supports(self, backend, requirements):
+        for class_type, input_name, value in requirements:
+            info = self._class_info(backend, class_type)
+            if not info:
+                return False
+            if input_name is None:
+                continue
+            inputs = info.get("input", {})
+            spec = inputs.get("required", {}).get(input_name) or inputs.get("optional", {}).get(input_name)
+            if not spec or not isinstance(spec[0], list) or value not in spec[0]:
+                return False
+        return True
+
+    def acquire(self, pipeline, requirements=(), count=1, service_time=None):
+        # count > 1 reserves the backend for a batch of jobs; release() each of them.
+        # service_time(url) gives a backend's seconds per prompt, or None before it has run one.
+        self.start()
+        candidates = [b for b in self.backends if b.healthy and self.supports(b, requirements)]
+        if not candidates:
+            raise NoBackendAvailable(f"No healthy ComfyUI backend can run {pipeline}")
+        times = {b.url: service_time(b.url) for b in candidates} if service_time is not None else {}
+
+        def work_ahead(b):
+            if times.get(b.url):
+                return (b.inflight + count) * times[b.url]
+            return 0 if b.inflight == 0 else math.inf
+
+        with self._lock:
+            backend = min(candidates, key=lambda b: (work_ahead(b), b.inflight, b.last_pipeline != pipeline))
+            backend.inflight += count
+            backend.last_pipeline = pipeline
+        return backend
+
+    def release(self, backend):
+        with self._lock:
+            backend.inflight = max(backend.inflight - 1, 0)
+
+    def status(self):
+        with self._lock:
+            return [backend.to_dict() for backend in self.backends]
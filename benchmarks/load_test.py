@@ -0,0 +1,175 @@
+# Load test of the production server (serve.py) against fake ComfyUI backends.
+#
+# Starts --backends fake ComfyUI servers and `python serve.py` (all pipelines)
+# in a subprocess, sends --requests blocking requests from --concurrency
+# client threads and reports requests/s and latency percentiles. Then sends
+# SIGTERM while requests are in flight to check they still complete and new
+# jobs get 503 during the drain.
+#
+#   python benchmarks/load_test.py [--requests 200] [--concurrency 16]
+#       [--endpoint cloth_swap|upscale] [--backends 2] [--exec-time 0.05]
+
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from fake_comfyui import FakeComfyUI
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def send(session, url, endpoint, i):
+    image = f"load-{i}-{time.time_ns()}".encode()  # distinct bytes, so no cache answers
+    if endpoint == "cloth_swap":
+        files = {"person_image": ("person.png", image), "cloth_image": ("cloth.png", b"cloth")}
+        return session.post(f"{url}/cloth_swap", files=files, data={"prompt": "shirt"}, timeout=300)
+    return session.post(f"{url}/upscale_image", files={"image": ("image.png", image)}, timeout=300)
+
+
+def run_load(url, endpoint, total, concurrency):
+    latencies, statuses = [], []
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        session = requests.Session()
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                status = send(session, url, endpoint, i).status_code
+            except requests.exceptions.RequestException:
+                status = None
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                statuses.append(status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, statuses
+
+
+def wait_ready(url, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"serve.py exited with status {process.returncode}")
+        try:
+            if requests.get(f"{url}/healthz", timeout=1).status_code == 200:
+                return
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("serve.py did not become ready")
+
+
+def shutdown_test(url, process, endpoint, inflight):
+    # In-flight requests must finish with 200 after SIGTERM; new ones get 503
+    results = []
+
+    def request(i):
+        results.append(send(requests.Session(), url, endpoint, i).status_code)
+
+    threads = [threading.Thread(target=request, args=(i,)) for i in range(inflight)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.5)
+    start = time.perf_counter()
+    process.send_signal(signal.SIGTERM if os.name != "nt" else signal.CTRL_BREAK_EVENT)
+    time.sleep(0.1)
+    try:
+        rejected = send(requests.Session(), url, endpoint, -1).status_code
+    except requests.exceptions.RequestException:
+        rejected = None
+    for thread in threads:
+        thread.join()
+    process.wait(timeout=60)
+    return results, rejected, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test serve.py against fake ComfyUI backends")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--endpoint", choices=["cloth_swap", "upscale"], default="cloth_swap")
+    parser.add_argument("--backends", type=int, default=2)
+    parser.add_argument("--exec-time", type=float, default=0.05)
+    parser.add_argument("--threads", type=int, default=32, help="THREADS for serve.py")
+    args = parser.parse_args()
+
+    fakes = [FakeComfyUI(exec_time=args.exec_time).start() for _ in range(args.backends)]
+    cache_dir = tempfile.mkdtemp(prefix="load-test-")
+    port = free_port()
+    url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        HOST="127.0.0.1",
+        PORT=str(port),
+        THREADS=str(args.threads),
+        COMFYUI_URLS=",".join(fake.url for fake in fakes),
+        UPLOAD_CACHE_PATH=os.path.join(cache_dir, "uploads.json"),
+        RESULT_CACHE_DIR=os.path.join(cache_dir, "results"),
+        MASK_CACHE_DIR=os.path.join(cache_dir, "masks"),
+        SAVE_OUTPUTS="0",
+        MAX_JOBS_PER_CLIENT="0",  # every request comes from the same address
+        LOG_LEVEL="WARNING",
+    )
+    flags = subprocess.CREATE_NEW_PROCESS_GROUP if os.name == "nt" else 0
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "serve.py")], cwd=cache_dir, env=env,
+                               stdout=subprocess.DEVNULL, creationflags=flags)
+    try:
+        wait_ready(url, process)
+        run_load(url, args.endpoint, args.backends * 2, args.backends)  # warm up connections and object_info
+
+        elapsed, latencies, statuses = run_load(url, args.endpoint, args.requests, args.concurrency)
+        failed = sum(1 for status in statuses if status != 200)
+        print(f"{args.requests} x {args.endpoint}, concurrency {args.concurrency}, {args.backends} backends, "
+              f"exec {args.exec_time:g}s, serve.py THREADS={args.threads}")
+        print(f"{'req/s':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}{'failed':>8}")
+        print(f"{len(statuses) / elapsed:>8.1f}{percentile(latencies, 50) * 1000:>9.0f}"
+              f"{percentile(latencies, 95) * 1000:>9.0f}{percentile(latencies, 99) * 1000:>9.0f}"
+              f"{max(latencies) * 1000:>9.0f}{failed:>8}")
+        bound = args.backends / args.exec_time
+        print(f"(fake ComfyUI runs one prompt at a time: at most {bound:.0f} req/s)")
+
+        results, rejected, shutdown = shutdown_test(url, process, args.endpoint, args.concurrency * 2)
+        print(f"SIGTERM with {len(results)} requests in flight: {sum(1 for s in results if s == 200)} completed, "
+              f"new request got {rejected}, exited with {process.returncode} after {shutdown:.2f}s")
+    finally:
+        if process.poll() is None:
+            process.kill()
+        for fake in fakes:
+            fake.stop()
+
+
+if __name__ == '__main__':
+    main()
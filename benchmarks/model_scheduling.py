@@ -0,0 +1,121 @@
+# Replay mixed cloth swap / upscale traffic against a fake ComfyUI backend
+# that charges for loading models, with and without model scheduling.
+#
+# The same Poisson arrival schedule is replayed without grouping
+# (MODEL_SCHEDULING=0: arrival order within each priority class) and with
+# grouping for each --max-wait bound. Reports the time to drain the
+# schedule, the model loads the backend performed and the request latency
+# per pipeline.
+#
+#   python benchmarks/model_scheduling.py [--jobs 30] [--rate 6] [--mix 0.5]
+#       [--exec-time 0.1] [--load-time 0.2] [--max-models 2] [--max-wait 1 5]
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_comfyui import FakeComfyUI
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def replay(app, schedule, tag):
+    latencies = {"cloth_swap": [], "upscale": []}
+    errors = []
+
+    def send(i, kind):
+        client = app.test_client()
+        image = f"{tag}-{i}".encode()  # distinct bytes, so neither result nor mask cache answers
+        start = time.perf_counter()
+        if kind == "cloth_swap":
+            response = client.post("/cloth_swap", data={
+                "person_image": (io.BytesIO(image), "person.png"),
+                "cloth_image": (io.BytesIO(b"cloth"), "cloth.png"),
+                "prompt": "shirt",
+            })
+        else:
+            response = client.post("/upscale_image", data={"image": (io.BytesIO(image), "image.png")})
+        if response.status_code != 200:
+            errors.append(response.status_code)
+        latencies[kind].append(time.perf_counter() - start)
+
+    threads = []
+    start = time.perf_counter()
+    for i, (at, kind) in enumerate(schedule):
+        time.sleep(max(at - (time.perf_counter() - start), 0))
+        thread = threading.Thread(target=send, args=(i, kind))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate model-residency-aware scheduling")
+    parser.add_argument("--jobs", type=int, default=30)
+    parser.add_argument("--rate", type=float, default=6.0, help="arrivals per second")
+    parser.add_argument("--mix", type=float, default=0.5, help="share of cloth swap jobs")
+    parser.add_argument("--exec-time", type=float, default=0.1)
+    parser.add_argument("--load-time", type=float, default=0.2, help="seconds to load one model file")
+    parser.add_argument("--max-models", type=int, default=2, help="model files that fit in VRAM")
+    parser.add_argument("--max-wait", type=float, nargs="+", default=[1.0, 5.0])
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    fake = FakeComfyUI(exec_time=args.exec_time, load_time=args.load_time, max_models=args.max_models).start()
+    cache_dir = tempfile.mkdtemp(prefix="model-scheduling-")
+    os.environ.update(
+        COMFYUI_URLS=fake.url,
+        UPLOAD_CACHE_PATH=os.path.join(cache_dir, "uploads.json"),
+        RESULT_CACHE_DIR=os.path.join(cache_dir, "results"),
+        MASK_CACHE_DIR=os.path.join(cache_dir, "masks"),
+        SAVE_OUTPUTS="0",
+        MAX_JOBS_PER_CLIENT="0",  # every simulated request comes from the same address
+        LOG_LEVEL="WARNING",
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        import combined
+    scheduler = combined.job_manager.scheduler
+
+    rng = random.Random(args.seed)
+    schedule, at = [], 0.0
+    for _ in range(args.jobs):
+        at += rng.expovariate(args.rate)
+        schedule.append((at, "cloth_swap" if rng.random() < args.mix else "upscale"))
+
+    modes = [("no grouping", False, 0.0)] + [(f"grouped, max wait {w:g}s", True, w) for w in args.max_wait]
+    print(f"{args.jobs} jobs at {args.rate:g}/s, {args.mix:.0%} cloth swap, load {args.load_time:g}s/model, "
+          f"exec {args.exec_time:g}s")
+    print(f"{'mode':<26}{'drain s':>9}{'loads':>7}{'switches':>10}"
+          f"{'swap p50':>10}{'swap p95':>10}{'up p50':>9}{'up p95':>9}")
+    for tag, (name, enabled, max_wait) in enumerate(modes):
+        scheduler.enabled, scheduler.max_wait = enabled, max_wait
+        fake.resident.clear()
+        loads, switches = fake.model_loads, scheduler.switches
+        with contextlib.redirect_stdout(io.StringIO()):
+            elapsed, latencies, errors = replay(combined.app, schedule, tag)
+        swap, up = latencies["cloth_swap"], latencies["upscale"]
+        print(f"{name:<26}{elapsed:>9.2f}{fake.model_loads - loads:>7}{scheduler.switches - switches:>10}"
+              f"{percentile(swap, 50):>10.2f}{percentile(swap, 95):>10.2f}"
+              f"{percentile(up, 50):>9.2f}{percentile(up, 95):>9.2f}"
+              + (f"  ({len(errors)} failed)" if errors else ""))
+    fake.stop()
+    os._exit(0)  # job-waiter and websocket threads would otherwise keep the interpreter alive
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+# Bytes uploaded and end-to-end latency of cloth swap requests with large
+# person photos, with and without input preprocessing (preprocess.py).
+#
+# Sends --requests cloth swaps one after another to the app against a fake
+# ComfyUI backend with a limited upload bandwidth. Each person image is a
+# distinct synthetic --megapixels JPEG (or variants of the first image
+# given), so no cache answers. Needs Pillow.
+#
+#   python benchmarks/preprocess.py [--requests 10] [--megapixels 24]
+#       [--upload-mbps 100] [--exec-time 0.5] [image ...]
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image, ImageDraw
+
+from fake_comfyui import FakeComfyUI
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def photo(megapixels):
+    # Smooth gradients plus sensor-like noise, so it compresses like a photo rather than a flat image
+    width = int((megapixels * 1e6 * 3 / 2) ** 0.5)
+    size = (width, width * 2 // 3)
+    noise = Image.effect_noise(size, 10)  # about 8 MB at 24 MP, like a phone JPEG
+    gradient = Image.linear_gradient("L").resize(size)
+    return Image.merge("RGB", (gradient, noise, gradient.rotate(90).resize(size)))
+
+
+def distinct_images(base, count):
+    # JPEG bytes of base with a different block drawn on each, so every request is a new image
+    images = []
+    for i in range(count):
+        image = base.copy()
+        ImageDraw.Draw(image).rectangle((0, 0, 127, 127), fill=(i * 37 % 256, i * 91 % 256, i * 13 % 256))
+        out = io.BytesIO()
+        image.save(out, "JPEG", quality=92)
+        images.append(out.getvalue())
+    return images
+
+
+def run(app, fake, images):
+    latencies = []
+    uploaded = fake.uploaded_bytes
+    client = app.test_client()
+    for i, image in enumerate(images):
+        start = time.perf_counter()
+        response = client.post("/cloth_swap", data={
+            "person_image": (io.BytesIO(image), f"person_{i}.jfif"),
+            "cloth_image": (io.BytesIO(b"cloth"), "cloth.png"),
+            "prompt": "shirt",
+        })
+        if response.status_code != 200:
+            raise RuntimeError(f"cloth swap failed with {response.status_code}: {response.get_data(as_text=True)}")
+        latencies.append(time.perf_counter() - start)
+    return fake.uploaded_bytes - uploaded, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure input image preprocessing")
+    parser.add_argument("--requests", type=int, default=10)
+    parser.add_argument("--megapixels", type=float, default=24)
+    parser.add_argument("--upload-mbps", type=float, default=100, help="simulated upload bandwidth to ComfyUI")
+    parser.add_argument("--exec-time", type=float, default=0.5)
+    parser.add_argument("images", nargs="*", help="photo to use instead of a synthetic one")
+    args = parser.parse_args()
+
+    fake = FakeComfyUI(exec_time=args.exec_time, upload_bandwidth=args.upload_mbps * 125000).start()
+    cache_dir = tempfile.mkdtemp(prefix="preprocess-")
+    os.environ.update(
+        COMFYUI_URLS=fake.url,
+        UPLOAD_CACHE_PATH=os.path.join(cache_dir, "uploads.json"),
+        RESULT_CACHE_DIR=os.path.join(cache_dir, "results"),
+        MASK_CACHE_DIR=os.path.join(cache_dir, "masks"),
+        SAVE_OUTPUTS="0",
+        LOG_LEVEL="WARNING",
+        PERSON_MAX_MEGAPIXELS="2",  # the SAM node's limit; CatVTON would otherwise get the full image
+    )
+    with contextlib.redirect_stdout(io.StringIO()):
+        import combined
+        import preprocess
+
+    base = Image.open(args.images[0]).convert("RGB") if args.images else photo(args.megapixels)
+    images = distinct_images(base, args.requests)
+    print(f"{args.requests} cloth swaps, person {base.width}x{base.height} JPEG, "
+          f"upload {args.upload_mbps:g} Mbit/s, exec {args.exec_time:g}s")
+    print(f"{'preprocessing':<15}{'uploaded MB':>13}{'per image MB':>14}{'p50 s':>8}{'p95 s':>8}")
+    for tag, enabled in enumerate((False, True)):
+        preprocess.PREPROCESS_IMAGES = enabled
+        # A trailing byte (ignored by JPEG decoders) makes the images new content for each mode
+        uploaded, latencies = run(combined.app, fake, [image + bytes([tag]) for image in images])
+        print(f"{'on' if enabled else 'off':<15}{uploaded / 1e6:>13.1f}{uploaded / 1e6 / len(images):>14.2f}"
+              f"{percentile(latencies, 50):>8.2f}{percentile(latencies, 95):>8.2f}")
+    fake.stop()
+    os._exit(0)  # job-waiter and websocket threads would otherwise keep the interpreter alive
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# Compare response size and server CPU time of the result formats:
+# base64 JSON (default), raw image/png and multipart/mixed.
+#
+# Builds each response the way jobs.py does, from images already in memory,
+# so only the formatting cost is measured (no ComfyUI round trips).
+#
+#   python benchmarks/response_formats.py [--iterations 50] [image ...]
+
+import argparse
+import base64
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify
+
+from streaming import StreamPart, stream_response
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def build_json(cloth, mask):
+    payload = {
+        "cloth_image_base64": base64.b64encode(cloth).decode('utf-8'),
+        "mask_image_base64": base64.b64encode(mask).decode('utf-8'),
+    }
+    return jsonify(payload).get_data()
+
+
+def build_raw(cloth, mask):
+    response = stream_response(None, [StreamPart("cloth", data=cloth)])
+    return b"".join(response.response)
+
+
+def build_multipart(cloth, mask):
+    response = stream_response(None, [StreamPart("cloth", data=cloth), StreamPart("mask", data=mask)], multipart=True)
+    return b"".join(response.response)
+
+
+def measure(build, cloth, mask, iterations):
+    size = 0
+    start_cpu = time.process_time()
+    start_wall = time.perf_counter()
+    for _ in range(iterations):
+        size = len(build(cloth, mask))
+    cpu = (time.process_time() - start_cpu) / iterations
+    wall = (time.perf_counter() - start_wall) / iterations
+    return size, cpu, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare response size and CPU time of the result formats")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("images", nargs="*")
+    args = parser.parse_args()
+
+    images = args.images or sorted(glob.glob(os.path.join(ROOT, "input", "*.png")))[:2]
+    cloth = open(images[0], "rb").read()
+    mask = open(images[-1], "rb").read()
+
+    app = Flask(__name__)
+    print(f"cloth: {os.path.basename(images[0])} ({len(cloth)} bytes), mask: {os.path.basename(images[-1])} ({len(mask)} bytes)")
+    print(f"{'format':<22}{'outputs':>8}{'bytes':>12}{'cpu ms':>10}{'wall ms':>10}")
+    with app.app_context():
+        for name, build, outputs in (
+            ("json (base64)", build_json, 2),
+            ("image/png", build_raw, 1),
+            ("multipart/mixed", build_multipart, 2),
+        ):
+            size, cpu, wall = measure(build, cloth, mask, args.iterations)
+            print(f"{name:<22}{outputs:>8}{size:>12}{cpu * 1000:>10.2f}{wall * 1000:>10.2f}")
+
+
+if __name__ == '__main__':
+    main()
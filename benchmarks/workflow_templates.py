@@ -0,0 +1,73 @@
+# Compare the cost of building a per-request cloth swap graph:
+#   shallow copy   WORKFLOW_JSON.copy() + assignments (the old code; mutates the shared dict)
+#   deepcopy       copy.deepcopy() + assignments
+#   json roundtrip json.loads(json.dumps()) + assignments
+#   template       WorkflowTemplate.build()
+#
+# Also checks whether the module-level graph is left untouched.
+#
+#   python benchmarks/workflow_templates.py [--iterations 20000]
+
+import argparse
+import copy
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workflow_template import WorkflowTemplate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SLOTS = {
+    "person_image": ("1", "image"),
+    "cloth_image": ("2", "image"),
+    "prompt": ("4", "prompt"),
+    "seed": ("5", "seed"),
+}
+
+
+def assign(workflow, i):
+    workflow["1"]["inputs"]["image"] = f"person_{i}.png"
+    workflow["2"]["inputs"]["image"] = f"cloth_{i}.png"
+    workflow["4"]["inputs"]["prompt"] = f"prompt {i}"
+    workflow["5"]["inputs"]["seed"] = i
+    return workflow
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-request workflow construction")
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "workflow", "Cloth Swap.json"), "r", encoding="utf-8") as f:
+        graph = json.load(f)
+    before = json.dumps(graph, sort_keys=True)
+
+    def template_builder(g):
+        template = WorkflowTemplate(g, SLOTS, name="cloth_swap")
+        build = lambda i: template.build(person_image=f"person_{i}.png", cloth_image=f"cloth_{i}.png",
+                                         prompt=f"prompt {i}", seed=i)
+        return build, template.build
+
+    approaches = (
+        ("shallow copy", lambda g: (lambda i: assign(g.copy(), i), lambda: g)),
+        ("deepcopy", lambda g: (lambda i: assign(copy.deepcopy(g), i), lambda: g)),
+        ("json roundtrip", lambda g: (lambda i: assign(json.loads(json.dumps(g)), i), lambda: g)),
+        ("template", template_builder),
+    )
+
+    print(f"{'approach':<18}{'us/build':>10}{'shared graph intact':>22}")
+    for name, setup in approaches:
+        build, shared = setup(copy.deepcopy(graph))
+        start = time.perf_counter()
+        for i in range(args.iterations):
+            build(i)
+        elapsed = (time.perf_counter() - start) / args.iterations
+        intact = json.dumps(shared(), sort_keys=True) == before
+        print(f"{name:<18}{elapsed * 1e6:>10.2f}{'yes' if intact else 'NO':>22}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,288 @@
+# Shared HTTP client for ComfyUI.
+#
+# One pooled keep-alive requests.Session per ComfyUI backend, so uploads,
+# /prompt, /history and /view calls reuse TCP connections instead of opening
+# a new one each time. Connection counters show how many connections were
+# opened versus reused.
+#
+# get_images() fetches several /view images concurrently on a shared,
+# bounded thread pool (FETCH_WORKERS).
+#
+# Request latency, retries, timeouts and image bytes sent and received are
+# recorded in metrics.py.
+
+import base64
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.exceptions import ConnectionError, Timeout
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metrics import ENCODE_SECONDS, REQUEST_SECONDS, RETRIES, TIMEOUTS, UPLOAD_BYTES, VIEW_BYTES
+
+DEFAULT_POOL_SIZE = int(os.environ.get("COMFYUI_POOL_SIZE", 20))
+FETCH_WORKERS = int(os.environ.get("FETCH_WORKERS", 8))
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.opened = 0
+
+    def add(self, requests=0, opened=0):
+        with self._lock:
+            self.requests += requests
+            self.opened += opened
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "connections_opened": self.opened,
+                "connections_reused": max(self.requests - self.opened, 0),
+            }
+
+
+class CountingHTTPAdapter(HTTPAdapter):
+    def __init__(self, stats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        stats = self.stats
+
+        def counting(pool_class):
+            class CountingPool(pool_class):
+                def _new_conn(self):
+                    stats.add(opened=1)
+                    return super()._new_conn()
+            return CountingPool
+
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": counting(HTTPConnectionPool),
+            "https": counting(HTTPSConnectionPool),
+        }
+
+    def send(self, request, **kwargs):
+        self.stats.add(requests=1)
+        return super().send(request, **kwargs)
+
+
+class ComfyClient:
+    def __init__(self, base_url, pool_size=DEFAULT_POOL_SIZE):
+        self.base_url = base_url.rstrip('/')
+        self.stats = ConnectionStats()
+        self.session = requests.Session()
+        adapter = CountingHTTPAdapter(self.stats, pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def url(self, path):
+        return path if path.startswith("http") else f"{self.base_url}{path}"
+
+    def safe_request(self, method, url, max_retries=5, delay=1, **kwargs):
+        url = self.url(url)
+        path = "/" + urlsplit(url).path.lstrip("/").split("/")[0]  # metrics label: /view, /upload, /prompt
+        start = time.perf_counter()
+        try:
+            for i in range(max_retries):
+                try:
+                    response = self.session.request(method, url, **kwargs)
+                    response.raise_for_status()
+                    return response
+                except ConnectionError as e:
+                    logger.warning("Connection error (attempt %d/%d) to %s: %s", i + 1, max_retries, url, e)
+                    self._count_error(path, e, retry=i < max_retries - 1)
+                    if i < max_retries - 1:
+                        time.sleep(delay * (i + 1))
+                    else:
+                        for listener in _failure_listeners:
+                            listener(self.base_url, e)
+                        raise
+                except requests.exceptions.RequestException as e:
+                    # A 4xx (other than 429) is ComfyUI rejecting the request; sending it again won't help
+                    rejected = e.response is not None and 400 <= e.response.status_code < 500 \
+                        and e.response.status_code != 429
+                    logger.warning("Request error (attempt %d/%d) to %s: %s", i + 1, max_retries, url, e)
+                    self._count_error(path, e, retry=not rejected and i < max_retries - 1)
+                    if not rejected and i < max_retries - 1:
+                        time.sleep(delay * (i + 1))
+                    else:
+                        raise
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start, backend=self.base_url, path=path)
+
+    def _count_error(self, path, error, retry):
+        if isinstance(error, Timeout):
+            TIMEOUTS.inc(backend=self.base_url, kind="request")
+        if retry:
+            kind = "timeout" if isinstance(error, Timeout) else "connection" if isinstance(error, ConnectionError) else "http"
+            RETRIES.inc(backend=self.base_url, path=path, error=kind)
+
+    def upload_image(self, image_data, filename):
+        files = {"image": (filename, image_data, "image/jpeg")}
+        try:
+            response = self.safe_request("POST", "/upload/image", files=files)
+            if response.status_code == 200:
+                UPLOAD_BYTES.inc(len(image_data), backend=self.base_url)
+                try:
+                    return response.json().get("name", filename)
+                except ValueError:
+                    return filename
+            else:
+                logger.error("Failed to upload image: %s", response.text)
+                return None
+        except requests.exceptions.RequestException as e:
+            logger.error("Error during image upload: %s", e)
+            return None
+
+    def queue_prompt(self, prompt, client_id):
+        p = {"prompt": prompt, "client_id": client_id}
+        data = json.dumps(p).encode('utf-8')
+        sent = time.monotonic()
+        try:
+            response = self.safe_request("POST", "/prompt", data=data)
+            if response.status_code == 200:
+                response_data = response.json()
+                prompt_id = response_data.get("prompt_id")
+                logger.info("Queued prompt %s", prompt_id,
+                            extra={"prompt_id": prompt_id, "node_errors": response_data.get("node_errors")})
+                for listener in _prompt_listeners:
+                    listener(self.base_url, prompt_id, prompt, sent)
+                return response_data
+            else:
+                logger.error("Failed to queue prompt, status %d: %s", response.status_code, response.text)
+                return {}
+        except requests.exceptions.RequestException as e:
+            logger.error("Error during prompt queuing: %s", e)
+            if e.response is not None and 400 <= e.response.status_code < 500:
+                # ComfyUI's validation errors: {"error": {...}, "node_errors": {...}}
+                try:
+                    return e.response.json()
+                except ValueError:
+                    pass
+            return {}
+
+    def get_history(self, prompt_id, timeout=10):
+        response = self.session.get(self.url(f"/history/{prompt_id}"), timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def get_queue(self, timeout=5):
+        response = self.session.get(self.url("/queue"), timeout=timeout)
+        response.raise_for_status()
+        return response.json()
+
+    def cancel_prompt(self, prompt_id, timeout=5):
+        # Take the prompt out of ComfyUI's queue, or interrupt it if it is running; returns which
+        response = self.session.post(self.url("/queue"), json={"delete": [prompt_id]}, timeout=timeout)
+        response.raise_for_status()
+        if not any(item[1] == prompt_id for item in self.get_queue(timeout).get("queue_running", [])):
+            return "deleted"
+        # Older ComfyUI ignores prompt_id and interrupts whatever runs, hence the check above
+        response = self.session.post(self.url("/interrupt"), json={"prompt_id": prompt_id}, timeout=timeout)
+        response.raise_for_status()
+        return "interrupted"
+
+    def get_image(self, filename, subfolder, folder_type):
+        params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+        logger.debug("Fetching image %s", params)
+        try:
+            response = self.safe_request("GET", "/view", params=params)
+            if response.status_code == 200:
+                VIEW_BYTES.inc(len(response.content), backend=self.base_url)
+                return response.content
+            else:
+                logger.error("Failed to get image %s, status %d: %s", filename, response.status_code, response.text)
+                return None
+        except requests.exceptions.RequestException as e:
+            logger.error("Error getting image %s: %s", filename, e)
+            return None
+
+    def get_image_with_retry(self, filename, subfolder, folder_type, max_retries=3, retry_delay=1):
+        for attempt in range(max_retries):
+            image_data = self.get_image(filename, subfolder, folder_type)
+            if image_data:
+                return image_data
+            logger.warning("Failed to get image %s, retrying (attempt %d)", filename, attempt + 1)
+            time.sleep(retry_delay)
+        return None
+
+    def get_images(self, image_refs, encode=False, max_retries=3, retry_delay=1):
+        # Fetch /view images concurrently, in the order given; None for an image that failed.
+        # With encode=True each result is (data, base64 string), encoded as soon as it arrives.
+        def fetch(image_ref):
+            data = self.get_image_with_retry(image_ref["filename"], image_ref.get("subfolder", ""),
+                                             image_ref.get("type", "temp"), max_retries, retry_delay)
+            if not encode or not data:
+                return data
+            start = time.perf_counter()
+            encoded = base64.b64encode(data).decode('utf-8')
+            ENCODE_SECONDS.observe(time.perf_counter() - start)
+            return data, encoded
+
+        if len(image_refs) <= 1:
+            return [fetch(image_ref) for image_ref in image_refs]
+        return list(fetch_pool().map(fetch, image_refs))
+
+    def get_output_images(self, outputs, node_ids, encode=False):
+        # Every image of each output node, fetched together; one list per node id
+        refs = [outputs.get(node_id, {}).get("images", []) for node_id in node_ids]
+        images = iter(self.get_images([ref for node_refs in refs for ref in node_refs], encode=encode))
+        return [[next(images) for _ in node_refs] for node_refs in refs]
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_failure_listeners = []
+_prompt_listeners = []
+_fetch_pool = None
+
+
+def fetch_pool():
+    global _fetch_pool
+    with _clients_lock:
+        if _fetch_pool is None:
+            _fetch_pool = ThreadPoolExecutor(max_workers=FETCH_WORKERS, thread_name_prefix="comfyui-fetch")
+    return _fetch_pool
+
+
+def add_failure_listener(listener):
+    # listener(base_url, error) is called when a backend stays unreachable after all retries
+    _failure_listeners.append(listener)
+
+
+def add_prompt_listener(listener):
+    # listener(base_url, prompt_id, prompt, sent) is called in the submitting thread once a prompt is
+    # queued; sent is the time.monotonic() the /prompt request went out
+    _prompt_listeners.append(listener)
+
+
+def get_client(base_url):
+    base_url = base_url.rstrip('/')
+    with _clients_lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = ComfyClient(base_url)
+    return client
+
+
+def connection_stats():
+    with _clients_lock:
+        clients = dict(_clients)
+    return {url: client.stats.to_dict() for url, client in clients.items()}
+
+
+def init_app(app):
+    app.add_url_rule('/comfyui/connections', 'comfyui_connections', lambda: connection_stats(), methods=['GET'])
@@ -0,0 +1,365 @@
+# Completion listener for ComfyUI prompts.
+#
+# Keeps one persistent connection per ComfyUI server to its /ws?clientId=...
+# event stream and wakes up waiting requests as soon as the "executing"
+# message with node=None (or "execution_success") arrives for their
+# prompt_id. While the socket is down, waiters fall back to polling /history.
+#
+# The same events give when each node of a prompt ran (from its "executing"
+# message to the next one), see node_runs() and node_times(), which nodes
+# ComfyUI served from its cache, and when the prompt started and finished
+# executing, see prompt_times().
+#
+# subscribe() forwards a prompt's progress as it happens: the node executing,
+# step/max "progress" of nodes like samplers, nodes served from cache, and
+# the preview frames ComfyUI sends as binary messages when it runs with
+# --preview-method (attributed to the prompt executing at the time, unless
+# the frame carries its prompt_id). queue_position() reads /queue, at most
+# once per QUEUE_POLL_INTERVAL per server.
+#
+# cancel() wakes the waiter of a prompt the API gave up on (deleted from
+# ComfyUI's queue, which sends no event for it, or being interrupted).
+
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import requests
+import websocket
+
+from comfy_client import get_client
+
+FINISHED_BUFFER_SIZE = 1000
+QUEUE_POLL_INTERVAL = 1.0
+FORWARDED_EVENTS = ("execution_start", "execution_cached", "executing", "progress")
+
+# Binary /ws messages: a 4-byte event type, then the payload
+PREVIEW_IMAGE = 1  # 4-byte image type, then the image
+PREVIEW_IMAGE_WITH_METADATA = 4  # 4-byte metadata length, JSON metadata, then the image
+PREVIEW_MIMETYPES = {1: "image/jpeg", 2: "image/png"}
+
+logger = logging.getLogger(__name__)
+
+
+class PromptFailed(Exception):
+    pass
+
+
+class CompletionListener:
+    def __init__(self, base_url, client_id=None, reconnect_delay=2, poll_interval=1):
+        self.base_url = base_url.rstrip('/')
+        self.client_id = client_id or f"python-api-{uuid.uuid4().hex}"
+        self.reconnect_delay = reconnect_delay
+        self.poll_interval = poll_interval
+        self._cond = threading.Condition()
+        self._finished = OrderedDict()  # prompt_id -> (status, details)
+        self._executing = {}  # prompt_id -> (node_id, started) of the node running now
+        self._node_runs = OrderedDict()  # prompt_id -> [(node_id, started, finished)]
+        self._cached_nodes = OrderedDict()  # prompt_id -> node ids served from ComfyUI's cache
+        self._prompt_times = OrderedDict()  # prompt_id -> [execution started, finished] (time.monotonic())
+        self._running = None  # prompt_id executing now, for preview frames
+        self._subscribers = {}  # prompt_id -> [callback(event, data)]
+        self._queue = (None, None)  # (time.monotonic(), /queue response) last read
+        self._queue_lock = threading.Lock()
+        self._connected = False
+        self._generation = 0
+        self._stopped = False
+        self._ws = None
+        self._thread = None
+
+    @property
+    def ws_url(self):
+        scheme = "wss" if self.base_url.startswith("https") else "ws"
+        return f"{scheme}://{self.base_url.split('://', 1)[1]}/ws?clientId={self.client_id}"
+
+    @property
+    def connected(self):
+        return self._connected
+
+    def start(self, connect_timeout=1.0):
+        if self._thread is not None:
+            return self
+        self._thread = threading.Thread(target=self._run, name=f"comfyui-ws-{self.base_url}", daemon=True)
+        self._thread.start()
+        with self._cond:
+            self._cond.wait_for(lambda: self._connected, timeout=connect_timeout)
+        return self
+
+    def stop(self):
+        self._stopped = True
+        if self._ws is not None:
+            self._ws.close()
+
+    def _run(self):
+        while not self._stopped:
+            self._ws = websocket.WebSocketApp(
+                self.ws_url,
+                on_open=self._on_open,
+                on_message=self._on_message,
+                on_error=self._on_error,
+                on_close=self._on_close,
+            )
+            self._ws.run_forever(ping_interval=30, ping_timeout=10)
+            self._set_connected(False)
+            if not self._stopped:
+                time.sleep(self.reconnect_delay)
+
+    def _set_connected(self, connected):
+        with self._cond:
+            if self._connected != connected:
+                self._connected = connected
+                self._generation += 1
+                self._cond.notify_all()
+
+    def _on_open(self, ws):
+        logger.info("Connected to ComfyUI event stream at %s", self.ws_url)
+        self._set_connected(True)
+
+    def _on_error(self, ws, error):
+        logger.warning("ComfyUI event stream error (%s): %s", self.base_url, error)
+
+    def _on_close(self, ws, status_code, message):
+        self._set_connected(False)
+
+    def _on_message(self, ws, message):
+        if isinstance(message, bytes):
+            self._on_preview(message)
+            return
+        try:
+            msg = json.loads(message)
+        except ValueError:
+            return
+        msg_type = msg.get("type")
+        data = msg.get("data") or {}
+        prompt_id = data.get("prompt_id")
+        if msg_type == "status":
+            # Sent whenever ComfyUI's queue changes; the queue is the same for every prompt
+            exec_info = (data.get("status") or {}).get("exec_info") or {}
+            with self._queue_lock:
+                self._queue = (None, None)
+            with self._cond:
+                prompt_ids = list(self._subscribers)
+            for subscribed in prompt_ids:
+                self._publish(subscribed, "queue", {"queue_remaining": exec_info.get("queue_remaining")})
+            return
+        if not prompt_id:
+            return
+        if msg_type in FORWARDED_EVENTS:
+            self._publish(prompt_id, msg_type, data)
+
+        if msg_type == "execution_start":
+            self._prompt_event(prompt_id, 0)
+        elif msg_type == "execution_cached":
+            with self._cond:
+                self._cached_nodes[prompt_id] = list(data.get("nodes") or [])
+                while len(self._cached_nodes) > FINISHED_BUFFER_SIZE:
+                    self._cached_nodes.popitem(last=False)
+        elif msg_type == "executing":
+            self._node_executing(prompt_id, data.get("node"))
+
+        if msg_type == "executing" and data.get("node") is None:
+            self._finish(prompt_id, "success")
+        elif msg_type == "execution_success":
+            self._finish(prompt_id, "success")
+        elif msg_type == "execution_error":
+            self._finish(prompt_id, "error", data.get("exception_message"))
+        elif msg_type == "execution_interrupted":
+            self._finish(prompt_id, "interrupted")
+
+    def _on_preview(self, message):
+        event = int.from_bytes(message[:4], "big")
+        if event == PREVIEW_IMAGE:
+            mimetype = PREVIEW_MIMETYPES.get(int.from_bytes(message[4:8], "big"), "image/jpeg")
+            image = message[8:]
+            with self._cond:
+                prompt_id = self._running
+                node_id = self._executing.get(prompt_id, (None,))[0]
+        elif event == PREVIEW_IMAGE_WITH_METADATA:
+            length = int.from_bytes(message[4:8], "big")
+            try:
+                metadata = json.loads(message[8:8 + length])
+            except ValueError:
+                return
+            prompt_id = metadata.get("prompt_id")
+            node_id = metadata.get("display_node_id") or metadata.get("node_id")
+            mimetype = metadata.get("image_type", "image/jpeg")
+            image = message[8 + length:]
+        else:
+            return
+        if prompt_id and image:
+            self._publish(prompt_id, "preview", {"node": node_id, "mimetype": mimetype, "image": image})
+
+    def subscribe(self, prompt_id, callback):
+        # callback(event, data) runs on the socket thread for each event of the prompt, so it must not block
+        with self._cond:
+            self._subscribers.setdefault(prompt_id, []).append(callback)
+
+    def unsubscribe(self, prompt_id, callback):
+        with self._cond:
+            callbacks = self._subscribers.get(prompt_id, [])
+            if callback in callbacks:
+                callbacks.remove(callback)
+            if not callbacks:
+                self._subscribers.pop(prompt_id, None)
+
+    def _publish(self, prompt_id, event, data):
+        with self._cond:
+            callbacks = list(self._subscribers.get(prompt_id, ()))
+        for callback in callbacks:
+            try:
+                callback(event, data)
+            except Exception:
+                logger.exception("Error in %s event subscriber", event)
+
+    def executing(self, prompt_id):
+        # Node id running now for the prompt, or None
+        with self._cond:
+            return self._executing.get(prompt_id, (None,))[0]
+
+    def queue_position(self, prompt_id):
+        # 0 while the prompt runs, n when it is nth in ComfyUI's queue, None when in neither
+        with self._queue_lock:
+            read_at, queue_info = self._queue
+            if read_at is None or time.monotonic() - read_at > QUEUE_POLL_INTERVAL:
+                try:
+                    queue_info = get_client(self.base_url).get_queue()
+                except (requests.exceptions.RequestException, ValueError) as e:
+                    logger.warning("Error while fetching queue: %s", e)
+                    return None
+                self._queue = (time.monotonic(), queue_info)
+        if any(item[1] == prompt_id for item in queue_info.get("queue_running", [])):
+            return 0
+        # Items are [number, prompt_id, ...]; ComfyUI runs the lowest number first
+        pending = sorted(queue_info.get("queue_pending", []), key=lambda item: item[0])
+        for position, item in enumerate(pending, 1):
+            if item[1] == prompt_id:
+                return position
+        return None
+
+    def _node_executing(self, prompt_id, node_id):
+        # node_id None: the prompt finished, closing the last node
+        now = time.monotonic()
+        with self._cond:
+            if node_id is not None:
+                self._running = prompt_id
+            previous = self._executing.pop(prompt_id, None)
+            if previous is not None:
+                self._node_runs.setdefault(prompt_id, []).append((previous[0], previous[1], now))
+                while len(self._node_runs) > FINISHED_BUFFER_SIZE:
+                    self._node_runs.popitem(last=False)
+            if node_id is not None:
+                self._executing[prompt_id] = (node_id, now)
+
+    def _prompt_event(self, prompt_id, index):
+        # index 0: execution started, 1: finished; only the first message of each counts
+        with self._cond:
+            times = self._prompt_times.get(prompt_id)
+            if times is None:
+                times = self._prompt_times[prompt_id] = [None, None]
+                while len(self._prompt_times) > FINISHED_BUFFER_SIZE:
+                    self._prompt_times.popitem(last=False)
+            if times[index] is None:
+                times[index] = time.monotonic()
+
+    def prompt_times(self, prompt_id):
+        # (started, finished) in time.monotonic(), None for an event not seen (e.g. socket down)
+        with self._cond:
+            return tuple(self._prompt_times.get(prompt_id, (None, None)))
+
+    def node_runs(self, prompt_id):
+        # [(node_id, started, finished)] in execution order, time.monotonic()
+        with self._cond:
+            return list(self._node_runs.get(prompt_id, ()))
+
+    def node_times(self, prompt_id):
+        # {node_id: seconds} for the nodes ComfyUI executed (not the ones it served from its cache)
+        times = {}
+        for node_id, started, finished in self.node_runs(prompt_id):
+            times[node_id] = times.get(node_id, 0) + finished - started
+        return times
+
+    def cached_nodes(self, prompt_id):
+        with self._cond:
+            return list(self._cached_nodes.get(prompt_id, ()))
+
+    def _finish(self, prompt_id, status, details=None):
+        self._prompt_event(prompt_id, 1)
+        self._node_executing(prompt_id, None)  # an error or interrupt ends the node that was running
+        with self._cond:
+            if self._running == prompt_id:
+                self._running = None
+            if prompt_id in self._finished and (status == "success" or self._finished[prompt_id][0] == "cancelled"):
+                return
+            self._finished[prompt_id] = (status, details)
+            while len(self._finished) > FINISHED_BUFFER_SIZE:
+                self._finished.popitem(last=False)
+            self._cond.notify_all()
+
+    def cancel(self, prompt_id):
+        self._finish(prompt_id, "cancelled")
+
+    def fetch_history(self, prompt_id):
+        entry = get_client(self.base_url).get_history(prompt_id).get(prompt_id)
+        if entry and 'outputs' in entry:
+            status = entry.get("status", {})
+            if status.get("status_str") == "error":
+                raise PromptFailed(f"Prompt {prompt_id} failed in ComfyUI")
+            return entry['outputs']
+        return None
+
+    def wait_for_outputs(self, prompt_id, timeout):
+        # Returns the prompt's outputs dict, or None if it did not finish in time.
+        deadline = time.monotonic() + timeout
+        seen_generation = None
+        completed = False
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+
+            with self._cond:
+                finished = self._finished.pop(prompt_id, None)
+                connected = self._connected
+                generation = self._generation
+                if not completed and finished is None and connected and generation == seen_generation:
+                    self._cond.wait(remaining)
+                    continue
+
+            if finished is not None:
+                status, details = finished
+                if status != "success":
+                    raise PromptFailed(f"Prompt {prompt_id} {status}: {details or ''}".strip())
+                completed = True
+
+            # Either the socket reported completion, the socket is down, or it
+            # (re)connected and we may have missed the message: ask /history.
+            try:
+                outputs = self.fetch_history(prompt_id)
+            except requests.exceptions.RequestException as e:
+                logger.warning("Error while fetching history: %s", e)
+                outputs = None
+            if outputs is not None:
+                return outputs
+
+            seen_generation = generation
+            if completed:
+                # ComfyUI can announce completion just before the history entry is stored
+                time.sleep(min(0.1, max(deadline - time.monotonic(), 0)))
+            elif not connected:
+                with self._cond:
+                    self._cond.wait(min(self.poll_interval, max(deadline - time.monotonic(), 0)))
+
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+def get_listener(base_url):
+    with _listeners_lock:
+        listener = _listeners.get(base_url)
+        if listener is None:
+            listener = _listeners[base_url] = CompletionListener(base_url)
+    return listener.start()
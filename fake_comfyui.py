@@ -0,0 +1,562 @@
+# Fake ComfyUI server for local testing.
+#
+# Speaks enough of the ComfyUI HTTP API (/upload/image, /prompt, /history,
+# /view, /queue, /system_stats, /object_info) and the /ws event stream to exercise the API scripts without a GPU.
+# Every queued prompt "runs" for --exec-time seconds and echoes the first
+# uploaded LoadImage input back as the image of every output node.
+#
+# With --load-time, a node whose model file is not resident first "loads" it
+# for that long. At most --max-models models stay resident (least recently
+# used ones are unloaded), and nodes with cache_model false unload theirs
+# after running, like the real segmentation node.
+#
+# Nodes with an integer "steps" input (samplers, CatVTON) send a "progress"
+# message per step, and with --previews a PNG preview frame too, as ComfyUI
+# does with --preview-method. A "status" message with queue_remaining goes to
+# every client whenever the queue changes. POST /queue {"delete": [...]}
+# drops pending prompts and POST /interrupt stops the running one (between
+# nodes or steps) with an "execution_interrupted" message.
+#
+# /prompt is validated against /object_info like ComfyUI does: an unknown
+# node class or a value outside an input's list of choices (e.g. a model
+# file) answers 400 with "error" and "node_errors".
+#
+# POST /v1/traces is a stub OTLP/JSON trace collector: received spans are kept
+# in .spans (TRACE_ENDPOINT=http://127.0.0.1:8188/v1/traces).
+#
+#   python fake_comfyui.py --port 8188 --exec-time 2
+
+import argparse
+import base64
+import hashlib
+import json
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs, unquote
+
+from backends import MODEL_INPUTS
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+OUTPUT_CLASS_TYPES = ("PreviewImage", "SaveImage", "LayerMask: MaskPreview")
+
+# 1x1 transparent PNG, used when a prompt has no uploaded input to echo back
+BLANK_PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg=="
+)
+
+# Node classes and model files this fake "has installed", in /object_info format
+DEFAULT_OBJECT_INFO = {
+    "LoadImage": {"input": {"required": {"image": [[]]}}},
+    "LoadImageMask": {"input": {"required": {"image": [[]], "channel": [["alpha", "red", "green", "blue"]]}}},
+    "PreviewImage": {"input": {"required": {"images": ["IMAGE"]}}},
+    "SaveImage": {"input": {"required": {"images": ["IMAGE"]}}},
+    "ImageScaleBy": {"input": {"required": {
+        "image": ["IMAGE"],
+        "upscale_method": [["nearest-exact", "bilinear", "area", "bicubic", "lanczos"]],
+        "scale_by": ["FLOAT"],
+    }}},
+    "ImageUpscaleWithModel": {"input": {"required": {"upscale_model": ["UPSCALE_MODEL"], "image": ["IMAGE"]}}},
+    "UpscaleModelLoader": {"input": {"required": {"model_name": [["RealESRGAN_x2.pth", "RealESRGAN_x4.pth"]]}}},
+    "CheckpointLoaderSimple": {"input": {"required": {"ckpt_name": [["FLUX1\\flux1-dev-fp8.safetensors"]]}}},
+    "CLIPTextEncodeFlux": {"input": {"required": {"clip": ["CLIP"], "clip_l": ["STRING"], "t5xxl": ["STRING"]}}},
+    "UltimateSDUpscale": {"input": {"required": {"image": ["IMAGE"], "model": ["MODEL"], "upscale_by": ["FLOAT"]}}},
+    "CatVTONWrapper": {"input": {"required": {"image": ["IMAGE"], "mask": ["MASK"], "refer_image": ["IMAGE"]}}},
+    "LayerMask: MaskPreview": {"input": {"required": {"mask": ["MASK"]}}},
+    "LayerMask: SegmentAnythingUltra V2": {"input": {"required": {
+        "image": ["IMAGE"],
+        "sam_model": [["sam_vit_h (2.56GB)", "sam_vit_b (375MB)"]],
+        "grounding_dino_model": [["GroundingDINO_SwinT_OGC (694MB)"]],
+    }}},
+}
+
+
+class WebSocketConnection:
+    def __init__(self, sock, rfile, wfile):
+        self.sock = sock
+        self.rfile = rfile
+        self.wfile = wfile
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def send(self, payload, opcode=0x1):
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+        header = bytes([0x80 | opcode])
+        length = len(payload)
+        if length < 126:
+            header += bytes([length])
+        elif length < 65536:
+            header += bytes([126]) + struct.pack("!H", length)
+        else:
+            header += bytes([127]) + struct.pack("!Q", length)
+        with self.lock:
+            if self.closed:
+                return False
+            try:
+                self.wfile.write(header + payload)
+                self.wfile.flush()
+                return True
+            except (OSError, ValueError):
+                self.closed = True
+                return False
+
+    def send_json(self, message):
+        return self.send(json.dumps(message))
+
+    def read_frame(self):
+        head = self.rfile.read(2)
+        if len(head) < 2:
+            return None, None
+        opcode = head[0] & 0x0F
+        length = head[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if head[1] & 0x80 else b"\x00\x00\x00\x00"
+        data = bytearray(self.rfile.read(length))
+        for i in range(len(data)):
+            data[i] ^= mask[i % 4]
+        return opcode, bytes(data)
+
+    def close(self):
+        self.send(b"", opcode=0x8)
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+class FakeComfyUI:
+    def __init__(self, host="127.0.0.1", port=0, exec_time=1.0, object_info=None, upload_time=0.0, view_time=0.0,
+                 load_time=0.0, max_models=0, upload_bandwidth=0, previews=False):
+        self.exec_time = exec_time
+        self.previews = previews
+        self.upload_time = upload_time
+        self.upload_bandwidth = upload_bandwidth  # bytes/s for /upload/image bodies, 0: unlimited
+        self.view_time = view_time
+        self.load_time = load_time
+        self.max_models = max_models
+        self.resident = OrderedDict()  # model file -> None, least recently used first
+        self.model_loads = 0
+        self.object_info = DEFAULT_OBJECT_INFO if object_info is None else object_info
+        self.pending = []
+        self.running = None
+        self.deleted = set()
+        self.interrupted = None
+        self.uploads = {}
+        self.uploaded_bytes = 0
+        self.history = {}
+        self.prompts = {}
+        self.spans = []
+        self.clients = {}
+        self.connections = set()
+        self.request_counts = {}
+        self.lock = threading.Lock()
+        self.work_queue = queue.Queue()
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self._threads = []
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        for target in (self.server.serve_forever, self._worker):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        with self.lock:
+            clients = [c for conns in self.clients.values() for c in conns]
+            connections = list(self.connections)
+        for conn in clients:
+            conn.close()
+        # Keep-alive connections would otherwise keep being served after shutdown
+        for sock in connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.work_queue.put(None)
+
+    def drop_websockets(self):
+        with self.lock:
+            clients = [c for conns in self.clients.values() for c in conns]
+        for conn in clients:
+            conn.close()
+
+    def count(self, path):
+        with self.lock:
+            self.request_counts[path] = self.request_counts.get(path, 0) + 1
+
+    def validate(self, prompt):
+        # ComfyUI's /prompt error body for an invalid prompt, or None
+        node_errors = {}
+        for node_id, node in prompt.items():
+            info = self.object_info.get(node.get("class_type"))
+            if info is None:
+                return {"error": {"type": "invalid_prompt", "details": f"Node ID '#{node_id}'", "extra_info": {},
+                                  "message": f"Cannot execute because node {node.get('class_type')} does not exist."},
+                        "node_errors": {}}
+            for input_name, spec in info.get("input", {}).get("required", {}).items():
+                value = node.get("inputs", {}).get(input_name)
+                choices = spec[0] if spec and isinstance(spec[0], list) else None
+                if choices and isinstance(value, str) and value not in choices:
+                    node_errors.setdefault(node_id, {"errors": [], "dependent_outputs": [],
+                                                     "class_type": node["class_type"]})["errors"].append({
+                        "type": "value_not_in_list", "message": "Value not in list",
+                        "details": f"{input_name}: '{value}' not in {choices}",
+                        "extra_info": {"input_name": input_name},
+                    })
+        if node_errors:
+            return {"error": {"type": "prompt_outputs_failed_validation", "message": "Prompt outputs failed validation",
+                              "details": "", "extra_info": {}}, "node_errors": node_errors}
+        return None
+
+    def broadcast(self, client_id, message):
+        with self.lock:
+            targets = list(self.clients.get(client_id, []))
+        for conn in targets:
+            if isinstance(message, bytes):
+                conn.send(message, opcode=0x2)
+            else:
+                conn.send_json(message)
+
+    def broadcast_status(self):
+        with self.lock:
+            targets = [c for conns in self.clients.values() for c in conns]
+            remaining = len(self.pending) + (1 if self.running else 0)
+        for conn in targets:
+            conn.send_json({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": remaining}}}})
+
+    def _worker(self):
+        while True:
+            prompt_id = self.work_queue.get()
+            if prompt_id is None:
+                return
+            with self.lock:
+                if prompt_id in self.deleted:
+                    self.deleted.discard(prompt_id)
+                    continue
+                self.pending.remove(prompt_id)
+                self.running = prompt_id
+            self.broadcast_status()
+            try:
+                self._execute(prompt_id)
+            finally:
+                with self.lock:
+                    self.running = None
+                self.broadcast_status()
+
+    def _execute(self, prompt_id):
+        with self.lock:
+            entry = self.prompts[prompt_id]
+        graph = entry["prompt"]
+        client_id = entry["client_id"]
+        self.broadcast(client_id, {"type": "execution_start", "data": {"prompt_id": prompt_id}})
+
+        source_image = None
+        for node in graph.values():
+            if node.get("class_type") == "LoadImage":
+                source_image = self.uploads.get(node["inputs"].get("image"))
+                if source_image is not None:
+                    break
+        if source_image is None:
+            source_image = BLANK_PNG
+
+        step = self.exec_time / max(len(graph), 1)
+        outputs = {}
+        for node_id, node in graph.items():
+            if self._interrupt(prompt_id, client_id, node_id):
+                return
+            self.broadcast(client_id, {"type": "executing", "data": {"node": node_id, "prompt_id": prompt_id}})
+            models = [v for k, v in node.get("inputs", {}).items() if k in MODEL_INPUTS and isinstance(v, str)]
+            for model in models:
+                self._load_model(model)
+            steps = node.get("inputs", {}).get("steps")
+            if isinstance(steps, int) and steps > 0:
+                for i in range(1, steps + 1):
+                    time.sleep(step / steps)
+                    if self._interrupt(prompt_id, client_id, node_id):
+                        return
+                    self.broadcast(client_id, {"type": "progress", "data": {
+                        "value": i, "max": steps, "prompt_id": prompt_id, "node": node_id}})
+                    if self.previews:
+                        # Binary frame: event type 1 (preview image), image type 2 (PNG), image
+                        self.broadcast(client_id, struct.pack(">II", 1, 2) + BLANK_PNG)
+            else:
+                time.sleep(step)
+            if node.get("inputs", {}).get("cache_model") is False:
+                for model in models:
+                    self.resident.pop(model, None)
+            if node.get("class_type") in OUTPUT_CLASS_TYPES:
+                filename = f"ComfyUI_temp_{prompt_id[:5]}_{node_id}_.png"
+                with self.lock:
+                    self.uploads[filename] = source_image
+                output = {"images": [{"filename": filename, "subfolder": "", "type": "temp"}]}
+                outputs[node_id] = output
+                self.broadcast(client_id, {"type": "executed", "data": {"node": node_id, "output": output, "prompt_id": prompt_id}})
+
+        with self.lock:
+            self.history[prompt_id] = {
+                "prompt": [entry["number"], prompt_id, graph, {"client_id": client_id}, list(outputs)],
+                "outputs": outputs,
+                "status": {"status_str": "success", "completed": True, "messages": []},
+            }
+        self.broadcast(client_id, {"type": "executing", "data": {"node": None, "prompt_id": prompt_id}})
+        self.broadcast(client_id, {"type": "execution_success", "data": {"prompt_id": prompt_id}})
+
+    def _interrupt(self, prompt_id, client_id, node_id):
+        with self.lock:
+            if self.interrupted != prompt_id:
+                return False
+            self.interrupted = None
+            self.history[prompt_id] = {
+                "prompt": [self.prompts[prompt_id]["number"], prompt_id, self.prompts[prompt_id]["prompt"], {}, []],
+                "outputs": {},
+                "status": {"status_str": "error", "completed": False,
+                           "messages": [["execution_interrupted", {"prompt_id": prompt_id, "node_id": node_id}]]},
+            }
+        self.broadcast(client_id, {"type": "execution_interrupted", "data": {"prompt_id": prompt_id, "node_id": node_id}})
+        return True
+
+    def _load_model(self, model):
+        if model in self.resident:
+            self.resident.move_to_end(model)
+            return
+        time.sleep(self.load_time)
+        self.model_loads += 1
+        self.resident[model] = None
+        while self.max_models and len(self.resident) > self.max_models:
+            self.resident.popitem(last=False)
+
+    def _make_handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def setup(self):
+                super().setup()
+                with fake.lock:
+                    fake.connections.add(self.connection)
+
+            def finish(self):
+                with fake.lock:
+                    fake.connections.discard(self.connection)
+                super().finish()
+
+            def send_json(self, payload, status=200):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def send_bytes(self, body, content_type="image/png", status=200):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def read_body(self):
+                length = int(self.headers.get("Content-Length", 0))
+                return self.rfile.read(length) if length else b""
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                fake.count(parsed.path.rstrip("/").rsplit("/", 1)[0] if parsed.path.startswith("/history/") else parsed.path)
+
+                if parsed.path == "/ws":
+                    return self.handle_websocket(params.get("clientId", ""))
+                if parsed.path.startswith("/history/"):
+                    prompt_id = parsed.path[len("/history/"):]
+                    with fake.lock:
+                        entry = fake.history.get(prompt_id)
+                    return self.send_json({prompt_id: entry} if entry else {})
+                if parsed.path == "/view":
+                    time.sleep(fake.view_time)
+                    with fake.lock:
+                        data = fake.uploads.get(params.get("filename"))
+                    if data is None:
+                        return self.send_bytes(b"Not Found", "text/plain", 404)
+                    return self.send_bytes(data)
+                if parsed.path == "/queue":
+                    with fake.lock:
+                        queue_running = [[fake.prompts[fake.running]["number"], fake.running]] if fake.running else []
+                        queue_pending = [[fake.prompts[p]["number"], p] for p in fake.pending]
+                    return self.send_json({"queue_running": queue_running, "queue_pending": queue_pending})
+                if parsed.path == "/system_stats":
+                    return self.send_json({
+                        "system": {"os": "fake", "python_version": "", "embedded_python": False},
+                        "devices": [{"name": "fake", "type": "cpu", "vram_total": 0, "vram_free": 0}],
+                    })
+                if parsed.path == "/object_info":
+                    return self.send_json(fake.object_info)
+                if parsed.path.startswith("/object_info/"):
+                    class_type = unquote(parsed.path[len("/object_info/"):])
+                    info = fake.object_info.get(class_type)
+                    return self.send_json({class_type: info} if info else {})
+                self.send_bytes(b"Not Found", "text/plain", 404)
+
+            def do_HEAD(self):
+                parsed = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                fake.count("HEAD " + parsed.path)
+                with fake.lock:
+                    data = fake.uploads.get(params.get("filename")) if parsed.path == "/view" else None
+                self.send_response(200 if data is not None else 404)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(data)) if data is not None else "0")
+                self.end_headers()
+
+            def do_POST(self):
+                parsed = urlparse(self.path)
+                fake.count(parsed.path)
+                body = self.read_body()
+
+                if parsed.path == "/upload/image":
+                    time.sleep(fake.upload_time + (len(body) / fake.upload_bandwidth if fake.upload_bandwidth else 0))
+                    filename, data = parse_multipart_image(self.headers.get("Content-Type", ""), body)
+                    if filename is None:
+                        return self.send_json({"error": "no image"}, 400)
+                    with fake.lock:
+                        fake.uploads[filename] = data
+                        fake.uploaded_bytes += len(data)
+                    return self.send_json({"name": filename, "subfolder": "", "type": "input"})
+                if parsed.path == "/prompt":
+                    payload = json.loads(body or b"{}")
+                    error = fake.validate(payload.get("prompt", {}))
+                    if error is not None:
+                        return self.send_json(error, 400)
+                    prompt_id = str(uuid.uuid4())
+                    with fake.lock:
+                        number = len(fake.prompts)
+                        fake.prompts[prompt_id] = {
+                            "prompt": payload.get("prompt", {}),
+                            "client_id": payload.get("client_id", ""),
+                            "number": number,
+                        }
+                        fake.pending.append(prompt_id)
+                    fake.work_queue.put(prompt_id)
+                    fake.broadcast_status()
+                    return self.send_json({"prompt_id": prompt_id, "number": number, "node_errors": {}})
+                if parsed.path == "/queue":
+                    payload = json.loads(body or b"{}")
+                    with fake.lock:
+                        for prompt_id in payload.get("delete", []):
+                            if prompt_id in fake.pending:
+                                fake.pending.remove(prompt_id)
+                                fake.deleted.add(prompt_id)
+                    fake.broadcast_status()
+                    return self.send_json({})
+                if parsed.path == "/interrupt":
+                    payload = json.loads(body or b"{}")
+                    with fake.lock:
+                        if fake.running and payload.get("prompt_id") in (None, fake.running):
+                            fake.interrupted = fake.running
+                    return self.send_json({})
+                if parsed.path == "/v1/traces":
+                    payload = json.loads(body or b"{}")
+                    with fake.lock:
+                        for resource in payload.get("resourceSpans", []):
+                            for scope in resource.get("scopeSpans", []):
+                                fake.spans.extend(scope.get("spans", []))
+                    return self.send_json({})
+                self.send_bytes(b"Not Found", "text/plain", 404)
+
+            def handle_websocket(self, client_id):
+                key = self.headers.get("Sec-WebSocket-Key")
+                if not key:
+                    return self.send_bytes(b"Expected WebSocket upgrade", "text/plain", 400)
+                accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+                self.send_response(101, "Switching Protocols")
+                self.send_header("Upgrade", "websocket")
+                self.send_header("Connection", "Upgrade")
+                self.send_header("Sec-WebSocket-Accept", accept)
+                self.end_headers()
+                self.wfile.flush()
+
+                conn = WebSocketConnection(self.connection, self.rfile, self.wfile)
+                with fake.lock:
+                    fake.clients.setdefault(client_id, []).append(conn)
+                conn.send_json({"type": "status", "data": {"status": {"exec_info": {"queue_remaining": fake.work_queue.qsize()}}, "sid": client_id}})
+                try:
+                    while not conn.closed:
+                        opcode, data = conn.read_frame()
+                        if opcode is None or opcode == 0x8:
+                            break
+                        if opcode == 0x9:
+                            conn.send(data, opcode=0xA)
+                except (OSError, ValueError):
+                    pass
+                finally:
+                    conn.closed = True
+                    with fake.lock:
+                        fake.clients.get(client_id, []).remove(conn)
+                    self.close_connection = True
+
+        return Handler
+
+
+def parse_multipart_image(content_type, body):
+    if "boundary=" not in content_type:
+        return None, None
+    boundary = content_type.split("boundary=", 1)[1].strip('"').encode()
+    for part in body.split(b"--" + boundary):
+        if b"\r\n\r\n" not in part:
+            continue
+        headers, data = part.split(b"\r\n\r\n", 1)
+        if b'name="image"' not in headers:
+            continue
+        filename = None
+        for line in headers.split(b"\r\n"):
+            if b"filename=" in line:
+                filename = line.split(b"filename=", 1)[1].split(b";")[0].strip().strip(b'"').decode()
+        return os.path.basename(filename or "image.png"), data[:-2] if data.endswith(b"\r\n") else data
+    return None, None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Fake ComfyUI server for local testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    parser.add_argument("--exec-time", type=float, default=1.0)
+    parser.add_argument("--upload-time", type=float, default=0.0)
+    parser.add_argument("--view-time", type=float, default=0.0)
+    parser.add_argument("--load-time", type=float, default=0.0)
+    parser.add_argument("--max-models", type=int, default=0)
+    parser.add_argument("--upload-mbps", type=float, default=0, help="simulated upload bandwidth, Mbit/s")
+    parser.add_argument("--previews", action="store_true", help="send preview frames with step progress")
+    args = parser.parse_args()
+
+    fake = FakeComfyUI(args.host, args.port, args.exec_time, upload_time=args.upload_time, view_time=args.view_time,
+                       load_time=args.load_time, max_models=args.max_models,
+                       upload_bandwidth=args.upload_mbps * 125000, previews=args.previews).start()
+    print(f"Fake ComfyUI listening on {fake.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
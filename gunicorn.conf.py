@@ -0,0 +1,48 @@
+# gunicorn settings for serve.py (Linux):
+#
+#   gunicorn -c gunicorn.conf.py
+#
+# Serves API_APP (default "serve:create_app()") from WORKERS processes
+# (default 1, see serve.py for why) with THREADS threads each, bound to
+# HOST:PORT.
+#
+# On SIGTERM a worker keeps serving while it drains: new jobs get 503 and
+# GET /healthz reports draining, while job status and result requests are
+# still answered. Once its jobs are done, or after SHUTDOWN_TIMEOUT, it
+# stops like gunicorn's own handler would, finishing the open requests.
+# graceful_timeout leaves room for that before gunicorn kills the worker.
+
+import math
+import os
+import signal
+import threading
+
+import serve
+
+wsgi_app = os.environ.get("API_APP", "serve:create_app()")
+bind = f"{serve.HOST}:{serve.PORT}"
+# Jobs live in the memory of the worker that took them: more than one worker needs clients
+# (or a load balancer) to send a job's status and result requests back to the same one
+workers = int(os.environ.get("WORKERS", 1))
+worker_class = "gthread"
+threads = serve.THREADS
+graceful_timeout = math.ceil(serve.SHUTDOWN_TIMEOUT) + 30  # drain, then the last responses
+timeout = 300  # blocking endpoints wait for ComfyUI
+
+
+def post_worker_init(worker):
+    # Replace the worker's SIGTERM handler, which stops serving at once, with a drain of the
+    # app it serves (worker.wsgi) that stops the worker when done
+    stopping = threading.Event()
+
+    def drain_and_stop():
+        serve.drain(worker.wsgi)
+        worker.alive = False
+
+    def handle_term(signum, frame):
+        if not stopping.is_set():
+            stopping.set()
+            worker.log.info("Draining in-flight jobs (up to %.0fs)", serve.SHUTDOWN_TIMEOUT)
+            threading.Thread(target=drain_and_stop, name="shutdown", daemon=True).start()
+
+    signal.signal(signal.SIGTERM, handle_term)
@@ -0,0 +1,121 @@
+# Server-Sent Events for a job: GET /jobs/<job_id>/events.
+#
+# Forwards what ComfyUI reports about the job's prompt while it runs, so a
+# frontend can show progress (and give up early) instead of waiting for the
+# result blind:
+#
+#   status     the job status (first event, and whenever it changes, e.g.
+#              from "waiting" in the scheduler to "queued" in ComfyUI)
+#   queue      {"position": n}, n-th in ComfyUI's queue, 0 once running
+#   started    ComfyUI started executing the prompt
+#   cached     {"nodes": [...]} served from ComfyUI's cache
+#   executing  {"node", "class_type"} the node running now
+#   progress   {"node", "class_type", "value", "max"}, e.g. sampler steps
+#   preview    {"node", "mimetype", "image"} base64 latent preview, only
+#              when ComfyUI runs with --preview-method
+#   done       the final job status with "result_url"; the stream ends
+#
+# Each stream holds a server thread until the job finishes. A client that
+# reads too slowly misses progress and preview events rather than buffering
+# them in memory (EVENT_BUFFER_SIZE); the status and done events always come.
+
+import base64
+import json
+import queue
+
+from flask import Response
+
+from comfy_completion import get_listener
+
+EVENT_BUFFER_SIZE = 64
+KEEPALIVE_SECONDS = 15
+WAITING_POLL_SECONDS = 0.5
+
+EVENT_NAMES = {"execution_start": "started", "execution_cached": "cached"}
+
+
+def _format(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def event_stream(job, result_url):
+    events = queue.Queue()
+
+    def forward(event, data):
+        # Runs on the listener's socket thread
+        if events.qsize() < EVENT_BUFFER_SIZE:
+            events.put((event, data))
+
+    def node_event(node_id, **fields):
+        return {"node": node_id, "class_type": job.node_classes.get(node_id), **fields}
+
+    def generate():
+        job.add_done_callback(lambda job: events.put(("done", None)))
+        status = job.status
+        yield _format("status", job.to_dict())
+        # Held back in the scheduler: there is no prompt to follow in ComfyUI yet
+        idle = 0
+        while job.backend and job.prompt_id is None and not job.done.wait(WAITING_POLL_SECONDS):
+            idle += WAITING_POLL_SECONDS
+            if idle >= KEEPALIVE_SECONDS:
+                idle = 0
+                yield ": keepalive\n\n"
+        listener = get_listener(job.backend) if job.backend and job.prompt_id else None
+        if listener is not None:
+            listener.subscribe(job.prompt_id, forward)
+        try:
+            if job.status != status and not job.done.is_set():
+                status = job.status
+                yield _format("status", job.to_dict())
+            started = listener is None or listener.prompt_times(job.prompt_id)[0] is not None
+            node_id = listener.executing(job.prompt_id) if listener is not None else None
+            if node_id is not None:
+                yield _format("executing", node_event(node_id))
+            position = None
+            check_queue = not started
+            while True:
+                if check_queue and not job.done.is_set():
+                    check_queue = False
+                    new_position = listener.queue_position(job.prompt_id)
+                    if new_position is not None and new_position != position and not started:
+                        position = new_position
+                        yield _format("queue", {"position": position})
+                try:
+                    event, data = events.get(timeout=KEEPALIVE_SECONDS)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    check_queue = not started
+                    continue
+                if job.status != status and event != "done":
+                    status = job.status
+                    yield _format("status", job.to_dict())
+                if event == "done":
+                    break
+                if event == "queue":
+                    check_queue = not started
+                    continue
+                if event == "execution_start":
+                    started = True
+                    if position != 0:
+                        position = 0
+                        yield _format("queue", {"position": 0})
+                    data = {}
+                elif event == "execution_cached":
+                    data = {"nodes": data.get("nodes") or []}
+                elif event == "executing":
+                    if data.get("node") is None:
+                        continue  # the prompt finished; done follows once the outputs are collected
+                    data = node_event(data["node"])
+                elif event == "progress":
+                    data = node_event(data.get("node"), value=data.get("value"), max=data.get("max"))
+                elif event == "preview":
+                    data = {"node": data["node"], "mimetype": data["mimetype"],
+                            "image": base64.b64encode(data["image"]).decode('utf-8')}
+                yield _format(EVENT_NAMES.get(event, event), data)
+            yield _format("done", {**job.to_dict(), "result_url": result_url})
+        finally:
+            if listener is not None:
+                listener.unsubscribe(job.prompt_id, forward)
+
+    return Response(generate(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
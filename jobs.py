@@ -0,0 +1,882 @@
+# Asynchronous job API.
+#
+# POST /jobs/<pipeline> uploads the inputs and returns a job id straight away.
+# The job waits for its turn, is queued in ComfyUI and awaited in the
+# background, so no Flask worker is held while the GPU runs:
+#
+#   GET /jobs/<job_id>          -> job status
+#   GET /jobs/<job_id>/result   -> 202 while pending, then the pipeline's response
+#   GET /jobs/<job_id>/events   -> Server-Sent Events: queue position, node,
+#                                  step progress and previews (job_events.py)
+#   DELETE /jobs/<job_id>       -> cancel the job
+#
+# A job given up on is cancelled in ComfyUI too, so it stops taking GPU time:
+# its prompt is deleted from ComfyUI's queue, or interrupted if it is
+# already running. That happens on DELETE /jobs/<job_id>, when the client of
+# a blocking endpoint disconnects (detected under gunicorn and the Flask dev
+# server from the socket, and under waitress when serve.py runs it with
+# channel_request_lookahead; other servers do not tell), and when the job
+# is not done by its deadline (X-Deadline, default the pipeline's
+# max_wait_time, from arrival; for the jobs of a batch, from when the
+# scheduler lets each through), which answers 504. A cancelled job finishes
+# as "cancelled" with status 410. GPU time spent on prompts whose result is
+# not delivered is counted in comfyui_api_wasted_gpu_seconds_total.
+#
+# The original blocking endpoints are thin wrappers: submit, then wait for the
+# job to finish in the request thread.
+#
+# Result responses are content-negotiated: base64 JSON by default,
+# "Accept: image/png" for the primary output image as raw bytes, and
+# "Accept: multipart/mixed" for every output image in one response. For the
+# blocking endpoints the raw formats skip the base64 collect step and stream
+# straight from ComfyUI /view (see streaming.py); ?stream=1 does the same on
+# POST /jobs/<pipeline>.
+#
+# Time spent in each stage of a job (upload, queue, wait, collect, ...) is
+# reported in a Server-Timing header and under "timings" in the job status,
+# and observed in the per-stage histograms served at /metrics (metrics.py).
+# The wait is also broken down from ComfyUI's events into comfyui_queue,
+# execute and history. When tracing is on (tracing.py), each job is a span
+# of its request, with a span per stage and per executed ComfyUI node.
+#
+# Admitted jobs ("waiting") wait in the scheduler (scheduler.py) by priority
+# and model group before their prompt goes to ComfyUI, instead of piling up
+# there; a job still waiting at its deadline fails with 504. The priority
+# class comes from the X-Priority header (interactive, normal, batch; default
+# per pipeline). A request is rejected with 429 and Retry-After when its
+# client already has MAX_JOBS_PER_CLIENT requests in progress (a batch counts
+# once; client from X-Client-Id, else the remote address), or when the
+# estimated wait of its (first) job exceeds its deadline (X-Deadline seconds,
+# default the pipeline's max_wait_time).
+#
+# drain() (see serve.py) stops admitting jobs, answering 503 instead, and
+# waits for the unfinished ones; GET /healthz reports 503 while draining.
+
+import json
+import logging
+import math
+import os
+import queue
+import select
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import requests
+from flask import Response, jsonify, request, url_for
+
+from backends import BackendPool, NoBackendAvailable
+from comfy_completion import get_listener, PromptFailed
+from comfy_client import add_prompt_listener, get_client
+from job_events import event_stream
+import logs
+from metrics import CANCELLED_PROMPTS, JOBS, STAGE_SECONDS, TIMEOUTS, WASTED_GPU_SECONDS
+from result_cache import get_result_cache
+from scheduler import PRIORITIES, ModelScheduler, model_group
+from streaming import SAVE_OUTPUTS, StreamPart, parts_from_payload, stream_response
+import tracing
+
+JOB_RETENTION_SECONDS = 3600
+MAX_WAITER_THREADS = 64  # for jobs the scheduler let through: queuing, awaiting and collecting them
+MAX_JOBS_PER_CLIENT = int(os.environ.get("MAX_JOBS_PER_CLIENT", 16))  # 0 for no limit
+DISCONNECT_CHECK_INTERVAL = 1.0
+CANCEL_WAIT_SECONDS = 5
+
+logger = logging.getLogger(__name__)
+
+
+_current = threading.local()
+
+
+@contextmanager
+def stage(name):
+    # Record the duration of a block against the job being submitted or collected in this thread
+    job = getattr(_current, "job", None)
+    start = time.perf_counter()
+    start_ns = time.time_ns()
+    try:
+        yield
+    finally:
+        if job is not None:
+            job.add_timing(name, time.perf_counter() - start)
+            tracing.record(job.span, name, start_ns, time.time_ns())
+
+
+@contextmanager
+def current_job(job):
+    previous = getattr(_current, "job", None)
+    _current.job = job
+    try:
+        yield
+    finally:
+        _current.job = previous
+
+
+def _log_context():
+    job = getattr(_current, "job", None)
+    if job is None:
+        return {}
+    return {
+        "request_id": job.request_id,
+        "job_id": job.id,
+        "prompt_id": job.prompt_id,
+        "pipeline": job.pipeline,
+        "trace_id": job.span.trace_id if job.span is not None else None,
+    }
+
+
+def _prompt_queued(base_url, prompt_id, prompt, sent):
+    # When the prompt reached ComfyUI's queue, and node class names for the per-node spans and events
+    job = getattr(_current, "job", None)
+    if job is None:
+        return
+    job.queued_at = sent
+    job.node_classes = {node_id: node.get("class_type") for node_id, node in prompt.items()}
+
+
+logs.add_context_provider(_log_context)
+add_prompt_listener(_prompt_queued)
+
+
+def client_socket():
+    # The request's socket where the server exposes it (gunicorn, the Flask dev server), else
+    # waitress's client_disconnected() check, which needs channel_request_lookahead > 0 (serve.py)
+    environ = request.environ
+    return (environ.get("gunicorn.socket") or environ.get("werkzeug.socket")
+            or environ.get("waitress.client_disconnected"))
+
+
+def client_disconnected(sock):
+    # True once the client closed the connection; a pipelined next request still counts as connected
+    if sock is None:
+        return False
+    if callable(sock):
+        return sock()
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except ValueError:  # TLS sockets cannot peek
+        return False
+    except OSError:
+        return True
+
+
+class JobError(Exception):
+    def __init__(self, error, status=500, **extra):
+        super().__init__(error)
+        self.status = status
+        self.payload = {"error": error, **extra}
+
+
+class CachedResult:
+    # Returned by a pipeline's submit() when the response is already in the result cache
+    def __init__(self, payload):
+        self.payload = payload
+
+
+class PendingPrompt:
+    # Returned by a pipeline's submit() once the inputs are on the backend. When the job's turn
+    # comes, build(keep_models) gives the graph to queue; keep_models is True when more jobs for
+    # the same models are queued or waiting, i.e. when keeping them loaded (cache_model) pays off.
+    def __init__(self, build, context):
+        self.build = build
+        self.context = context
+
+
+class Job:
+    def __init__(self, pipeline, stream=False):
+        self.id = uuid.uuid4().hex
+        self.request_id = logs.request_id()
+        self.pipeline = pipeline
+        self.stream = stream
+        self.status = "submitting"
+        self.prompt_id = None
+        self.backend = None
+        self.created_at = time.time()
+        self.arrived = time.monotonic()
+        self.queued_at = None  # time.monotonic() once the prompt is in ComfyUI
+        self.finished_at = None
+        self.result = None
+        self.http_status = None
+        self.cached = False
+        self.outputs = None
+        self.context = None
+        self.timings = {}
+        self.batch_size = 1
+        self.priority = PRIORITIES["normal"]
+        self.client = None
+        self.retry_after = None
+        self.ticket = None
+        self.deadline = None  # time.monotonic() by which the job must be done
+        self.timeout = None  # seconds from its turn in the scheduler, for batch jobs (deadline None till then)
+        self.cancel_reason = None
+        parent = tracing.current_span()
+        self.span = parent.child(f"job {pipeline}", **{"job.id": self.id}) if parent is not None else None
+        self.node_classes = {}
+        self._lock = threading.Lock()
+        self._collect_lock = threading.Lock()  # one request at a time collects a ?stream=1 job's outputs
+        self._callbacks = []
+        self.done = threading.Event()
+
+    def add_timing(self, name, seconds):
+        with self._lock:
+            self.timings[name] = self.timings.get(name, 0) + seconds
+        STAGE_SECONDS.observe(seconds, endpoint=self.pipeline, stage=name, backend=self.backend or "")
+
+    def server_timing(self):
+        with self._lock:
+            return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.timings.items())
+
+    def finish(self, status, result, http_status):
+        self.status = status
+        self.result = result
+        self.http_status = http_status
+        self.finished_at = time.time()
+        JOBS.inc(endpoint=self.pipeline, status=status, code=http_status)
+        if self.span is not None:
+            self.span.set_attribute("job.status", status)
+            self.span.set_attribute("http.status_code", http_status)
+            self.span.set_attribute("comfyui.prompt_id", self.prompt_id)
+            if status == "failed":
+                self.span.set_error((result or {}).get("error"))
+            self.span.end()
+        with self._lock:
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def request_cancel(self, reason):
+        # For the first request: "waiting" while the job is held back in the scheduler, "queued"
+        # while its prompt is in ComfyUI (and has to be stopped there); None when too late
+        with self._lock:
+            if self.status not in ("waiting", "queued") or self.cancel_reason is not None:
+                return None
+            self.cancel_reason = reason
+            return self.status
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def to_dict(self):
+        info = {
+            "job_id": self.id,
+            "pipeline": self.pipeline,
+            "status": self.status,
+            "prompt_id": self.prompt_id,
+            "backend": self.backend,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "cached": self.cached,
+            "timings": {name: round(seconds * 1000, 1) for name, seconds in dict(self.timings).items()},
+        }
+        if self.status in ("failed", "cancelled"):
+            info["error"] = (self.result or {}).get("error")
+        if self.cancel_reason is not None:
+            info["cancel_reason"] = self.cancel_reason
+        if self.retry_after is not None:
+            info["retry_after"] = self.retry_after
+        return info
+
+
+class Pipeline:
+    def __init__(self, name, submit, collect, max_wait_time, outputs=None, save_name=None, requirements=None,
+                 priority="normal"):
+        self.name = name
+        self.priority = priority
+        self.requirements = requirements or []
+        self.submit = submit
+        self.collect = collect
+        self.max_wait_time = max_wait_time
+        self.outputs = outputs or []
+        self.save_name = save_name
+
+
+class JobManager:
+    def __init__(self, app, comfyui_urls):
+        self.app = app
+        self.backends = BackendPool(comfyui_urls)
+        self.scheduler = ModelScheduler()
+        self.pipelines = {}
+        self._jobs = {}
+        self._client_jobs = {}  # client -> requests (a batch counts once) with unfinished jobs
+        self._active_jobs = 0
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self.draining = False
+        app.extensions["job_manager"] = self
+        self._executor = ThreadPoolExecutor(max_workers=MAX_WAITER_THREADS, thread_name_prefix="job-waiter")
+
+        app.add_url_rule('/jobs/<job_id>', 'job_status', self.job_status_view, methods=['GET'])
+        app.add_url_rule('/jobs/<job_id>', 'job_cancel', self.job_cancel_view, methods=['DELETE'])
+        app.add_url_rule('/jobs/<job_id>/result', 'job_result', self.job_result_view, methods=['GET'])
+        app.add_url_rule('/jobs/<job_id>/events', 'job_events', self.job_events_view, methods=['GET'])
+        app.add_url_rule('/comfyui/backends', 'comfyui_backends', lambda: jsonify(self.backends.status()), methods=['GET'])
+        app.add_url_rule('/comfyui/scheduler', 'comfyui_scheduler', lambda: jsonify(self.scheduler.status()), methods=['GET'])
+        app.add_url_rule('/healthz', 'healthz', self.health_view, methods=['GET'])
+
+    def add_pipeline(self, name, submit, collect, max_wait_time=120, outputs=None, save_name=None, requirements=None,
+                     route=True, priority="normal"):
+        # submit(comfyui_url) runs in the request context, uploads the inputs and returns a
+        # PendingPrompt, or a CachedResult; the prompt is queued in the background once the
+        # scheduler lets the job through, and its id is added to the context as "prompt_id".
+        # collect(outputs, context, comfyui_url) runs in the background and returns the
+        # response payload. A "result_cache_key" in context stores that
+        # payload for reuse. outputs lists the (node_id, name, payload_key) images used when
+        # streaming, and save_name(context, name) gives the OUTPUT_FOLDER path for a
+        # streamed copy. requirements (see backends.workflow_requirements) limits the
+        # backends the pipeline is routed to. outputs and requirements may also be
+        # callables, outputs(context) and requirements(), for pipelines whose graph is
+        # only known per request. route=False skips the POST /jobs/<name> route. priority is the
+        # default class of the pipeline's jobs.
+        self.pipelines[name] = Pipeline(name, submit, collect, max_wait_time, outputs, save_name, requirements,
+                                        priority)
+        if route:
+            self.app.add_url_rule(f'/jobs/{name}', f'submit_{name}_job', lambda: self.submit_view(name), methods=['POST'])
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _store(self, job):
+        now = time.time()
+        with self._lock:
+            expired = [job_id for job_id, j in self._jobs.items()
+                       if j.finished_at and now - j.finished_at > JOB_RETENTION_SECONDS]
+            for job_id in expired:
+                del self._jobs[job_id]
+            self._jobs[job.id] = job
+
+    def submit(self, name, stream=False):
+        pipeline = self.pipelines[name]
+        job = Job(name, stream)
+        admitted = self._admit(pipeline, [job])
+        if admitted is None:
+            return job
+        backend, requirements = admitted
+        return self._start(job, pipeline, backend, pipeline.submit, model_group(requirements))
+
+    def submit_batch(self, name, submits, admission=None):
+        # Queue one job per submit(comfyui_url) callable back to back on the same backend, so
+        # ComfyUI can reuse the cached outputs of nodes whose inputs the jobs share. With an
+        # admission from admit_request(), the jobs belong to that request and are not admitted again.
+        pipeline = self.pipelines[name]
+        jobs = [Job(name) for _ in submits]
+        for job in jobs:
+            # Same cache_model for every job of the batch, or ComfyUI would not reuse shared nodes
+            job.batch_size = len(jobs)
+        admitted = self._admit(pipeline, jobs, batch=True, admission=admission)
+        if admitted is None:
+            return jobs
+        backend, requirements = admitted
+        for job, submit in zip(jobs, submits):
+            self._start(job, pipeline, backend, submit, model_group(requirements))
+        return jobs
+
+    def admit_request(self):
+        # Admit a request that submits its jobs in rounds (the tiles of a tiled upscale) once: it
+        # takes one of its client's slots until finish_request(admission), and its jobs go through
+        # submit_batch(..., admission=admission). Raises JobError (503, 429) when refused.
+        with self._lock:
+            draining = self.draining
+        if draining:
+            raise JobError("Server is shutting down", 503)
+        client = request.headers.get("X-Client-Id") or request.remote_addr
+        admission, active = self._take_client_slot(client, 1)
+        if admission is None:
+            error, retry_after = self._client_busy(active)
+            raise JobError(error, 429, retry_after=math.ceil(retry_after))
+        return admission
+
+    def finish_request(self, admission):
+        # The request from admit_request() submits no more jobs; its slot is free once they are done
+        self._leave(admission)
+
+    def _take_client_slot(self, client, unfinished):
+        # (admission, None), with the request holding one of its client's slots until unfinished
+        # drops to 0, or (None, requests the client has in progress) when it has no slot left
+        with self._lock:
+            active = self._client_jobs.get(client, 0)
+            if MAX_JOBS_PER_CLIENT and active >= MAX_JOBS_PER_CLIENT:
+                return None, active
+            self._client_jobs[client] = active + 1
+        return {"client": client, "unfinished": unfinished}, None
+
+    def _client_busy(self, active):
+        # (error, retry after seconds) for a client without a free slot; one of its jobs should be
+        # done within about a prompt's time
+        service_times = [t for t in (self.scheduler.service_time(b.url) for b in self.backends.backends) if t]
+        return f"Too many requests in progress ({active}, limit {MAX_JOBS_PER_CLIENT})", min(service_times, default=1)
+
+    def _admit(self, pipeline, jobs, batch=False, admission=None):
+        # Route the jobs to a backend, or fail them all (503 / 429); returns (backend, requirements) or None.
+        # The jobs of a batch run one after another, so each one's deadline counts from its turn.
+        # Jobs joining an admission from admit_request() skip the client and estimated wait checks.
+        priority = request.headers.get("X-Priority", pipeline.priority).lower()
+        if priority not in PRIORITIES:
+            return self._fail(jobs, {"error": f"X-Priority must be one of {', '.join(PRIORITIES)}"}, 400)
+        try:
+            deadline = float(request.headers.get("X-Deadline", pipeline.max_wait_time))
+        except ValueError:
+            return self._fail(jobs, {"error": "X-Deadline must be a number of seconds"}, 400)
+        client = request.headers.get("X-Client-Id") or request.remote_addr
+        for job in jobs:
+            job.priority = PRIORITIES[priority]
+            job.client = client
+            if batch:
+                job.timeout = deadline
+            else:
+                job.deadline = job.arrived + deadline
+
+        joined = admission is not None
+        if not joined:
+            with self._lock:
+                draining = self.draining
+            if draining:
+                return self._fail(jobs, {"error": "Server is shutting down"}, 503)
+            admission, active = self._take_client_slot(client, 0)
+            if admission is None:
+                error, retry_after = self._client_busy(active)
+                return self._fail(jobs, {"error": error}, 429, retry_after)
+        with self._lock:
+            admission["unfinished"] += len(jobs)
+            self._active_jobs += len(jobs)
+        for job in jobs:
+            job.add_done_callback(lambda job: self._job_done(admission))
+
+        try:
+            with current_job(jobs[0]), stage("route"):
+                requirements = pipeline.requirements() if callable(pipeline.requirements) else pipeline.requirements
+                backend = self.backends.acquire(pipeline.name, requirements, count=len(jobs),
+                                                service_time=self.scheduler.service_time)
+        except NoBackendAvailable as e:
+            logger.warning("%s", e)
+            return self._fail(jobs, {"error": str(e)}, 503)
+        except Exception as e:
+            logger.exception("Error routing %s jobs", pipeline.name)
+            return self._fail(jobs, {"error": "Job failed", "details": str(e)}, 500)
+
+        if joined:
+            return backend, requirements
+        # Turn jobs away now rather than let them time out in the queue; a batch when its
+        # first job could not be done in time
+        wait = self.scheduler.estimated_wait(backend.url, jobs[0].priority)
+        service_time = self.scheduler.service_time(backend.url)
+        if wait is not None and wait + service_time > deadline:
+            for _ in jobs:
+                self.backends.release(backend)
+            # Retry once the queue should have moved on by the excess, at least one prompt
+            return self._fail(jobs, {
+                "error": "Server busy, estimated wait exceeds the deadline",
+                "estimated_wait": round(wait, 1),
+                "deadline": deadline,
+            }, 429, max(wait + service_time - deadline, service_time))
+        return backend, requirements
+
+    def _fail(self, jobs, payload, status, retry_after=None):
+        if retry_after is not None:
+            payload = {**payload, "retry_after": math.ceil(retry_after)}
+        for job in jobs:
+            if retry_after is not None:
+                job.retry_after = math.ceil(retry_after)
+            job.finish("failed", payload, status)
+        return None
+
+    def _job_done(self, admission):
+        with self._lock:
+            self._active_jobs -= 1
+        self._leave(admission)
+
+    def _leave(self, admission):
+        with self._lock:
+            admission["unfinished"] -= 1
+            if admission["unfinished"]:
+                return
+            client = admission["client"]
+            remaining = self._client_jobs.get(client, 0) - 1
+            if remaining > 0:
+                self._client_jobs[client] = remaining
+            else:
+                self._client_jobs.pop(client, None)
+                if not self._client_jobs:
+                    self._idle.notify_all()
+
+    def drain(self, timeout):
+        # Refuse new jobs and wait up to timeout seconds for the unfinished ones; True if none is left
+        with self._lock:
+            self.draining = True
+            logger.info("Draining %d unfinished jobs", self._active_jobs)
+            return self._idle.wait_for(lambda: not self._client_jobs, timeout)
+
+    def _start(self, job, pipeline, backend, submit, group=()):
+        # Uploads and the prompt must go to the same backend
+        job.backend = backend.url
+        try:
+            with current_job(job):
+                submitted = submit(backend.url)
+        except JobError as e:
+            self._release(job, backend)
+            job.finish("failed", e.payload, e.status)
+            return job
+        except Exception as e:
+            # Finish the job whatever went wrong, or its client slot and backend stay taken
+            logger.exception("Error submitting %s job", pipeline.name)
+            self._release(job, backend)
+            job.finish("failed", {"error": "Job failed", "details": str(e)}, 500)
+            return job
+
+        if isinstance(submitted, CachedResult):
+            self._release(job, backend)
+            job.backend = None
+            job.cached = True
+            job.finish("succeeded", submitted.payload, 200)
+            self._store(job)
+            return job
+
+        job.context = submitted.context
+        job.status = "waiting"
+        self._store(job)
+        # The job waits for its turn without a thread; a worker takes it once the scheduler lets it go
+        start, start_ns = time.perf_counter(), time.time_ns()
+
+        def scheduled(ticket):
+            job.add_timing("schedule", time.perf_counter() - start)
+            tracing.record(job.span, "schedule", start_ns, time.time_ns())
+            self._executor.submit(self._complete, job, pipeline, submitted, backend, ticket)
+
+        self.scheduler.submit(backend.url, group, scheduled, job.priority, job.arrived, job.deadline,
+                              cancelled=lambda: job.cancel_reason is not None)
+        return job
+
+    def _complete(self, job, pipeline, pending, backend, ticket):
+        # ticket is None when the job's deadline passed or it was cancelled while waiting
+        job.ticket = ticket
+        try:
+            with current_job(job):
+                if self._queue(job, pending, backend):
+                    self._wait_and_collect(job, pipeline, job.context)
+        finally:
+            # A cancelled prompt's time says nothing about how long prompts take
+            queued = job.prompt_id is not None
+            self._release(job, backend, ran=queued and job.cancel_reason is None)
+            if queued and job.status != "succeeded":
+                self._record_wasted(job)
+
+    def _queue(self, job, pending, backend):
+        # Queue the prompt of a job the scheduler let through; False if the job finished instead
+        try:
+            if job.cancel_reason is not None:
+                job.finish("cancelled", {"error": "Job cancelled", "reason": job.cancel_reason}, 410)
+                return False
+            if job.ticket is None:
+                TIMEOUTS.inc(backend=backend.url, kind="schedule")
+                raise JobError("Deadline passed while waiting for a backend.", 504)
+            if job.deadline is None:
+                job.deadline = time.monotonic() + job.timeout
+            graph = pending.build(job.batch_size > 1 or job.ticket.upcoming > 0)
+            with stage("queue"):
+                prompt_data = get_client(backend.url).queue_prompt(graph, get_listener(backend.url).client_id)
+            if 'prompt_id' not in prompt_data and "node_errors" in prompt_data:
+                raise JobError("ComfyUI rejected the prompt", 400, details=prompt_data.get("error"),
+                               node_errors=prompt_data["node_errors"])
+            if 'prompt_id' not in prompt_data:
+                raise JobError("Failed to get prompt_id from the response", response=prompt_data)
+        except JobError as e:
+            job.finish("failed", e.payload, e.status)
+            return False
+        except Exception as e:
+            logger.exception("Error queuing job %s", job.id)
+            job.finish("failed", {"error": "Job failed", "details": str(e)}, 500)
+            return False
+
+        if job.queued_at is None:
+            job.queued_at = time.monotonic()
+        job.context["prompt_id"] = prompt_data['prompt_id']
+        with job._lock:
+            job.prompt_id = prompt_data['prompt_id']
+            job.status = "queued"
+            cancelled = job.cancel_reason is not None
+        if cancelled:
+            # Cancelled while the prompt was on its way to ComfyUI
+            self._stop_prompt(job)
+        return True
+
+    def _release(self, job, backend, ran=False):
+        # ran=True when ComfyUI executed the job's prompt
+        if job.ticket is not None:
+            self.scheduler.done(job.ticket, ran=ran)
+            job.ticket = None
+        self.backends.release(backend)
+
+    def cancel(self, job, reason):
+        # Stop the job, in the scheduler or in ComfyUI; False if it is done (or being collected)
+        state = job.request_cancel(reason)
+        if state is None:
+            return False
+        if state == "queued":
+            self._stop_prompt(job)
+        else:
+            self.scheduler.wake()
+        return True
+
+    def _stop_prompt(self, job):
+        try:
+            action = get_client(job.backend).cancel_prompt(job.prompt_id)
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning("Could not cancel prompt %s on %s: %s", job.prompt_id, job.backend, e)
+        else:
+            CANCELLED_PROMPTS.inc(backend=job.backend, reason=job.cancel_reason, action=action)
+            logger.info("Prompt %s %s in ComfyUI (%s)", job.prompt_id, action, job.cancel_reason)
+        get_listener(job.backend).cancel(job.prompt_id)
+
+    def _record_wasted(self, job):
+        # Execution time of a prompt whose result the client does not get, up to its cancellation
+        started, finished = get_listener(job.backend).prompt_times(job.prompt_id)
+        if started is not None:
+            WASTED_GPU_SECONDS.inc(max((finished or time.monotonic()) - started, 0), endpoint=job.pipeline,
+                                   backend=job.backend, reason=job.cancel_reason or "failed")
+
+    def _wait_and_collect(self, job, pipeline, context):
+        try:
+            listener = get_listener(job.backend)
+            try:
+                with stage("wait"):
+                    outputs = listener.wait_for_outputs(job.prompt_id, max(job.deadline - time.monotonic(), 0))
+                if outputs is None:
+                    TIMEOUTS.inc(backend=job.backend, kind="job")
+                    if job.request_cancel("timeout"):
+                        self._stop_prompt(job)
+            finally:
+                self._record_comfyui(job, listener)
+            if outputs is None:
+                raise JobError("Failed to generate image within the time limit.", 504)
+            if job.stream:
+                job.outputs = outputs
+                job.finish("succeeded", {"outputs": outputs}, 200)
+                return
+            job.status = "collecting"
+            with stage("collect"):
+                payload = pipeline.collect(outputs, context, job.backend)
+            if context.get("result_cache_key"):
+                get_result_cache().put(context["result_cache_key"], payload)
+            job.finish("succeeded", payload, 200)
+        except PromptFailed as e:
+            if job.cancel_reason is not None:
+                job.finish("cancelled", {"error": "Job cancelled", "reason": job.cancel_reason}, 410)
+                return
+            logger.warning("Prompt failed: %s", e)
+            job.finish("failed", {"error": str(e)}, 500)
+        except JobError as e:
+            job.finish("failed", e.payload, e.status)
+        except Exception as e:
+            logger.exception("Error completing job %s", job.id)
+            job.finish("failed", {"error": "Job failed", "details": str(e)}, 500)
+
+    def _record_comfyui(self, job, listener):
+        # Split the wait: queued in ComfyUI, executing, and from completion to reading /history.
+        # A traced job also gets the prompt's spans, with one per executed node.
+        started, finished = listener.prompt_times(job.prompt_id)
+        now = time.monotonic()
+        if started is not None:
+            job.add_timing("comfyui_queue", max(started - job.queued_at, 0))
+            if finished is not None:
+                job.add_timing("execute", finished - started)
+        if finished is not None:
+            job.add_timing("history", max(now - finished, 0))
+        if job.span is None:
+            return
+
+        wall_ns = tracing.wall_ns
+        prompt_span = job.span.child("comfyui prompt", wall_ns(job.queued_at), tracing.SPAN_KIND_CLIENT,
+                                     **{"comfyui.prompt_id": job.prompt_id, "comfyui.backend": job.backend})
+        if started is not None:
+            tracing.record(prompt_span, "comfyui_queue", wall_ns(job.queued_at), wall_ns(started))
+            cached = listener.cached_nodes(job.prompt_id)
+            execute = prompt_span.child("execute", wall_ns(started),
+                                        **{"comfyui.cached_nodes": ",".join(cached) if cached else None})
+            for node_id, node_started, node_finished in listener.node_runs(job.prompt_id):
+                class_type = job.node_classes.get(node_id)
+                tracing.record(execute, f"{node_id} {class_type}" if class_type else node_id,
+                               wall_ns(node_started), wall_ns(node_finished),
+                               **{"comfyui.node_id": node_id, "comfyui.class_type": class_type})
+            execute.end(wall_ns(finished) if finished is not None else None)
+        prompt_span.end(wall_ns(finished) if finished is not None else None)
+
+    def run_blocking(self, name):
+        fmt = response_format()
+        job = self.submit(name, stream=fmt != "json")
+        self.wait(job)
+        return self.job_response(job, fmt)
+
+    def wait(self, job):
+        # Wait in the request thread for the job to finish, cancelling it if the client hangs up
+        sock = client_socket()
+        while not job.done.wait(DISCONNECT_CHECK_INTERVAL):
+            if client_disconnected(sock) and self.cancel(job, "disconnected"):
+                logger.info("Client disconnected, cancelled job %s", job.id)
+
+    def job_response(self, job, fmt):
+        error = None
+        if job.status == "succeeded" and fmt == "json" and job.outputs is not None:
+            error = self._collect_streamed(job)
+        if error is not None:
+            response = jsonify(error[0])
+            response.status_code = error[1]
+        elif job.status != "succeeded" or fmt == "json":
+            response = jsonify(job.result)
+            response.status_code = job.http_status
+        else:
+            response = self.stream_job(job, fmt)
+        response.vary.add("Accept")
+        if job.timings:
+            response.headers["Server-Timing"] = job.server_timing()
+        if job.retry_after is not None:
+            response.headers["Retry-After"] = str(job.retry_after)
+        return response
+
+    def _collect_streamed(self, job):
+        # A ?stream=1 job finished with ComfyUI's outputs only: collect the pipeline's payload
+        # when it is first asked for as JSON. Returns (payload, status) for an error, else None.
+        pipeline = self.pipelines[job.pipeline]
+        with job._collect_lock:
+            if job.outputs is None:
+                return None  # another request collected it while this one waited
+            try:
+                with current_job(job), stage("collect"):
+                    payload = pipeline.collect(job.outputs, job.context, job.backend)
+            except JobError as e:
+                return e.payload, e.status
+            except Exception as e:
+                logger.exception("Error collecting job %s", job.id)
+                return {"error": "Job failed", "details": str(e)}, 500
+            if job.context.get("result_cache_key"):
+                get_result_cache().put(job.context["result_cache_key"], payload)
+            job.result = payload
+            with job._lock:
+                job.outputs = None  # later requests use the payload, for JSON and raw images alike
+        return None
+
+    def stream_job(self, job, fmt):
+        pipeline = self.pipelines[job.pipeline]
+        output_nodes = pipeline.outputs(job.context or {}) if callable(pipeline.outputs) else pipeline.outputs
+        outputs = job.outputs
+        if outputs is None:
+            # Collected (or cached) job: the images are already in the base64 payload
+            parts = parts_from_payload(job.result, [(name, key) for _, name, key in output_nodes])
+        else:
+            parts = []
+            for node_id, name, _ in output_nodes:
+                for i, image_ref in enumerate(outputs.get(node_id, {}).get("images", [])):
+                    save_path = None
+                    if SAVE_OUTPUTS and pipeline.save_name and i == 0:
+                        save_path = pipeline.save_name(job.context, name)
+                    parts.append(StreamPart(name if i == 0 else f"{name}_{i}", image_ref, save_path=save_path))
+        if fmt == "image":
+            parts = parts[:1]
+        if not parts:
+            response = jsonify({"error": "No output images found in ComfyUI outputs."})
+            response.status_code = 500
+            return response
+        try:
+            return stream_response(get_client(job.backend) if job.backend else None, parts, multipart=fmt == "multipart")
+        except requests.exceptions.RequestException as e:
+            logger.error("Error streaming output images: %s", e)
+            response = jsonify({"error": "Failed to retrieve output images from ComfyUI.", "details": str(e)})
+            response.status_code = 502
+            return response
+
+    def batch_response(self, jobs):
+        # One JSON line per job, in the order the jobs finish. A batch turned away as a whole
+        # (bad headers, busy, draining, no backend) gets that response instead.
+        if all(job.status == "failed" and job.backend is None for job in jobs):
+            headers = {"Retry-After": str(jobs[0].retry_after)} if jobs[0].retry_after is not None else {}
+            return jsonify(jobs[0].result), jobs[0].http_status, headers
+        finished = queue.Queue()
+        indexes = {job.id: i for i, job in enumerate(jobs)}
+        for job in jobs:
+            job.add_done_callback(finished.put)
+        sock = client_socket()
+
+        def generate():
+            try:
+                yield json.dumps({"batch_size": len(jobs), "job_ids": [job.id for job in jobs]}) + "\n"
+                for _ in jobs:
+                    while True:
+                        try:
+                            job = finished.get(timeout=DISCONNECT_CHECK_INTERVAL)
+                            break
+                        except queue.Empty:
+                            if client_disconnected(sock):
+                                return
+                    line = {"index": indexes[job.id], **job.to_dict(), **(job.result or {})}
+                    yield json.dumps(line) + "\n"
+            finally:
+                # Left early: the client is gone, so are the jobs it was waiting for
+                for job in jobs:
+                    self.cancel(job, "disconnected")
+
+        return Response(generate(), mimetype="application/x-ndjson")
+
+    def submit_view(self, name):
+        job = self.submit(name, stream=response_format() == "stream")
+        if job.status == "failed":
+            headers = {"Retry-After": str(job.retry_after)} if job.retry_after is not None else {}
+            return jsonify(job.result), job.http_status, headers
+        return jsonify(job.to_dict()), 202
+
+    def health_view(self):
+        with self._lock:
+            status = "draining" if self.draining else "ok"
+            jobs = self._active_jobs
+        return jsonify({"status": status, "active_jobs": jobs}), 503 if status == "draining" else 200
+
+    def job_status_view(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown job id"}), 404
+        return jsonify(job.to_dict())
+
+    def job_cancel_view(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown job id"}), 404
+        if not self.cancel(job, "deleted"):
+            return jsonify({**job.to_dict(), "error": f"Job is {job.status}, it can no longer be cancelled"}), 409
+        job.done.wait(CANCEL_WAIT_SECONDS)
+        return jsonify(job.to_dict())
+
+    def job_result_view(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown job id"}), 404
+        if not job.done.is_set():
+            return jsonify(job.to_dict()), 202
+        return self.job_response(job, response_format())
+
+    def job_events_view(self, job_id):
+        job = self.get(job_id)
+        if job is None:
+            return jsonify({"error": "Unknown job id"}), 404
+        return event_stream(job, url_for('job_result', job_id=job.id))
+
+
+RESPONSE_FORMATS = {
+    "application/json": "json",
+    "image/png": "image",
+    "multipart/mixed": "multipart",
+}
+
+
+def response_format():
+    # "stream" (?stream=1) is raw bytes for one output image, multipart/mixed for several
+    if request.args.get("stream", "").lower() in ("1", "true", "yes"):
+        return "stream"
+    best = request.accept_mimetypes.best_match(list(RESPONSE_FORMATS), default="application/json")
+    return RESPONSE_FORMATS[best]
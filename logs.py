@@ -0,0 +1,154 @@
+# Structured logging.
+#
+# Modules log through logging.getLogger(__name__) with %-style arguments,
+# which are only formatted if the record is written. Records are handed to a
+# bounded queue (QueueHandler) and formatted and written by a background
+# thread (QueueListener), so request threads never serialize payloads or
+# wait on stdout; when the queue is full, records are dropped and counted
+# instead of blocking. Output is one JSON object per line (LOG_FORMAT=text
+# for plain lines), at LOG_LEVEL (default INFO).
+#
+# Every record carries the request id (X-Request-Id, generated when absent
+# and echoed in the response) and, inside a job, the job and prompt ids.
+#
+# Workflow graphs and ComfyUI outputs are too big to log for every request:
+# debug_sample() logs them for a LOG_GRAPH_SAMPLE fraction of jobs
+# (default 0, i.e. never).
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import g, has_request_context, request
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+GRAPH_SAMPLE_RATE = float(os.environ.get("LOG_GRAPH_SAMPLE", 0))
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# Attributes every LogRecord has; anything else on a record came from extra= or the context
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_context_providers = []
+_listener = None
+_setup_lock = threading.Lock()
+_dropped = 0
+
+
+def add_context_provider(provider):
+    # provider() returns fields (None values are skipped) for records logged in the calling thread
+    _context_providers.append(provider)
+
+
+def request_id():
+    if has_request_context():
+        return getattr(g, "request_id", None)
+    return None
+
+
+def context():
+    fields = {"request_id": request_id()}
+    for provider in _context_providers:
+        for key, value in provider().items():
+            if fields.get(key) is None:
+                fields[key] = value
+    return {key: value for key, value in fields.items() if value is not None}
+
+
+def sampled(key=None):
+    # Stable per job (or request): a sampled job logs both its graph and its outputs
+    if GRAPH_SAMPLE_RATE <= 0:
+        return False
+    if key is None:
+        fields = context()
+        key = fields.get("job_id") or fields.get("request_id") or uuid.uuid4().hex
+    return int(hashlib.md5(key.encode("utf-8")).hexdigest()[:8], 16) / 0xFFFFFFFF < GRAPH_SAMPLE_RATE
+
+
+def debug_sample(logger, message, *args, **fields):
+    # Log a large payload (graph, outputs) for sampled jobs only; it is serialized off the request thread
+    if sampled():
+        logger.info(message, *args, extra={**fields, "sampled": True})
+
+
+class ContextFilter(logging.Filter):
+    # Runs in the thread that logs, before the record is queued
+    def filter(self, record):
+        for key, value in context().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(QueueHandler):
+    def prepare(self, record):
+        # Leave msg % args to the listener thread; logged arguments must not be mutated afterwards
+        return record
+
+    def enqueue(self, record):
+        global _dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _dropped += 1
+
+
+def dropped():
+    return _dropped
+
+
+def setup():
+    global _listener
+    with _setup_lock:
+        if _listener is not None:
+            return
+        output = logging.StreamHandler(sys.stdout)
+        output.setFormatter(JSONFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+        records = queue.Queue(LOG_QUEUE_SIZE)
+        handler = DroppingQueueHandler(records)
+        handler.addFilter(ContextFilter())
+        root = logging.getLogger()
+        root.addHandler(handler)
+        root.setLevel(LOG_LEVEL)
+        _listener = QueueListener(records, output)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def init_app(app):
+    setup()
+
+    @app.before_request
+    def assign_request_id():
+        g.request_id = request.headers.get("X-Request-Id") or uuid.uuid4().hex[:16]
+
+    @app.after_request
+    def echo_request_id(response):
+        if getattr(g, "request_id", None):
+            response.headers["X-Request-Id"] = g.request_id
+        return response
@@ -0,0 +1,102 @@
+# Segmentation mask cache for the cloth swap workflow.
+#
+# The segmentation node (SAM vit_h + GroundingDINO) recomputes the garment
+# mask on every request, even for a person image and prompt it has already
+# segmented. The mask it produced (the MaskPreview image) is cached, keyed by
+# the hash of the person image and the node's settings (prompt, threshold,
+# models, detail options). On a hit the mask is uploaded as an input image and
+# the segmentation node is replaced by LoadImageMask, so SAM does not run.
+#
+# Entries are stored like result cache entries (MASK_CACHE_DIR,
+# MASK_CACHE_MAX_BYTES, MASK_CACHE_TTL) together with how long segmentation
+# took on the GPU; hits add that up as GPU seconds saved.
+
+import base64
+import hashlib
+import os
+import threading
+
+from result_cache import ResultCache, canonical_json
+from workflow_registry import is_link
+
+MASK_CACHE_DIR = os.environ.get(
+    "MASK_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "masks")
+)
+MASK_CACHE_MAX_BYTES = int(os.environ.get("MASK_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+MASK_CACHE_TTL = int(os.environ.get("MASK_CACHE_TTL", 7 * 24 * 3600))
+
+
+def mask_key(person_digest, segment_inputs):
+    # Every input of the segmentation node except the image link, which the person digest stands for
+    settings = {k: v for k, v in segment_inputs.items() if not is_link(v)}
+    material = canonical_json({"person": person_digest, "segment": settings})
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def mask_graph(workflow, node_id, mask_filename, mask_output=1):
+    # Replace the segmentation node with LoadImageMask reading mask_filename; links to its
+    # mask output (mask_output) are moved to LoadImageMask's output 0
+    graph = dict(workflow)
+    graph[node_id] = {
+        "inputs": {"image": mask_filename, "channel": "red"},
+        "class_type": "LoadImageMask",
+        "_meta": {"title": "Cached mask"},
+    }
+    for other_id, node in workflow.items():
+        links = {k: v for k, v in node["inputs"].items() if is_link(v) and v[0] == node_id}
+        if not links or other_id == node_id:
+            continue
+        if any(v[1] != mask_output for v in links.values()):
+            raise ValueError(f"Node {other_id} uses an output of node {node_id} other than its mask")
+        node = dict(node)
+        node["inputs"] = {**node["inputs"], **{k: [node_id, 0] for k in links}}
+        graph[other_id] = node
+    return graph
+
+
+class MaskCache(ResultCache):
+    def __init__(self, directory=MASK_CACHE_DIR, max_bytes=MASK_CACHE_MAX_BYTES, ttl=MASK_CACHE_TTL):
+        self.gpu_seconds_saved = 0.0
+        super().__init__(directory, max_bytes, ttl)
+
+    def get_mask(self, key):
+        entry = self.get(key)
+        if entry is None:
+            return None
+        with self._lock:
+            self.gpu_seconds_saved += entry.get("segmentation_seconds") or 0
+        return base64.b64decode(entry["mask_base64"])
+
+    def put_mask(self, key, mask_data, segmentation_seconds=None):
+        # A job that missed while an earlier one was still running stores the same mask; keep the
+        # first entry, whose segmentation was not served from ComfyUI's own cache
+        with self._lock:
+            if key in self._index:
+                return
+        self.put(key, {
+            "mask_base64": base64.b64encode(mask_data).decode("utf-8"),
+            "segmentation_seconds": segmentation_seconds,
+        })
+
+    def stats(self):
+        stats = super().stats()
+        del stats["bypassed"]
+        with self._lock:
+            stats["gpu_seconds_saved"] = round(self.gpu_seconds_saved, 3)
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_mask_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = MaskCache()
+    return _cache
+
+
+def init_app(app):
+    app.add_url_rule('/comfyui/mask_cache', 'comfyui_mask_cache', lambda: get_mask_cache().stats(), methods=['GET'])
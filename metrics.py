@@ -0,0 +1,164 @@
+# Prometheus metrics, served at GET /metrics in the text exposition format.
+#
+# Counters and histograms are kept in memory by label values; recording one
+# is a dict lookup and an addition under a per-metric lock, so they stay on
+# in production. Histograms use fixed buckets.
+#
+# Every stage a job records (see jobs.stage: read, cache, upload, schedule,
+# queue, wait, collect, ...) is observed in comfyui_api_stage_seconds by
+# endpoint (pipeline), stage and backend. The ComfyUI side of "wait" is split
+# from the /ws events into comfyui_queue (waiting in ComfyUI's queue),
+# execute (running) and history (from completion until the outputs were read
+# from /history).
+
+import bisect
+import threading
+
+from flask import Response
+
+import logs
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._values = {}  # label values -> [per-bucket counts (last is +Inf), sum]
+        _registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            values = sorted((key, list(counts), total) for key, (counts, total) in self._values.items())
+        for key, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                labels = _labels(self.labelnames, key, [("le", _number(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class CallbackMetric:
+    # Read when /metrics is scraped: collect() returns {label values tuple: value}
+    def __init__(self, name, documentation, metric_type, collect, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.metric_type = metric_type
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for key, value in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {_number(value)}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "comfyui_api_stage_seconds", "Time spent in each stage of a job.", ("endpoint", "stage", "backend"))
+JOBS = Counter("comfyui_api_jobs_total", "Finished jobs by outcome.", ("endpoint", "status", "code"))
+REQUEST_SECONDS = Histogram(
+    "comfyui_api_request_seconds", "ComfyUI HTTP requests through safe_request, including retries.",
+    ("backend", "path"))
+RETRIES = Counter(
+    "comfyui_api_request_retries_total", "ComfyUI HTTP requests retried after an error.", ("backend", "path", "error"))
+TIMEOUTS = Counter(
+    "comfyui_api_timeouts_total",
+    "Timeouts: HTTP requests to ComfyUI (kind=request), prompts not finished in time (kind=job) and jobs "
+    "still waiting for a backend at their deadline (kind=schedule).",
+    ("backend", "kind"))
+UPLOAD_BYTES = Counter("comfyui_api_upload_bytes_total", "Image bytes uploaded to ComfyUI.", ("backend",))
+VIEW_BYTES = Counter("comfyui_api_view_bytes_total", "Image bytes fetched from ComfyUI /view.", ("backend",))
+ENCODE_SECONDS = Histogram("comfyui_api_base64_seconds", "Time to base64 encode one output image.")
+OUTPUT_WRITE_SECONDS = Histogram(
+    "comfyui_api_output_write_seconds", "Time the background writer spent writing one input or output image.")
+PREPROCESS_SECONDS = Histogram(
+    "comfyui_api_preprocess_seconds", "Time to downscale and re-encode one input image above max_megapixels.")
+PREPROCESS_IMAGES_TOTAL = Counter(
+    "comfyui_api_preprocess_images_total", "Input images by preprocessing outcome.", ("action",))
+PREPROCESS_BYTES_SAVED = Counter(
+    "comfyui_api_preprocess_bytes_saved_total", "Input image bytes not uploaded because the image was downscaled.")
+CANCELLED_PROMPTS = Counter(
+    "comfyui_api_cancelled_prompts_total",
+    "Prompts the API gave up on, taken out of ComfyUI's queue (action=deleted) or interrupted.",
+    ("backend", "reason", "action"))
+WASTED_GPU_SECONDS = Counter(
+    "comfyui_api_wasted_gpu_seconds_total",
+    "Seconds ComfyUI spent executing prompts whose result was not delivered (cancelled, timed out or failed).",
+    ("endpoint", "backend", "reason"))
+LOG_RECORDS_DROPPED = CallbackMetric(
+    "comfyui_api_log_records_dropped_total", "Log records dropped because the log queue was full.", "counter",
+    lambda: {(): logs.dropped()})
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    app.add_url_rule('/metrics', 'metrics', lambda: Response(render(), mimetype="text/plain; version=0.0.4"),
+                     methods=['GET'])
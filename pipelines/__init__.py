@@ -0,0 +1,25 @@
+# Pipeline plugins.
+#
+# A plugin is a module with init_app(app, job_manager) that adds its
+# pipeline(s) (job_manager.add_pipeline) and routes. service.create_app()
+# imports only the plugins it serves, by the names below or by module path
+# for a plugin that lives elsewhere.
+
+import importlib
+
+PLUGINS = {
+    "cloth_swap": "pipelines.cloth_swap",
+    "upscale": "pipelines.upscale",
+    "tiled_upscale": "pipelines.tiled_upscale",
+    "run": "workflow_registry",
+}
+
+
+def load(name):
+    module = PLUGINS.get(name, name)
+    try:
+        return importlib.import_module(module)
+    except ModuleNotFoundError as e:
+        if e.name != module:
+            raise
+        raise ValueError(f"Unknown pipeline plugin {name} (available: {', '.join(PLUGINS)})") from None
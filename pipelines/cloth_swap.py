@@ -0,0 +1,237 @@
+# Cloth swap pipeline: workflow/Cloth Swap.json (SAM + GroundingDINO
+# segmentation, CatVTON), POST /cloth_swap and POST /cloth_swap/batch.
+
+import logging
+import os
+import random
+
+from flask import jsonify, request
+from werkzeug.utils import secure_filename
+
+from comfy_completion import get_listener
+from jobs import CachedResult, JobError, PendingPrompt, stage
+from logs import debug_sample
+from mask_cache import get_mask_cache, mask_graph, mask_key
+from pipelines.common import (
+    OUTPUT_FOLDER, generate_random_digits, get_output_images, read_input_image,
+    upload_images_to_comfyui,
+)
+from result_cache import get_result_cache, make_key
+from streaming import SAVE_OUTPUTS, get_output_writer
+from upload_cache import content_filename
+from workflow_registry import get_registry
+
+MAX_BATCH_SIZE = int(os.environ.get("MAX_BATCH_SIZE", 50))  # jobs per /cloth_swap/batch request
+# Downscale person images above this many megapixels before upload; 0 keeps them at full size,
+# since CatVTON (node 5) reads the person image next to the 2 MP SAM node
+PERSON_MAX_MEGAPIXELS = float(os.environ.get("PERSON_MAX_MEGAPIXELS", 0))
+
+# Parameter slots of the workflow filled per request
+CLOTH_SWAP_SLOTS = {
+    "person_image": ("1", "image"),
+    "cloth_image": ("2", "image"),
+    "prompt": ("4", "prompt"),
+    "seed": ("5", "seed"),
+    "cache_model": ("4", "cache_model"),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def read_seed():
+    # CatVTON is only reproducible (and cacheable) when the client pins the seed
+    seed = request.form.get('seed')
+    if seed is not None:
+        try:
+            seed = int(seed)
+        except ValueError:
+            raise JobError("seed must be an integer", 400)
+    return seed
+
+
+def image_limit(slot):
+    # max_megapixels for the image of slot (None: no limit)
+    if slot == "person_image" and PERSON_MAX_MEGAPIXELS > 0:
+        return PERSON_MAX_MEGAPIXELS
+    return get_registry().require("cloth_swap").image_limits.get(CLOTH_SWAP_SLOTS[slot][0])
+
+
+def queue_cloth_swap(comfyui_url, person, cloth, prompt, seed, person_filename_base, random_suffix, uploaded=None):
+    # person / cloth are read_input_image() results; uploaded is the pair of ComfyUI filenames
+    # when the images are already on this backend
+    person_image_data, person_input_path, person_digest = person
+    cloth_image_data, cloth_input_path, cloth_digest = cloth
+
+    template = get_registry().template("cloth_swap", CLOTH_SWAP_SLOTS)
+    workflow_params = {
+        "person_image": content_filename(person_digest, person_input_path),
+        "cloth_image": content_filename(cloth_digest, cloth_input_path),
+        "prompt": prompt,
+    }
+
+    cache_key = None
+    if seed is None:
+        workflow_params["seed"] = random.randint(0, 0xFFFFFFFFFFFFFFFF)
+        get_result_cache().record_bypass()
+    else:
+        workflow_params["seed"] = seed
+        with stage("cache"):
+            cache_key = make_key("cloth_swap", template.build(**workflow_params), [person_digest, cloth_digest])
+            cached = get_result_cache().get(cache_key)
+        if cached is not None:
+            return CachedResult(cached)
+
+    # Segmentation (node 4) only depends on the person image and its own settings
+    with stage("cache"):
+        segmentation_key = mask_key(person_digest, template.build(**workflow_params)["4"]["inputs"])
+        cached_mask = get_mask_cache().get_mask(segmentation_key)
+
+    images = [(cached_mask, "mask.png")] if cached_mask is not None else []
+    if uploaded is None:
+        images = [
+            (person_image_data, os.path.basename(person_input_path)),
+            (cloth_image_data, os.path.basename(cloth_input_path)),
+        ] + images
+    if images:
+        with stage("upload"):
+            uploaded = list(uploaded or ()) + upload_images_to_comfyui(images, comfyui_url)
+    uploaded_person_filename, uploaded_cloth_filename = uploaded[:2]
+
+    if not all(uploaded):
+        raise JobError("Failed to upload images to ComfyUI")
+
+    workflow_params["person_image"] = uploaded_person_filename
+    workflow_params["cloth_image"] = uploaded_cloth_filename
+
+    def build(keep_models):
+        # Keep SAM loaded after this job only if more cloth swaps are about to run on this backend
+        workflow = template.build(**workflow_params, cache_model=keep_models)
+        if cached_mask is not None:
+            workflow = mask_graph(workflow, "4", uploaded[2])
+        debug_sample(logger, "Cloth swap workflow", graph=workflow)
+        return workflow
+
+    return PendingPrompt(build, {
+        "person_filename_base": person_filename_base,
+        "random_suffix": random_suffix,
+        "result_cache_key": cache_key,
+        "mask_cache_key": segmentation_key if cached_mask is None else None,
+    })
+
+
+def submit_cloth_swap(comfyui_url):
+    if 'person_image' not in request.files or 'cloth_image' not in request.files or 'prompt' not in request.form:
+        raise JobError("Missing person_image, cloth_image, or prompt", 400)
+
+    person_image_file = request.files['person_image']
+    cloth_image_file = request.files['cloth_image']
+    prompt = request.form['prompt']
+    seed = read_seed()
+
+    random_suffix = generate_random_digits()
+    person = read_input_image(person_image_file, random_suffix, image_limit("person_image"))
+    cloth = read_input_image(cloth_image_file, random_suffix, image_limit("cloth_image"))
+
+    return queue_cloth_swap(comfyui_url, person, cloth, prompt, seed,
+                            secure_filename(person_image_file.filename), random_suffix)
+
+
+def cloth_swap_output_path(context, name):
+    return os.path.join(OUTPUT_FOLDER, f"{os.path.splitext(context['person_filename_base'])[0]}_{context['random_suffix']}_{name}.jpg")
+
+
+def collect_cloth_swap(outputs, context, comfyui_url):
+    debug_sample(logger, "ComfyUI outputs", outputs=outputs)
+
+    # Get the cloth swapped images (node ID 7) and mask images (node ID 6) together
+    cloth_images, mask_images = get_output_images(outputs, ["7", "6"], comfyui_url)
+    cloth_image_data, cloth_image_base64 = cloth_images[0] if cloth_images and cloth_images[0] else (None, None)
+    mask_image_data, mask_image_base64 = mask_images[0] if mask_images and mask_images[0] else (None, None)
+
+    if cloth_image_data and mask_image_data:
+        cloth_output_path = cloth_swap_output_path(context, "cloth")
+        mask_output_path = cloth_swap_output_path(context, "mask")
+        if SAVE_OUTPUTS:
+            get_output_writer().write(cloth_output_path, cloth_image_data)
+            get_output_writer().write(mask_output_path, mask_image_data)
+        if context.get("mask_cache_key"):
+            segmentation_seconds = get_listener(comfyui_url).node_times(context["prompt_id"]).get("4")
+            get_mask_cache().put_mask(context["mask_cache_key"], mask_image_data, segmentation_seconds)
+        payload = {
+            "cloth_image_base64": cloth_image_base64,
+            "mask_image_base64": mask_image_base64,
+            "output_cloth_filename": os.path.basename(cloth_output_path),
+            "output_mask_filename": os.path.basename(mask_output_path)
+        }
+        # Further images of the same nodes (batch size > 1)
+        for name, images in (("cloth", cloth_images), ("mask", mask_images)):
+            for i, image in enumerate(images[1:], 1):
+                if image:
+                    payload[f"{name}_{i}_image_base64"] = image[1]
+        return payload
+    else:
+        error_message = "Failed to retrieve image data."
+        if not cloth_image_data and not mask_image_data:
+            error_message = "Failed to retrieve both cloth and mask image data."
+        elif not cloth_image_data:
+            error_message = "Failed to retrieve cloth image data."
+        elif not mask_image_data:
+            error_message = "Failed to retrieve mask image data."
+        raise JobError(error_message)
+
+
+def cloth_swap_batch(job_manager):
+    # One person with many garments, or one garment on many people. Every image is uploaded
+    # once and the CatVTON jobs are queued back to back on one backend, so with one person
+    # ComfyUI reuses its cached segmentation mask (node 4) instead of re-running SAM.
+    person_files = request.files.getlist('person_image')
+    cloth_files = request.files.getlist('cloth_image')
+    if not person_files or not cloth_files or 'prompt' not in request.form:
+        return jsonify({"error": "Missing person_image, cloth_image, or prompt"}), 400
+    if len(person_files) > 1 and len(cloth_files) > 1:
+        return jsonify({"error": "Send one person_image with several cloth_image files, or one cloth_image with several person_image files"}), 400
+    if len(person_files) * len(cloth_files) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"At most {MAX_BATCH_SIZE} images per batch"}), 400
+
+    prompt = request.form['prompt']
+    try:
+        seed = read_seed()
+    except JobError as e:
+        return jsonify(e.payload), e.status
+
+    random_suffix = generate_random_digits()
+    persons = [read_input_image(f, random_suffix, image_limit("person_image")) for f in person_files]
+    cloths = [read_input_image(f, random_suffix, image_limit("cloth_image")) for f in cloth_files]
+    images = {digest: (data, os.path.basename(path)) for data, path, digest in persons + cloths}
+    uploaded = {}
+
+    def upload_all(comfyui_url):
+        if not uploaded:
+            with stage("upload"):
+                names = upload_images_to_comfyui(list(images.values()), comfyui_url)
+            uploaded.update(zip(images, names))
+        return uploaded
+
+    def submit_item(i, person_file, person, cloth):
+        def submit(comfyui_url):
+            names = upload_all(comfyui_url)
+            return queue_cloth_swap(comfyui_url, person, cloth, prompt, seed, secure_filename(person_file.filename),
+                                    f"{random_suffix}_{i}", uploaded=(names[person[2]], names[cloth[2]]))
+        return submit
+
+    submits = [submit_item(i, person_file, person, cloth)
+               for i, (person_file, person, cloth) in enumerate(
+                   (pf, p, c) for pf, p in zip(person_files, persons) for c in cloths)]
+    return job_manager.batch_response(job_manager.submit_batch("cloth_swap", submits))
+
+
+def init_app(app, job_manager):
+    job_manager.add_pipeline(
+        "cloth_swap", submit_cloth_swap, collect_cloth_swap, max_wait_time=120,
+        outputs=[("7", "cloth", "cloth_image_base64"), ("6", "mask", "mask_image_base64")],
+        save_name=cloth_swap_output_path,
+        requirements=lambda: get_registry().requirements("cloth_swap"),
+        priority="interactive",
+    )
+    app.add_url_rule('/cloth_swap', 'cloth_swap', lambda: job_manager.run_blocking("cloth_swap"), methods=['POST'])
+    app.add_url_rule('/cloth_swap/batch', 'cloth_swap_batch', lambda: cloth_swap_batch(job_manager), methods=['POST'])
@@ -0,0 +1,50 @@
+# Helpers shared by the pipeline plugins: where input and output images are
+# kept, and thin wrappers around the shared ComfyUI client and upload cache.
+#
+# The folders (INPUT_FOLDER, OUTPUT_FOLDER) are created by the background
+# writer on the first image written to them, not at startup.
+
+import os
+import random
+
+from werkzeug.utils import secure_filename
+
+from comfy_client import get_client
+from jobs import stage
+from preprocess import preprocess_image
+from streaming import get_output_writer
+from upload_cache import content_digest, get_upload_cache
+
+OUTPUT_FOLDER = os.environ.get("OUTPUT_FOLDER", r"C:\Users\umakanths\Desktop\Test\output_images")
+INPUT_FOLDER = os.environ.get("INPUT_FOLDER", r"C:\Users\umakanths\Desktop\Test\input")
+
+
+def generate_random_digits(length=6):
+    return ''.join(random.choice('0123456789') for _ in range(length))
+
+
+def upload_image_to_comfyui(image_data, filename, comfyui_url):
+    return get_upload_cache().upload(get_client(comfyui_url), image_data, filename)
+
+
+def upload_images_to_comfyui(images, comfyui_url):
+    return get_upload_cache().upload_many(get_client(comfyui_url), images)
+
+
+def get_output_images(outputs, node_ids, comfyui_url):
+    # Every image of each node, fetched concurrently, as (data, base64) pairs
+    return get_client(comfyui_url).get_output_images(outputs, node_ids, encode=True)
+
+
+def read_input_image(image_file, random_suffix, max_megapixels=None):
+    # (data, input_path, digest) of the image as uploaded, i.e. downscaled to max_megapixels
+    # and with the extension of its format (see preprocess.py); the copy in INPUT_FOLDER is
+    # written in the background
+    with stage("read"):
+        image_data = image_file.read()
+    with stage("preprocess"):
+        image_data, filename_base = preprocess_image(image_data, secure_filename(image_file.filename), max_megapixels)
+    input_filename = f"{os.path.splitext(filename_base)[0]}_{random_suffix}{os.path.splitext(filename_base)[1]}"
+    input_path = os.path.join(INPUT_FOLDER, input_filename)
+    get_output_writer().write(input_path, image_data)
+    return image_data, input_path, content_digest(image_data)
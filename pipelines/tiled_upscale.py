@@ -0,0 +1,245 @@
+# Tiled upscale: POST /upscale_image/tiled.
+#
+# One UltimateSDUpscale prompt for a very large image can run past the
+# prompt time limit and return nothing. Here the API cuts the image into
+# overlapping tiles of TILE_SIZE pixels (at least TILE_OVERLAP apart), runs
+# each tile as its own prompt of TILED_UPSCALE_WORKFLOW (default
+# workflow/upscale workflow.json) and stitches the upscaled tiles together.
+#
+# Tiles are submitted as separate "upscale_tile" jobs, at most TILES_PER_BACKEND
+# per backend at a time, so a large image spreads over every GPU. The request
+# is admitted once and takes one of its client's MAX_JOBS_PER_CLIENT slots,
+# however many tiles it has. A tile that fails (its upload, its prompt, or a
+# timeout in the scheduler or in ComfyUI) is retried (TILE_RETRIES times) on
+# its own instead of the whole image; a rejected tile (400) is not. Upscaled tiles are merged in raster order as they arrive,
+# each feathered into the tiles above and to its left across the overlap; tiles
+# that finish early wait in memory until their turn. When the request gives
+# up (a tile failed for good, or the client disconnected), the tiles still in
+# flight are cancelled in ComfyUI.
+#
+# Form data: image. The response is {"output_image_base64": ...} (PNG), or the
+# PNG itself for Accept: image/png or ?stream=1. Needs Pillow.
+
+import base64
+import io
+import logging
+import math
+import os
+import queue
+import random
+from collections import deque
+
+from flask import Response, jsonify, request
+from werkzeug.utils import secure_filename
+
+from jobs import (DISCONNECT_CHECK_INTERVAL, JobError, client_disconnected, client_socket, PendingPrompt,
+                  response_format, stage)
+from pipelines.common import get_output_images, upload_image_to_comfyui
+from workflow_registry import get_registry
+
+TILED_UPSCALE_WORKFLOW = os.environ.get("TILED_UPSCALE_WORKFLOW", "upscale_workflow")
+TILE_SIZE = int(os.environ.get("TILE_SIZE", 1024))
+TILE_OVERLAP = int(os.environ.get("TILE_OVERLAP", 64))
+TILE_RETRIES = int(os.environ.get("TILE_RETRIES", 2))
+TILES_PER_BACKEND = int(os.environ.get("TILES_PER_BACKEND", 2))
+TILE_MAX_WAIT = 300
+MAX_TILES = 400
+
+logger = logging.getLogger(__name__)
+
+
+def tile_starts(length, tile, overlap):
+    # Evenly spread start offsets of tiles covering 0..length, overlapping by at least overlap
+    if length <= tile:
+        return [0]
+    count = math.ceil((length - overlap) / (tile - overlap))
+    return [round(i * (length - tile) / (count - 1)) for i in range(count)]
+
+
+def plan_tiles(width, height, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    # Tile boxes (x0, y0, x1, y1) in raster order, and the grid (columns, rows)
+    tile_width, tile_height = min(tile, width), min(tile, height)
+    xs = tile_starts(width, tile_width, overlap)
+    ys = tile_starts(height, tile_height, overlap)
+    boxes = [(x, y, x + tile_width, y + tile_height) for y in ys for x in xs]
+    return boxes, (len(xs), len(ys))
+
+
+def _ramp(length, size, vertical):
+    # Mask rising from 0 to 255 across length pixels, stretched to size
+    from PIL import Image
+
+    ramp = Image.new("L", (1, length) if vertical else (length, 1))
+    ramp.putdata([round(255 * (i + 0.5) / length) for i in range(length)])
+    return ramp.resize(size, Image.NEAREST)
+
+
+class TileMerger:
+    def __init__(self, boxes, grid, width, height):
+        self.boxes = boxes
+        self.columns = grid[0]
+        self.width = width
+        self.height = height
+        self.scale = None
+        self.canvas = None
+        self.merged = 0
+        self._waiting = {}
+
+    def add(self, index, image_data):
+        # Merge every tile whose turn has come; out-of-order tiles wait
+        self._waiting[index] = image_data
+        while self.merged in self._waiting:
+            self._paste(self.merged, self._waiting.pop(self.merged))
+            self.merged += 1
+
+    def _scaled(self, box):
+        return tuple(round(v * self.scale) for v in box)
+
+    def _paste(self, index, image_data):
+        from PIL import Image, ImageChops
+
+        with Image.open(io.BytesIO(image_data)) as tile:
+            tile = tile.convert("RGB")
+        x0, y0, x1, y1 = self.boxes[index]
+        if self.canvas is None:
+            # The workflow's scale factor, from the first tile
+            self.scale = tile.width / (x1 - x0)
+            self.canvas = Image.new("RGB", (round(self.width * self.scale), round(self.height * self.scale)))
+        left, top, right, bottom = self._scaled(self.boxes[index])
+        size = (right - left, bottom - top)
+        if tile.size != size:
+            tile = tile.resize(size, Image.LANCZOS)
+
+        mask = None
+        column, row = index % self.columns, index // self.columns
+        overlap = self._scaled(self.boxes[index - 1])[2] - left if column > 0 else 0
+        if overlap > 0:
+            mask = Image.new("L", size, 255)
+            mask.paste(_ramp(overlap, (overlap, size[1]), vertical=False), (0, 0))
+        overlap = self._scaled(self.boxes[index - self.columns])[3] - top if row > 0 else 0
+        if overlap > 0:
+            top_mask = Image.new("L", size, 255)
+            top_mask.paste(_ramp(overlap, (size[0], overlap), vertical=True), (0, 0))
+            mask = top_mask if mask is None else ImageChops.multiply(mask, top_mask)
+        self.canvas.paste(tile, (left, top), mask)
+
+    def png(self):
+        out = io.BytesIO()
+        self.canvas.save(out, "PNG")
+        return out.getvalue()
+
+
+def submit_tile_item(index, tile_data, filename, params):
+    def submit(comfyui_url):
+        workflow = get_registry().require(TILED_UPSCALE_WORKFLOW)
+        with stage("upload"):
+            uploaded_filename = upload_image_to_comfyui(tile_data, filename, comfyui_url)
+        if not uploaded_filename:
+            raise JobError("Failed to upload image to ComfyUI")
+
+        graph = workflow.template.build(**params, **{f"{workflow.images[0]}.image": uploaded_filename})
+        return PendingPrompt(lambda keep_models: graph, {"tile": index, "output_node": workflow.outputs[0]})
+    return submit
+
+
+def collect_tile(outputs, context, comfyui_url):
+    # The tile's image stays in the job context; the payload only says which tile it is
+    images = get_output_images(outputs, [context["output_node"]], comfyui_url)[0]
+    if not images or not images[0]:
+        raise JobError("No upscaled image found in ComfyUI outputs.")
+    context["image_data"] = images[0][0]
+    return {"tile": context["tile"]}
+
+
+def tiled_upscale(job_manager):
+    if 'image' not in request.files:
+        return jsonify({"error": "Missing image file"}), 400
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        return jsonify({"error": "Tiled upscale needs Pillow on the API server"}), 501
+    workflow = get_registry().get(TILED_UPSCALE_WORKFLOW)
+    if workflow is None or len(workflow.images) != 1:
+        return jsonify({"error": f"Workflow {TILED_UPSCALE_WORKFLOW} with one LoadImage node not found"}), 500
+
+    image_file = request.files['image']
+    try:
+        with Image.open(image_file.stream) as source:
+            source = ImageOps.exif_transpose(source).convert("RGB")
+    except (OSError, Image.DecompressionBombError) as e:
+        return jsonify({"error": "Invalid image", "details": str(e)}), 400
+    boxes, grid = plan_tiles(source.width, source.height)
+    if len(boxes) > MAX_TILES:
+        return jsonify({"error": f"Image too large: {len(boxes)} tiles, at most {MAX_TILES}"}), 400
+
+    # One seed for every tile, so they are denoised alike
+    params = {param: random.randint(0, 0xFFFFFFFFFFFFFFFF) for param, (_, input_name) in workflow.template.slots.items()
+              if input_name in ("seed", "noise_seed")}
+    name, _ = os.path.splitext(secure_filename(image_file.filename) or "image.png")
+
+    def tile_submit(index):
+        out = io.BytesIO()
+        source.crop(boxes[index]).save(out, "PNG", compress_level=1)
+        return submit_tile_item(index, out.getvalue(), f"{name}_tile{index}.png", params)
+
+    try:
+        admission = job_manager.admit_request()
+    except JobError as e:
+        headers = {"Retry-After": str(e.payload["retry_after"])} if "retry_after" in e.payload else {}
+        return jsonify(e.payload), e.status, headers
+
+    window = max(1, len(job_manager.backends.backends) * TILES_PER_BACKEND)
+    merger = TileMerger(boxes, grid, source.width, source.height)
+    pending = deque(range(len(boxes)))
+    in_flight = {}  # job id -> (job, tile index)
+    attempts = [0] * len(boxes)
+    finished = queue.Queue()
+    sock = client_socket()
+    reason = "abandoned"
+    try:
+        while pending or in_flight:
+            while pending and len(in_flight) < window:
+                index = pending.popleft()
+                job = job_manager.submit_batch("upscale_tile", [tile_submit(index)], admission=admission)[0]
+                in_flight[job.id] = (job, index)
+                job.add_done_callback(finished.put)
+            try:
+                job = finished.get(timeout=DISCONNECT_CHECK_INTERVAL)
+            except queue.Empty:
+                if client_disconnected(sock):
+                    reason = "disconnected"
+                    logger.info("Client disconnected, cancelling %d tiles in flight", len(in_flight))
+                    return jsonify({"error": "Job cancelled", "reason": reason}), 410
+                continue
+            _, index = in_flight.pop(job.id)
+            if job.status == "succeeded":
+                merger.add(index, job.context.pop("image_data"))
+            elif attempts[index] < TILE_RETRIES and job.http_status != 400:
+                attempts[index] += 1
+                logger.warning("Tile %d of %d failed, retrying (%d/%d): %s", index, len(boxes), attempts[index],
+                               TILE_RETRIES, (job.result or {}).get("error"))
+                pending.appendleft(index)
+            else:
+                headers = {"Retry-After": str(job.retry_after)} if job.retry_after is not None else {}
+                return jsonify({**job.result, "tile": index, "tiles": len(boxes)}), job.http_status, headers
+    finally:
+        for job, _ in in_flight.values():
+            job_manager.cancel(job, reason)
+        job_manager.finish_request(admission)
+
+    image_data = merger.png()
+    headers = {"X-Tiles": f"{grid[0]}x{grid[1]}", "X-Tile-Retries": str(sum(attempts))}
+    if response_format() in ("image", "stream"):
+        return Response(image_data, mimetype="image/png", headers=headers)
+    return jsonify({"output_image_base64": base64.b64encode(image_data).decode('utf-8')}), 200, headers
+
+
+def init_app(app, job_manager):
+    job_manager.add_pipeline(
+        "upscale_tile", None, collect_tile, max_wait_time=TILE_MAX_WAIT,
+        requirements=lambda: get_registry().requirements(TILED_UPSCALE_WORKFLOW),
+        route=False,
+        priority="batch",
+    )
+    app.add_url_rule('/upscale_image/tiled', 'upscale_image_tiled', lambda: tiled_upscale(job_manager),
+                     methods=['POST'])
@@ -0,0 +1,76 @@
+# Upscale pipeline: workflow/RealESRGAN Upscale.json, POST /upscale_image.
+
+import logging
+import os
+
+from flask import request
+
+from jobs import CachedResult, JobError, PendingPrompt, stage
+from logs import debug_sample
+from pipelines.common import (
+    generate_random_digits, get_output_images, read_input_image, upload_image_to_comfyui,
+)
+from result_cache import get_result_cache, make_key
+from upload_cache import content_filename
+from workflow_registry import get_registry
+
+# Image slot of the workflow filled per request
+UPSCALE_SLOTS = {"image": ("4", "image")}
+
+logger = logging.getLogger(__name__)
+
+
+def submit_upscale(comfyui_url):
+    if 'image' not in request.files:
+        raise JobError("Missing image file", 400)
+
+    # Work from the uploaded bytes in memory; the copy in INPUT_FOLDER is written in the background
+    image_limit = get_registry().require("realesrgan_upscale").image_limits.get(UPSCALE_SLOTS["image"][0])
+    input_image_data, input_path, input_digest = read_input_image(request.files['image'], generate_random_digits(),
+                                                                  image_limit)
+
+    # The RealESRGAN graph has no seed, so the same input always gives the same output
+    template = get_registry().template("realesrgan_upscale", UPSCALE_SLOTS)
+    workflow = template.build(image=content_filename(input_digest, input_path))
+    with stage("cache"):
+        cache_key = make_key("upscale", workflow, [input_digest])
+        cached = get_result_cache().get(cache_key)
+    if cached is not None:
+        return CachedResult(cached)
+
+    with stage("upload"):
+        uploaded_filename = upload_image_to_comfyui(input_image_data, os.path.basename(input_path), comfyui_url)
+
+    if not uploaded_filename:
+        raise JobError("Failed to upload image to ComfyUI")
+
+    workflow = template.build(image=uploaded_filename)
+    return PendingPrompt(lambda keep_models: workflow, {"result_cache_key": cache_key})
+
+
+def collect_upscale(outputs, context, comfyui_url):
+    debug_sample(logger, "ComfyUI outputs", outputs=outputs)
+
+    # Get the upscaled images from node ID 11, already Base64 encoded
+    output_images = get_output_images(outputs, ["11"], comfyui_url)[0]
+    if output_images:
+        if output_images[0]:
+            payload = {"output_image_base64": output_images[0][1]}
+            for i, image in enumerate(output_images[1:], 1):
+                if image:
+                    payload[f"output_{i}_image_base64"] = image[1]
+            return payload
+        else:
+            raise JobError("Failed to retrieve upscaled image data from ComfyUI.")
+
+    raise JobError("No upscaled image found in ComfyUI outputs.")
+
+
+def init_app(app, job_manager):
+    job_manager.add_pipeline(
+        "upscale", submit_upscale, collect_upscale, max_wait_time=120,
+        outputs=[("11", "output", "output_image_base64")],
+        requirements=lambda: get_registry().requirements("realesrgan_upscale"),
+        priority="batch",
+    )
+    app.add_url_rule('/upscale_image', 'upscale_image', lambda: job_manager.run_blocking("upscale"), methods=['POST'])
@@ -0,0 +1,165 @@
+# Preprocessing of input images before they are uploaded to ComfyUI.
+#
+# Nodes like "LayerMask: SegmentAnythingUltra V2" declare max_megapixels and
+# shrink larger images themselves, so uploading a 24 MP phone photo byte for
+# byte only costs upload bandwidth and ComfyUI decode time. The image size is
+# read from the file header (PNG, JPEG, WebP, GIF, BMP) without decoding it;
+# only an image above the limit of every node that reads it is downscaled and
+# re-encoded, on a bounded thread pool (PREPROCESS_WORKERS; Pillow releases
+# the GIL while decoding, resizing and encoding). JPEGs are decoded at a
+# reduced scale (draft mode) when that is still above the limit.
+#
+# The file extension always follows the content, e.g. the .jfif of a JPEG
+# becomes .jpg, so ComfyUI lists the upload as an image.
+#
+# Resizing needs Pillow; without it (or with PREPROCESS_IMAGES=0) images are
+# uploaded unchanged apart from the extension.
+
+import functools
+import io
+import logging
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import PREPROCESS_BYTES_SAVED, PREPROCESS_IMAGES_TOTAL, PREPROCESS_SECONDS
+
+PREPROCESS_IMAGES = os.environ.get("PREPROCESS_IMAGES", "1") != "0"
+PREPROCESS_WORKERS = int(os.environ.get("PREPROCESS_WORKERS", min(4, os.cpu_count() or 1)))
+JPEG_QUALITY = 95
+
+# Extensions accepted for each format; the first one replaces any other
+EXTENSIONS = {"png": (".png",), "jpeg": (".jpg", ".jpeg"), "webp": (".webp",), "gif": (".gif",), "bmp": (".bmp",)}
+# Format a resized image is saved in; the rest become PNG
+SAVE_FORMATS = {"png": "PNG", "jpeg": "JPEG", "webp": "WEBP"}
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _jpeg_size(data):
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+        elif marker in JPEG_SOF_MARKERS:
+            return int.from_bytes(data[i + 7:i + 9], "big"), int.from_bytes(data[i + 5:i + 7], "big")
+        elif marker == 0x01 or 0xD0 <= marker <= 0xD8:  # markers without a length
+            i += 2
+        else:
+            i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+
+def _webp_size(data):
+    chunk = data[12:16]
+    if chunk == b"VP8 " and len(data) >= 30:
+        return int.from_bytes(data[26:28], "little") & 0x3FFF, int.from_bytes(data[28:30], "little") & 0x3FFF
+    if chunk == b"VP8L" and len(data) >= 25:
+        bits = int.from_bytes(data[21:25], "little")
+        return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+    if chunk == b"VP8X" and len(data) >= 30:
+        return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+    return None
+
+
+def image_info(data):
+    # (format, width, height) from the header, or None for anything not recognised
+    size = None
+    if data[:8] == b"\x89PNG\r\n\x1a\n" and data[12:16] == b"IHDR":
+        fmt, size = "png", (int.from_bytes(data[16:20], "big"), int.from_bytes(data[20:24], "big"))
+    elif data[:2] == b"\xff\xd8":
+        fmt, size = "jpeg", _jpeg_size(data)
+    elif data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        fmt, size = "webp", _webp_size(data)
+    elif data[:6] in (b"GIF87a", b"GIF89a"):
+        fmt, size = "gif", (int.from_bytes(data[6:8], "little"), int.from_bytes(data[8:10], "little"))
+    elif data[:2] == b"BM" and len(data) >= 26:
+        fmt, size = "bmp", (int.from_bytes(data[18:22], "little"), abs(int.from_bytes(data[22:26], "little", signed=True)))
+    if size is None:
+        return None
+    return fmt, size[0], size[1]
+
+
+def _downscale(data, fmt, max_pixels):
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(data)) as image:
+        scale = math.sqrt(max_pixels / (image.width * image.height))
+        image.draft(None, (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+        # Bake the EXIF orientation in, since the EXIF data is not kept
+        image = ImageOps.exif_transpose(image)
+        scale = math.sqrt(max_pixels / (image.width * image.height))
+        if scale < 1:
+            image = image.resize((max(1, int(image.width * scale)), max(1, int(image.height * scale))),
+                                 Image.LANCZOS)
+        save_format = SAVE_FORMATS.get(fmt, "PNG")
+        options = {"icc_profile": image.info.get("icc_profile")}
+        if save_format == "JPEG":
+            options["quality"] = JPEG_QUALITY
+            if image.mode not in ("RGB", "L", "CMYK"):
+                image = image.convert("RGB")
+        elif save_format == "WEBP":
+            options["quality"] = JPEG_QUALITY
+        out = io.BytesIO()
+        image.save(out, save_format, **{k: v for k, v in options.items() if v is not None})
+    return out.getvalue(), save_format.lower()
+
+
+def _preprocess_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=PREPROCESS_WORKERS, thread_name_prefix="image-preprocess")
+    return _pool
+
+
+@functools.lru_cache(maxsize=None)
+def _pillow_available():
+    try:
+        import PIL  # noqa: F401
+    except ImportError:
+        logger.info("Pillow is not installed, input images above max_megapixels are uploaded unchanged")
+        return False
+    return True
+
+
+def preprocess_image(image_data, filename, max_megapixels=None):
+    # (image_data, filename) to upload: downscaled to max_megapixels (None: no limit), with the
+    # extension of its actual format
+    info = image_info(image_data)
+    if info is None:
+        PREPROCESS_IMAGES_TOTAL.inc(action="unknown")
+        return image_data, filename
+    fmt, width, height = info
+    base, ext = os.path.splitext(filename)
+    normalized = base + (ext if ext.lower() in EXTENSIONS[fmt] else EXTENSIONS[fmt][0])
+
+    if (not PREPROCESS_IMAGES or not max_megapixels or width * height <= max_megapixels * 1e6
+            or not _pillow_available()):
+        PREPROCESS_IMAGES_TOTAL.inc(action="unchanged" if normalized == filename else "renamed")
+        return image_data, normalized
+
+    start = time.perf_counter()
+    try:
+        resized, fmt = _preprocess_pool().submit(_downscale, image_data, fmt, int(max_megapixels * 1e6)).result()
+    except Exception as e:  # Pillow raises several exception types for damaged files
+        logger.warning("Could not downscale %s (%dx%d), uploading it unchanged: %s", filename, width, height, e)
+        PREPROCESS_IMAGES_TOTAL.inc(action="failed")
+        return image_data, normalized
+    PREPROCESS_SECONDS.observe(time.perf_counter() - start)
+    if len(resized) >= len(image_data):  # ComfyUI shrinks it anyway; send the smaller file
+        PREPROCESS_IMAGES_TOTAL.inc(action="unchanged" if normalized == filename else "renamed")
+        return image_data, normalized
+    PREPROCESS_IMAGES_TOTAL.inc(action="resized")
+    PREPROCESS_BYTES_SAVED.inc(len(image_data) - len(resized))
+    logger.debug("Downscaled %s from %dx%d, %d -> %d bytes", filename, width, height, len(image_data), len(resized))
+    return resized, base + EXTENSIONS[fmt][0]
@@ -0,0 +1,254 @@
+# Priority and model-residency-aware scheduling of prompts per ComfyUI backend.
+#
+# Jobs wait here, not in ComfyUI's FIFO: at most MAX_INFLIGHT prompts per
+# backend are queued or running in ComfyUI, and waiting jobs are let through
+# by priority class (interactive, normal, batch), in arrival order within a
+# class. The time each prompt took (from the later of its queuing and the
+# previous prompt finishing) gives the backend's service time, used to
+# estimate how long a new job would wait.
+#
+# Cloth swap (SAM, GroundingDINO, CatVTON) and upscale (RealESRGAN) do not fit
+# in VRAM together, so alternating them makes every job pay for loading its
+# models. Jobs are grouped by the model files their workflow loads (see
+# backends.workflow_requirements). Right before /prompt a job waits for
+# its turn: jobs of the group whose models are loaded go straight through,
+# while another group is held back until that group has drained from the
+# backend. A held job waits at most MAX_WAIT seconds; after that the backend
+# stops taking more jobs of the loaded group so it can switch.
+#
+# Waiting jobs hold no thread: submit() puts a job in line and a single
+# dispatcher thread calls it back once it may go, so every waiting job is
+# ranked, however many there are.
+#
+# The scheduler also tells a job whether more jobs for the same models are
+# queued or waiting, which pipelines use to set cache_model (keep the models
+# loaded after the job) only when something will reuse them.
+#
+# MODEL_SCHEDULING=0 turns grouping off: prompts are queued in arrival order
+# within their priority class.
+
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+MODEL_SCHEDULING = os.environ.get("MODEL_SCHEDULING", "1") != "0"
+MAX_WAIT = float(os.environ.get("MODEL_SCHEDULING_MAX_WAIT", 30))
+MAX_INFLIGHT = int(os.environ.get("MAX_INFLIGHT", 4))  # per backend, 0 for no limit
+SERVICE_TIME_ALPHA = 0.2
+
+PRIORITIES = {"interactive": 0, "normal": 1, "batch": 2}
+
+
+def model_group(requirements):
+    # The model files a workflow loads; workflows without any never wait
+    return tuple(sorted((r for r in requirements if r[1] is not None), key=lambda r: (r[0], r[1], r[2])))
+
+
+class Ticket:
+    def __init__(self, backend_url, group, priority=PRIORITIES["normal"], arrived=None, deadline=None,
+                 cancelled=None, callback=None):
+        self.backend_url = backend_url
+        self.group = group
+        self.priority = priority
+        self.arrived = time.monotonic() if arrived is None else arrived
+        self.deadline = deadline
+        self.cancelled = cancelled
+        self.callback = callback
+        self.admitted = False
+        self.admitted_at = None
+        self.upcoming = 0  # other jobs for the same models queued or waiting when admitted
+
+
+class _BackendState:
+    def __init__(self):
+        self.active = None  # group whose models are (or are being) loaded
+        self.running = Counter()  # group -> admitted jobs not finished yet
+        self.waiting = []  # tickets in arrival order
+        self.service_time = None  # moving average of seconds per prompt
+        self.last_done = 0
+
+    def to_dict(self):
+        return {
+            "active": [r[2] for r in self.active] if self.active else None,
+            "running": sum(self.running.values()),
+            "waiting": len(self.waiting),
+            "waiting_by_priority": {name: sum(1 for t in self.waiting if t.priority == p) for name, p in PRIORITIES.items()},
+            "service_time": round(self.service_time, 3) if self.service_time is not None else None,
+        }
+
+
+class ModelScheduler:
+    def __init__(self, enabled=MODEL_SCHEDULING, max_wait=MAX_WAIT, max_inflight=MAX_INFLIGHT):
+        self.enabled = enabled
+        self.max_wait = max_wait
+        self.max_inflight = max_inflight
+        self._cond = threading.Condition()
+        self._thread = None
+        self._backends = {}
+        self.switches = 0
+        self.held = 0
+        self.held_seconds = 0.0
+
+    def _state(self, backend_url):
+        state = self._backends.get(backend_url)
+        if state is None:
+            state = self._backends[backend_url] = _BackendState()
+        return state
+
+    def _next_switch(self, state, priority, now):
+        # (oldest ticket of the class waiting for another group, seconds until it may force a switch)
+        for ticket in state.waiting:
+            if ticket.priority == priority and ticket.group and ticket.group != state.active:
+                return ticket, ticket.arrived + self.max_wait - now
+        return None, None
+
+    def _can_admit(self, state, ticket, now):
+        if self.max_inflight and sum(state.running.values()) >= self.max_inflight:
+            return False
+        for other in state.waiting:
+            if other is ticket:
+                break
+            # Earlier jobs of the class go first (only those of the same models when grouping)
+            if other.priority == ticket.priority and (not self.enabled or other.group == ticket.group):
+                return False
+        if any(other.priority < ticket.priority for other in state.waiting):
+            return False
+        if not self.enabled or not ticket.group or state.active is None:
+            return True
+        other, remaining = self._next_switch(state, ticket.priority, now)
+        if ticket.group == state.active:
+            return other is None or remaining > 0
+        # Another group: only once the loaded one has drained, oldest waiter first
+        return state.running[state.active] == 0 and other is ticket
+
+    def submit(self, backend_url, group, callback, priority=PRIORITIES["normal"], arrived=None, deadline=None,
+               cancelled=None):
+        # Put a job in line for backend_url without blocking. callback(ticket) is called from the
+        # dispatcher thread once the job may be queued, or callback(None) once deadline
+        # (time.monotonic()) passes or cancelled() is true (see wake()); keep it short.
+        # arrived (time.monotonic()) is when the job came in, before its uploads.
+        ticket = Ticket(backend_url, group, priority, arrived, deadline, cancelled, callback)
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._dispatch_loop, name="model-scheduler", daemon=True)
+                self._thread.start()
+            state = self._state(backend_url)
+            i = len(state.waiting)
+            while i and state.waiting[i - 1].arrived > ticket.arrived:
+                i -= 1
+            state.waiting.insert(i, ticket)
+            self._cond.notify_all()
+        return ticket
+
+    def _dispatch_loop(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                ready = []
+                for state in self._backends.values():
+                    ready += self._dispatch(state, now)
+                if not ready:
+                    self._cond.wait(self._next_timeout(now))
+            for ticket, admitted in ready:
+                try:
+                    ticket.callback(ticket if admitted else None)
+                except Exception:
+                    logger.exception("Error in scheduler callback")
+
+    def _dispatch(self, state, now):
+        # (ticket, admitted) for the waiting jobs that may go now or have given up
+        ready = []
+        for ticket in list(state.waiting):
+            if (ticket.deadline is not None and now >= ticket.deadline) or \
+                    (ticket.cancelled is not None and ticket.cancelled()):
+                state.waiting.remove(ticket)
+                ready.append((ticket, False))
+        changed = True
+        while changed:
+            # Letting a job through can change who is next, so look again until nothing moves
+            changed = False
+            for ticket in list(state.waiting):
+                if self._can_admit(state, ticket, now):
+                    state.waiting.remove(ticket)
+                    self._admit(state, ticket, now)
+                    ready.append((ticket, True))
+                    changed = True
+        return ready
+
+    def _admit(self, state, ticket, now):
+        waited = now - ticket.arrived
+        if waited > 0.001:
+            self.held += 1
+            self.held_seconds += waited
+        if ticket.group:
+            if state.active is not None and ticket.group != state.active:
+                self.switches += 1
+            state.active = ticket.group
+        ticket.upcoming = state.running[ticket.group] + sum(1 for t in state.waiting if t.group == ticket.group)
+        state.running[ticket.group] += 1
+        ticket.admitted = True
+        ticket.admitted_at = now
+
+    def _next_timeout(self, now):
+        # Seconds until a waiting job's deadline or forced model switch, None if there is none
+        timeouts = []
+        for state in self._backends.values():
+            for ticket in state.waiting:
+                if ticket.deadline is not None:
+                    timeouts.append(ticket.deadline - now)
+            for priority in PRIORITIES.values():
+                _, remaining = self._next_switch(state, priority, now)
+                if remaining is not None:
+                    timeouts.append(remaining)
+        return max(min(timeouts), 0.001) if timeouts else None
+
+    def wake(self):
+        # Have the dispatcher check waiting jobs' cancelled() again
+        with self._cond:
+            self._cond.notify_all()
+
+    def done(self, ticket, ran=False):
+        # The job left the backend's queue; ran=True when ComfyUI executed its prompt
+        with self._cond:
+            if ticket.admitted:
+                ticket.admitted = False
+                state = self._state(ticket.backend_url)
+                state.running[ticket.group] -= 1
+                if ran:
+                    now = time.monotonic()
+                    sample = now - max(ticket.admitted_at, state.last_done)
+                    state.last_done = now
+                    if state.service_time is None:
+                        state.service_time = sample
+                    else:
+                        state.service_time += SERVICE_TIME_ALPHA * (sample - state.service_time)
+                self._cond.notify_all()
+
+    def service_time(self, backend_url):
+        with self._cond:
+            return self._state(backend_url).service_time
+
+    def estimated_wait(self, backend_url, priority=PRIORITIES["normal"]):
+        # Seconds until a new job of this priority would start running; None before any prompt finished
+        with self._cond:
+            state = self._state(backend_url)
+            if state.service_time is None:
+                return None
+            ahead = sum(state.running.values()) + sum(1 for t in state.waiting if t.priority <= priority)
+            return ahead * state.service_time
+
+    def status(self):
+        with self._cond:
+            return {
+                "enabled": self.enabled,
+                "max_wait": self.max_wait,
+                "max_inflight": self.max_inflight,
+                "switches": self.switches,
+                "held": self.held,
+                "held_seconds": round(self.held_seconds, 3),
+                "backends": {url: state.to_dict() for url, state in self._backends.items()},
+            }
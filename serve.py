@@ -0,0 +1,137 @@
+# Production entry point, instead of Flask's debug server.
+#
+#   python serve.py                                      (any platform)
+#   gunicorn -c gunicorn.conf.py                         (Linux)
+#
+# python serve.py runs waitress when it is installed, otherwise Werkzeug's
+# threaded server without the debugger and reloader. Settings come from the
+# environment:
+#
+#   API_PIPELINES     pipelines served (default all, see service.py)
+#   HOST, PORT        default 0.0.0.0:5002
+#   THREADS           request threads (default 32)
+#   SHUTDOWN_TIMEOUT  seconds to drain in-flight jobs on shutdown (default 120)
+#   API_APP, WORKERS  under gunicorn: the WSGI app (default serve:create_app())
+#                     and worker processes (default 1)
+#
+# Serve from one process with many threads: jobs, the scheduler and the
+# caches are kept in memory, so GET /jobs/<job_id> must reach the process
+# that took the job, and waiting for ComfyUI is I/O, not CPU.
+#
+# On SIGTERM / SIGINT new jobs get 503 (GET /healthz too, for the load
+# balancer) while job status and result requests are still served; once the
+# in-flight jobs and requests have finished, or after SHUTDOWN_TIMEOUT, the
+# server stops.
+
+import logging
+import os
+import signal
+import threading
+import time
+
+from werkzeug.wsgi import ClosingIterator
+
+import service
+from streaming import get_output_writer
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+THREADS = int(os.environ.get("THREADS", 32))
+SHUTDOWN_TIMEOUT = float(os.environ.get("SHUTDOWN_TIMEOUT", 120))
+PORT = int(os.environ.get("PORT", 5002))
+
+logger = logging.getLogger(__name__)
+
+
+_app = None
+
+
+def create_app():
+    # App factory for WSGI servers: the one app of this process, serving API_PIPELINES
+    global _app
+    if _app is None:
+        _app = service.create_app()
+    return _app
+
+
+class InFlightRequests:
+    # WSGI middleware counting requests whose response has not been fully sent
+    def __init__(self, app):
+        self.app = app
+        self.count = 0
+        self._cond = threading.Condition()
+
+    def __call__(self, environ, start_response):
+        with self._cond:
+            self.count += 1
+        try:
+            return ClosingIterator(self.app(environ, start_response), self._done)
+        except BaseException:
+            self._done()
+            raise
+
+    def _done(self):
+        with self._cond:
+            self.count -= 1
+            self._cond.notify_all()
+
+    def wait_idle(self, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.count <= 0, timeout)
+
+
+def drain(app, requests=None, timeout=SHUTDOWN_TIMEOUT):
+    # Stop taking jobs and wait for the in-flight ones (and their responses); True if all finished
+    deadline = time.monotonic() + timeout
+    job_manager = app.extensions.get("job_manager")
+    drained = job_manager.drain(timeout) if job_manager is not None else True
+    if requests is not None:
+        drained = requests.wait_idle(max(deadline - time.monotonic(), 0)) and drained
+    if not drained:
+        logger.warning("Shutting down with jobs or requests still in progress after %.0fs", timeout)
+    get_output_writer().flush()  # background copies of input and output images
+    return drained
+
+
+def _make_server(app, host, port):
+    # (serve_forever, stop) for waitress, or Werkzeug's threaded server
+    try:
+        from waitress.server import create_server
+    except ImportError:
+        from werkzeug.serving import make_server
+        server = make_server(host, port, app, threaded=True)
+        logger.info("waitress is not installed, serving with Werkzeug's threaded server")
+        return server.serve_forever, server.shutdown
+    # With a request of lookahead waitress keeps reading the connection while a request runs,
+    # so a client that hangs up is noticed and its job cancelled (jobs.client_disconnected)
+    server = create_server(app, host=host, port=port, threads=THREADS, channel_request_lookahead=1)
+    return server.run, server.close
+
+
+def run(app, host=HOST, port=5002):
+    requests = InFlightRequests(app.wsgi_app)
+    app.wsgi_app = requests
+    serve_forever, stop = _make_server(app, host, port)
+    stopping = threading.Event()
+
+    def shutdown(signum, frame):
+        if stopping.is_set():
+            return
+        stopping.set()
+        logger.info("Received signal %d, draining in-flight jobs (up to %.0fs)", signum, SHUTDOWN_TIMEOUT)
+
+        def drain_and_stop():
+            drain(app, requests)
+            stop()
+
+        threading.Thread(target=drain_and_stop, name="shutdown", daemon=True).start()
+
+    for name in ("SIGTERM", "SIGINT", "SIGBREAK"):  # SIGBREAK: Ctrl+Break on Windows
+        if hasattr(signal, name):
+            signal.signal(getattr(signal, name), shutdown)
+    logger.info("Serving %s on http://%s:%d", app.name, host, port)
+    serve_forever()
+    logger.info("Server stopped")
+
+
+if __name__ == '__main__':
+    run(create_app(), HOST, PORT)
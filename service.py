@@ -0,0 +1,51 @@
+# One API process serving every pipeline.
+#
+# The shared core (ComfyUI client and completion listener, job manager and
+# scheduler, upload / result / mask caches, logging, metrics, tracing) is set
+# up once, and each pipeline is a plugin from pipelines/ adding its own
+# routes, so cloth swap and upscale jobs share the backends, the scheduler
+# and the caches instead of running as separate apps on separate ports.
+#
+#   API_PIPELINES   comma-separated plugins to serve (default: all of
+#                   pipelines.PLUGINS), e.g. "upscale,run"
+#   COMFYUI_URLS    comma-separated ComfyUI backends (default COMFYUI_URL)
+#
+# Startup only registers routes: plugins are imported when loaded, and the
+# workflow directory, the caches and the image folders are read or created
+# on first use.
+
+import os
+
+from flask import Flask
+
+import comfy_client
+import logs
+import mask_cache
+import metrics
+import pipelines
+import result_cache
+import tracing
+import upload_cache
+from jobs import JobManager
+from pipelines.common import OUTPUT_FOLDER
+
+COMFYUI_URL = os.environ.get("COMFYUI_URL", "http://127.0.0.1:8188")
+COMFYUI_URLS = [url for url in os.environ.get("COMFYUI_URLS", COMFYUI_URL).split(",") if url]
+API_PIPELINES = [name.strip() for name in os.environ.get("API_PIPELINES", ",".join(pipelines.PLUGINS)).split(",")
+                 if name.strip()]
+
+
+def create_app(names=None, import_name=__name__):
+    # names: plugins to serve (default API_PIPELINES); the job manager is app.extensions["job_manager"]
+    app = Flask(import_name, static_folder=OUTPUT_FOLDER, static_url_path=f'/{os.path.basename(OUTPUT_FOLDER)}')
+    logs.init_app(app)
+    tracing.init_app(app)
+    job_manager = JobManager(app, COMFYUI_URLS)
+    comfy_client.init_app(app)
+    metrics.init_app(app)
+    upload_cache.init_app(app)
+    result_cache.init_app(app)
+    mask_cache.init_app(app)
+    for name in API_PIPELINES if names is None else names:
+        pipelines.load(name).init_app(app, job_manager)
+    return app
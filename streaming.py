@@ -0,0 +1,221 @@
+# Streaming of result images from ComfyUI /view to the HTTP client.
+#
+# Instead of fetching each output fully into memory, writing it to
+# OUTPUT_FOLDER, polling for the file and reading it back for base64, the
+# /view body is piped to the client in chunks, as raw bytes for a single
+# output or multipart/mixed for several. Saving a copy to disk is optional and done by a
+# background writer thread, off the request path.
+
+import base64
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+from flask import Response
+
+from comfy_client import fetch_pool
+from metrics import OUTPUT_WRITE_SECONDS, VIEW_BYTES
+
+STREAM_CHUNK_SIZE = 64 * 1024
+SAVE_OUTPUTS = os.environ.get("SAVE_OUTPUTS", "1") != "0"
+
+logger = logging.getLogger(__name__)
+
+
+class OutputWriter:
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="output-writer", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        files = {}
+        elapsed = {}  # handle -> seconds spent writing the file so far
+        failed = set()
+        folders = set()  # created on the first file written to them, not at startup
+        while True:
+            handle, path, op, chunk = self._queue.get()
+            try:
+                self._apply(files, elapsed, failed, folders, handle, path, op, chunk)
+            finally:
+                self._queue.task_done()
+
+    def _apply(self, files, elapsed, failed, folders, handle, path, op, chunk):
+        if handle in failed:
+            if op != "write":
+                failed.discard(handle)
+            return
+        start = time.perf_counter()
+        try:
+            if handle not in files:
+                folder = os.path.dirname(path)
+                if folder and folder not in folders:
+                    os.makedirs(folder, exist_ok=True)
+                    folders.add(folder)
+                files[handle] = open(f"{path}.part", "wb")
+                elapsed[handle] = 0.0
+            if op == "write":
+                files[handle].write(chunk)
+                elapsed[handle] += time.perf_counter() - start
+                return
+            files.pop(handle).close()
+            if op == "close":
+                os.replace(f"{path}.part", path)
+                OUTPUT_WRITE_SECONDS.observe(elapsed.pop(handle) + time.perf_counter() - start)
+            else:
+                os.remove(f"{path}.part")
+                elapsed.pop(handle)
+        except OSError as e:
+            logger.error("Error writing output image %s: %s", path, e)
+            f = files.pop(handle, None)
+            elapsed.pop(handle, None)
+            if f is not None:
+                f.close()
+            if op == "write":
+                failed.add(handle)
+
+    def flush(self):
+        # Wait until everything queued so far is on disk
+        self._queue.join()
+
+    def open(self, path):
+        return OutputFile(self._queue, path)
+
+    def write(self, path, data):
+        f = self.open(path)
+        f.write(data)
+        f.close()
+
+
+class OutputFile:
+    def __init__(self, write_queue, path):
+        self._queue = write_queue
+        self._handle = uuid.uuid4().hex
+        self.path = path
+
+    def write(self, chunk):
+        if chunk:
+            self._queue.put((self._handle, self.path, "write", chunk))
+
+    def close(self):
+        self._queue.put((self._handle, self.path, "close", None))
+
+    def abort(self):
+        self._queue.put((self._handle, self.path, "abort", None))
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_output_writer():
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = OutputWriter()
+    return _writer
+
+
+class StreamPart:
+    # One image of a streamed response: either a /view reference or bytes already in memory
+    def __init__(self, name, image_ref=None, data=None, save_path=None):
+        self.name = name
+        self.image_ref = image_ref
+        self.data = data
+        self.save_path = save_path
+        self._response = None
+        self._backend = None
+
+    def open(self, client):
+        # Issue the /view request up front so errors surface before the response starts
+        if self.data is None and self._response is None:
+            params = {
+                "filename": self.image_ref["filename"],
+                "subfolder": self.image_ref.get("subfolder", ""),
+                "type": self.image_ref.get("type", "temp"),
+            }
+            self._response = client.safe_request("GET", "/view", params=params, stream=True)
+            self._backend = client.base_url
+
+    def close(self):
+        if self._response is not None:
+            self._response.close()
+
+    def chunks(self):
+        out = get_output_writer().open(self.save_path) if self.save_path else None
+        received = 0
+        try:
+            if self.data is not None:
+                source = (self.data[i:i + STREAM_CHUNK_SIZE] for i in range(0, len(self.data), STREAM_CHUNK_SIZE))
+            else:
+                source = self._response.iter_content(STREAM_CHUNK_SIZE)
+            for chunk in source:
+                received += len(chunk)
+                if out:
+                    out.write(chunk)
+                yield chunk
+        except BaseException:
+            if out:
+                out.abort()
+                out = None
+            raise
+        finally:
+            if out:
+                out.close()
+            if self._backend is not None:
+                VIEW_BYTES.inc(received, backend=self._backend)
+            self.close()
+
+
+def parts_from_payload(payload, keys):
+    # Rebuild stream parts from a base64 JSON payload (e.g. a cached result); further
+    # images of an output are stored as "<name>_<i>_image_base64"
+    parts = []
+    for name, key in keys:
+        if payload.get(key):
+            parts.append(StreamPart(name, data=base64.b64decode(payload[key])))
+        i = 1
+        while payload.get(f"{name}_{i}_image_base64"):
+            parts.append(StreamPart(f"{name}_{i}", data=base64.b64decode(payload[f"{name}_{i}_image_base64"])))
+            i += 1
+    return parts
+
+
+def stream_response(client, parts, multipart=False, mimetype="image/png"):
+    # Open every /view request concurrently, so a multipart response waits for the slowest
+    # output once instead of for each output in turn
+    try:
+        if len(parts) > 1:
+            for future in [fetch_pool().submit(part.open, client) for part in parts]:
+                future.result()
+        else:
+            for part in parts:
+                part.open(client)
+    except Exception:
+        for part in parts:
+            part.close()
+        raise
+
+    if len(parts) == 1 and not multipart:
+        part = parts[0]
+        return Response(part.chunks(), mimetype=mimetype, headers={
+            "Content-Disposition": f'inline; filename="{part.name}.png"',
+        })
+
+    boundary = uuid.uuid4().hex
+
+    def generate():
+        for part in parts:
+            yield (
+                f"--{boundary}\r\n"
+                f"Content-Type: {mimetype}\r\n"
+                f'Content-Disposition: attachment; name="{part.name}"; filename="{part.name}.png"\r\n\r\n'
+            ).encode('utf-8')
+            yield from part.chunks()
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode('utf-8')
+
+    return Response(generate(), content_type=f"multipart/mixed; boundary={boundary}")
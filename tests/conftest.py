@@ -0,0 +1,89 @@
+# Smoke tests run the whole app (service.create_app()) against the fake
+# ComfyUI backend from fake_comfyui.py, so they need no GPU:
+#
+#   python -m pytest -q
+
+import os
+import sys
+
+import flask
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_comfyui import FakeComfyUI
+
+EXEC_TIME = 0.05
+
+
+@pytest.fixture(scope="session")
+def fake_comfyui():
+    fake = FakeComfyUI(exec_time=EXEC_TIME).start()
+    yield fake
+    fake.stop()
+
+
+@pytest.fixture(scope="session")
+def app(fake_comfyui, tmp_path_factory):
+    # Settings are read when the modules are imported, so the app is built once per session
+    work = tmp_path_factory.mktemp("service")
+    os.environ.update(
+        COMFYUI_URLS=fake_comfyui.url,
+        UPLOAD_CACHE_PATH=str(work / "cache" / "uploads.json"),
+        RESULT_CACHE_DIR=str(work / "cache" / "results"),
+        MASK_CACHE_DIR=str(work / "cache" / "masks"),
+        OUTPUT_FOLDER=str(work / "output_images"),
+        INPUT_FOLDER=str(work / "input"),
+        SAVE_OUTPUTS="0",
+        LOG_LEVEL="WARNING",
+    )
+    import service
+
+    return service.create_app()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def slow_comfyui(fake_comfyui):
+    # Prompts that run long enough to be cancelled or to miss a deadline
+    fake_comfyui.exec_time = 2.0
+    yield fake_comfyui
+    fake_comfyui.exec_time = EXEC_TIME
+
+
+@pytest.fixture
+def make_manager(app):
+    # A JobManager of its own, with one MAX_INFLIGHT=1 scheduler, over the given fake backends
+    from jobs import JobManager, PendingPrompt
+    from scheduler import ModelScheduler
+
+    fakes = []
+    managers = []
+
+    def make(*exec_times):
+        fakes.extend(FakeComfyUI(exec_time=t).start() for t in exec_times)
+        manager = JobManager(flask.Flask(__name__), [fake.url for fake in fakes])
+        managers.append(manager)
+        manager.scheduler = ModelScheduler(max_inflight=1)
+
+        def submit(comfyui_url):
+            graph = {
+                "1": {"class_type": "LoadImage", "inputs": {"image": "blank.png"}},
+                "2": {"class_type": "PreviewImage", "inputs": {"images": ["1", 0]}},
+            }
+            return PendingPrompt(lambda keep_models: graph, {})
+
+        manager.add_pipeline("echo", submit, lambda outputs, context, url: {"backend": url})
+        return manager, fakes
+
+    yield make
+    # Jobs a failed test left behind would otherwise wait out their deadline on a stopped backend
+    for manager in managers:
+        for job in list(manager._jobs.values()):
+            manager.cancel(job, "test finished")
+    for fake in fakes:
+        fake.stop()
@@ -0,0 +1,28 @@
+GRAPH = {
+    "1": {"class_type": "LoadImage", "inputs": {"image": "blank.png"}},
+    "2": {"class_type": "PreviewImage", "inputs": {"images": ["1", 0]}},
+}
+
+
+def test_history_fallback_without_websocket(app, fake_comfyui):
+    # A listener that never connected still finds the outputs by polling /history
+    from comfy_client import get_client
+    from comfy_completion import CompletionListener
+
+    listener = CompletionListener(fake_comfyui.url, poll_interval=0.05)
+    assert not listener.connected
+    before = fake_comfyui.request_counts.get("/history", 0)
+    prompt_id = get_client(fake_comfyui.url).queue_prompt(GRAPH, listener.client_id)["prompt_id"]
+    outputs = listener.wait_for_outputs(prompt_id, timeout=5)
+    assert outputs["2"]["images"]
+    assert fake_comfyui.request_counts["/history"] > before
+
+
+def test_history_fallback_times_out(app, slow_comfyui):
+    from comfy_client import get_client
+    from comfy_completion import CompletionListener
+
+    listener = CompletionListener(slow_comfyui.url, poll_interval=0.05)
+    prompt_id = get_client(slow_comfyui.url).queue_prompt(GRAPH, listener.client_id)["prompt_id"]
+    assert listener.wait_for_outputs(prompt_id, timeout=0.3) is None
+    get_client(slow_comfyui.url).cancel_prompt(prompt_id)
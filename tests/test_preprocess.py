@@ -0,0 +1,45 @@
+import io
+
+import pytest
+
+
+def encode(fmt, size=(321, 123), mode="RGB"):
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new(mode, size, (200, 120, 40)).save(out, fmt)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize("fmt,name", [("PNG", "png"), ("JPEG", "jpeg"), ("WEBP", "webp"), ("GIF", "gif"),
+                                      ("BMP", "bmp")])
+def test_image_info(app, fmt, name):
+    from preprocess import image_info
+
+    assert image_info(encode(fmt)) == (name, 321, 123)
+
+
+def test_image_info_lossless_webp_and_unknown(app):
+    from PIL import Image
+
+    from preprocess import image_info
+
+    out = io.BytesIO()
+    Image.new("RGBA", (77, 55)).save(out, "WEBP", lossless=True)
+    assert image_info(out.getvalue()) == ("webp", 77, 55)
+    assert image_info(b"not an image") is None
+    assert image_info(b"") is None
+
+
+def test_preprocess_image(app):
+    from preprocess import image_info, preprocess_image
+
+    data = encode("JPEG", (2000, 1000))
+    # Renamed to its actual format, not resized when within the limit
+    assert preprocess_image(data, "photo.jfif", max_megapixels=4) == (data, "photo.jpg")
+    assert preprocess_image(data, "photo.JPEG") == (data, "photo.JPEG")
+    resized, filename = preprocess_image(data, "photo.jfif", max_megapixels=0.5)
+    fmt, width, height = image_info(resized)
+    assert filename == "photo.jpg" and fmt == "jpeg"
+    assert width * height <= 0.5e6 and abs(width / height - 2) < 0.01
+    assert preprocess_image(b"unknown", "file.png", max_megapixels=0.5) == (b"unknown", "file.png")
@@ -0,0 +1,37 @@
+import os
+import threading
+
+from result_cache import ResultCache
+
+
+def test_put_and_get(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=1 << 20, ttl=60)
+    assert cache.get("a") is None
+    cache.put("a", {"value": 1})
+    assert cache.get("a") == {"value": 1}
+    assert (cache.hits, cache.misses) == (1, 1)
+    # A new instance finds the entries already on disk
+    assert ResultCache(str(tmp_path), max_bytes=1 << 20, ttl=60).get("a") == {"value": 1}
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(str(tmp_path), max_bytes=150, ttl=60)
+    cache.put("a", {"value": "x" * 40})
+    cache.put("b", {"value": "x" * 40})
+    cache.get("a")
+    cache.put("c", {"value": "x" * 40})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_concurrent_puts_of_one_key(tmp_path, caplog):
+    cache = ResultCache(str(tmp_path), max_bytes=1 << 30, ttl=60)
+    payloads = [{"writer": i, "value": "x" * 1000000} for i in range(16)]
+    threads = [threading.Thread(target=cache.put, args=("a", payload)) for payload in payloads]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not [record for record in caplog.records if "Error writing cache entry" in record.getMessage()]
+    assert cache.get("a") in payloads
+    assert os.listdir(tmp_path) == ["a.json"]
@@ -0,0 +1,153 @@
+import time
+
+
+def submit(manager, client, priority="normal", count=1, deadline=None):
+    headers = {"X-Client-Id": client, "X-Priority": priority}
+    if deadline is not None:
+        headers["X-Deadline"] = str(deadline)
+    with manager.app.test_request_context(headers=headers):
+        if count == 1:
+            return [manager.submit("echo")]
+        return manager.submit_batch("echo", [manager.pipelines["echo"].submit] * count)
+
+
+def test_routing_prefers_the_faster_backend(make_manager):
+    manager, (fast, slow) = make_manager(0.05, 2.0)
+    # One job on each, so both have a service time
+    warmup = submit(manager, "a") + submit(manager, "b")
+    assert {job.backend for job in warmup} == {fast.url, slow.url}
+    for job in warmup:
+        assert job.done.wait(10)
+
+    # Once some 20 jobs wait for the fast backend, the slow one is as quick for the next
+    jobs = [job for i in range(40) for job in submit(manager, str(i))]
+    assert sum(job.backend == slow.url for job in jobs) <= 3
+    for job in jobs:
+        assert job.done.wait(10) and job.status == "succeeded"
+
+
+def test_interactive_job_overtakes_waiting_batches(make_manager):
+    manager, _ = make_manager(0.05)
+    batches = [submit(manager, f"batch{i}", "batch", count=50) for i in range(2)]
+    time.sleep(0.2)
+    start = time.monotonic()
+    job, = submit(manager, "interactive", "interactive")
+    assert job.done.wait(10) and job.status == "succeeded"
+    # Behind at most the prompt that is running, not the 100 batch jobs
+    assert time.monotonic() - start < 1
+    assert any(not job.done.is_set() for batch in batches for job in batch)
+
+
+def test_waiting_job_deadline_and_cancel(make_manager):
+    manager, _ = make_manager(1.0)
+    running, = submit(manager, "a")
+    late, = submit(manager, "b", deadline=0.3)
+    cancelled, = submit(manager, "c")
+    assert manager.cancel(cancelled, "deleted")
+    assert cancelled.done.wait(1) and cancelled.status == "cancelled" and cancelled.prompt_id is None
+    assert late.done.wait(1) and late.http_status == 504 and late.prompt_id is None
+    assert running.done.wait(10) and running.status == "succeeded"
+
+
+def test_client_limit(make_manager, monkeypatch):
+    import jobs
+
+    monkeypatch.setattr(jobs, "MAX_JOBS_PER_CLIENT", 2)
+    manager, _ = make_manager(0.5)
+    first = submit(manager, "c") + submit(manager, "c")
+    refused, = submit(manager, "c")
+    assert refused.http_status == 429 and refused.retry_after >= 1
+    assert all(job.http_status == 429 for job in submit(manager, "c", count=3))
+    other, = submit(manager, "d")
+    assert other.http_status is None
+    for job in first:
+        assert job.done.wait(10)
+    again, = submit(manager, "c")
+    assert again.done.wait(10) and again.status == "succeeded"
+
+
+def test_estimated_wait_beyond_deadline(make_manager):
+    manager, _ = make_manager(0.3)
+    warmup, = submit(manager, "a")
+    assert warmup.done.wait(10)
+    queued = [job for i in range(4) for job in submit(manager, str(i))]
+    late, = submit(manager, "late", deadline=0.5)
+    assert late.http_status == 429
+    assert late.result["estimated_wait"] > 0 and late.retry_after >= 1
+    for job in queued:
+        assert job.done.wait(10) and job.status == "succeeded"
+
+
+def scheduler_calls(scheduler):
+    # submit(name, group, **kwargs) through scheduler, and the list of (name, ticket) calls back
+    calls = []
+
+    def put(name, group, **kwargs):
+        return scheduler.submit("backend", group, lambda ticket: calls.append((name, ticket)), **kwargs)
+
+    return put, calls
+
+
+def settle(calls, count, timeout=2):
+    deadline = time.monotonic() + timeout
+    while len(calls) < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)  # nothing else comes
+    return [name for name, _ in calls]
+
+
+UPSCALE = (("UpscaleModelLoader", "model_name", "RealESRGAN_x4.pth"),)
+SEGMENT = (("LayerMask: SegmentAnythingUltra V2", "sam_model", "sam_vit_h (2.56GB)"),)
+
+
+def test_scheduler_groups_jobs_by_models():
+    from scheduler import ModelScheduler
+
+    scheduler = ModelScheduler(enabled=True, max_wait=30, max_inflight=0)
+    put, calls = scheduler_calls(scheduler)
+    put("up1", UPSCALE)
+    put("seg", SEGMENT)
+    put("up2", UPSCALE)
+    # The loaded models' jobs go first; the other group waits until they have drained
+    assert settle(calls, 2) == ["up1", "up2"]
+    assert calls[1][1].upcoming == 1
+    scheduler.done(calls[0][1], ran=True)
+    assert settle(calls, 3) == ["up1", "up2"]
+    scheduler.done(calls[1][1], ran=True)
+    assert settle(calls, 3) == ["up1", "up2", "seg"]
+    assert scheduler.switches == 1
+
+
+def test_scheduler_switches_after_max_wait():
+    from scheduler import ModelScheduler
+
+    scheduler = ModelScheduler(enabled=True, max_wait=0.2, max_inflight=0)
+    put, calls = scheduler_calls(scheduler)
+    put("up1", UPSCALE)
+    put("seg", SEGMENT)
+    assert settle(calls, 1) == ["up1"]
+    time.sleep(0.25)
+    # seg has waited long enough: no more upscale jobs until it has run
+    put("up2", UPSCALE)
+    assert settle(calls, 2) == ["up1"]
+    scheduler.done(calls[0][1], ran=True)
+    assert settle(calls, 2) == ["up1", "seg"]
+
+
+def test_scheduler_priority_and_deadline():
+    from scheduler import PRIORITIES, ModelScheduler
+
+    scheduler = ModelScheduler(enabled=False, max_inflight=1)
+    put, calls = scheduler_calls(scheduler)
+    put("running", ())
+    assert settle(calls, 1) == ["running"]
+    put("batch", (), priority=PRIORITIES["batch"])
+    put("late", (), deadline=time.monotonic() + 0.1)
+    put("interactive", (), priority=PRIORITIES["interactive"])
+    # The job past its deadline is called back with None while the backend is still busy
+    assert settle(calls, 2) == ["running", "late"] and calls[1][1] is None
+    scheduler.done(calls[0][1], ran=True)
+    assert settle(calls, 3) == ["running", "late", "interactive"]
+    scheduler.done(calls[2][1], ran=True)
+    assert settle(calls, 4) == ["running", "late", "interactive", "batch"]
+    assert scheduler.service_time("backend") is not None
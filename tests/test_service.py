@@ -0,0 +1,231 @@
+import io
+import json
+import threading
+import time
+import uuid
+
+
+def image(name="image.png"):
+    # New content every time, so neither the upload nor the result cache answers
+    return io.BytesIO(uuid.uuid4().bytes), name
+
+
+def wait_for_job(client, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = client.get(f"/jobs/{job_id}").get_json()
+        if status["status"] in ("succeeded", "failed", "cancelled"):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} not done after {timeout}s")
+
+
+def test_cloth_swap(client):
+    response = client.post("/cloth_swap", data={
+        "person_image": image("person.png"), "cloth_image": image("cloth.png"), "prompt": "shirt"})
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload["cloth_image_base64"] and payload["mask_image_base64"]
+    assert "Server-Timing" in response.headers
+
+
+def test_cloth_swap_missing_input(client):
+    response = client.post("/cloth_swap", data={"person_image": image(), "prompt": "shirt"})
+    assert response.status_code == 400
+    assert response.get_json()["error"]
+
+
+def test_upscale_image(client):
+    response = client.post("/upscale_image", data={"image": image()})
+    assert response.status_code == 200
+    assert response.get_json()["output_image_base64"]
+
+
+def test_upscale_image_raw(client):
+    response = client.post("/upscale_image", data={"image": image()}, headers={"Accept": "image/png"})
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+
+
+def test_run_workflow(client):
+    response = client.post("/run/realesrgan_upscale", data={"4.image": image()})
+    assert response.status_code == 200
+    payload = response.get_json()
+    assert payload["workflow"] == "realesrgan_upscale"
+    assert any(key.endswith("_image_base64") for key in payload)
+
+
+def test_run_unknown_workflow(client):
+    assert client.post("/run/no_such_workflow", data={}).status_code == 404
+
+
+def test_job_status_and_result(client):
+    response = client.post("/jobs/upscale", data={"image": image()})
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    assert wait_for_job(client, job_id)["status"] == "succeeded"
+    result = client.get(f"/jobs/{job_id}/result")
+    assert result.status_code == 200
+    assert result.get_json()["output_image_base64"]
+
+
+def test_stream_job_result_as_json(client):
+    job_id = client.post("/jobs/upscale?stream=1", data={"image": image()}).get_json()["job_id"]
+    assert wait_for_job(client, job_id)["status"] == "succeeded"
+    assert client.get(f"/jobs/{job_id}/result").get_json()["output_image_base64"]
+    assert client.get(f"/jobs/{job_id}/result?stream=1").mimetype == "image/png"
+
+
+def test_stream_job_collected_once(app, fake_comfyui):
+    client = app.test_client()
+    job_id = client.post("/jobs/upscale?stream=1", data={"image": image()}).get_json()["job_id"]
+    assert wait_for_job(client, job_id)["status"] == "succeeded"
+    before = fake_comfyui.request_counts.get("/view", 0)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(app.test_client().get(f"/jobs/{job_id}/result")))
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert client.get(f"/jobs/{job_id}/result").status_code == 200
+    assert all(result.status_code == 200 and result.get_json()["output_image_base64"] for result in results)
+    assert fake_comfyui.request_counts["/view"] == before + 1
+    assert client.get(f"/jobs/{job_id}/result?stream=1").mimetype == "image/png"
+
+
+def test_unknown_job(client):
+    assert client.get("/jobs/nope").status_code == 404
+    assert client.delete("/jobs/nope").status_code == 404
+
+
+def test_cancel_job(client, slow_comfyui):
+    job_id = client.post("/jobs/upscale", data={"image": image()}).get_json()["job_id"]
+    response = client.delete(f"/jobs/{job_id}")
+    assert response.status_code == 200
+    assert response.get_json()["status"] == "cancelled"
+    assert client.get(f"/jobs/{job_id}/result").status_code == 410
+    assert client.delete(f"/jobs/{job_id}").status_code == 409
+
+
+def test_deadline(client, slow_comfyui):
+    response = client.post("/upscale_image", data={"image": image()}, headers={"X-Deadline": "0.5"})
+    assert response.status_code == 504
+
+
+def test_cloth_swap_batch(client):
+    # More jobs than MAX_JOBS_PER_CLIENT: a batch is one request
+    count = 20
+    response = client.post("/cloth_swap/batch", data={
+        "person_image": image("person.png"),
+        "cloth_image": [image(f"cloth_{i}.png") for i in range(count)],
+        "prompt": "shirt",
+    })
+    assert response.status_code == 200
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert len(lines[0]["job_ids"]) == count
+    assert sorted(line["index"] for line in lines[1:]) == list(range(count))
+    assert all(line["status"] == "succeeded" for line in lines[1:])
+
+
+def test_cloth_swap_batch_rejected(client):
+    response = client.post("/cloth_swap/batch", data={
+        "person_image": image(), "cloth_image": [image(), image()], "prompt": "shirt"},
+        headers={"X-Priority": "urgent"})
+    assert response.status_code == 400
+    assert response.mimetype == "application/json"
+
+
+def test_unexpected_error_finishes_job(app, client, monkeypatch):
+    def submit(comfyui_url):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(app.extensions["job_manager"].pipelines["upscale"], "submit", submit)
+    response = client.post("/upscale_image", data={"image": image()})
+    assert response.status_code == 500
+    assert response.get_json()["details"] == "boom"
+    assert client.get("/healthz").get_json()["active_jobs"] == 0
+
+
+def test_image_limits(app):
+    from workflow_registry import image_limits
+
+    graph = {
+        "1": {"class_type": "LoadImage", "inputs": {"image": "a.png"}},
+        "2": {"class_type": "LoadImage", "inputs": {"image": "b.png"}},
+        "3": {"class_type": "Segment", "inputs": {"image": ["1", 0], "max_megapixels": 2}},
+        "4": {"class_type": "Segment", "inputs": {"image": ["2", 0], "max_megapixels": 2}},
+        "5": {"class_type": "TryOn", "inputs": {"image": ["1", 0]}},
+    }
+    # Image 1 also goes to a node that wants it at full size
+    assert image_limits(graph) == {"2": 2}
+
+
+def test_rejected_prompt_is_not_retried(client, fake_comfyui):
+    # ComfyUI answers 400 with node_errors; the request fails at once instead of being resent
+    before = fake_comfyui.request_counts.get("/prompt", 0)
+    response = client.post("/run/realesrgan_upscale", data={"4.image": image(), "7.upscale_method": "nope"})
+    assert response.status_code == 400
+    assert "7" in response.get_json()["node_errors"]
+    assert fake_comfyui.request_counts["/prompt"] == before + 1
+
+
+def test_result_cache(client, fake_comfyui):
+    data = uuid.uuid4().bytes
+    first = client.post("/upscale_image", data={"image": (io.BytesIO(data), "image.png")})
+    assert first.status_code == 200
+    hits = client.get("/comfyui/result_cache").get_json()["hits"]
+    prompts = fake_comfyui.request_counts["/prompt"]
+    second = client.post("/upscale_image", data={"image": (io.BytesIO(data), "image.png")})
+    assert second.get_json()["output_image_base64"] == first.get_json()["output_image_base64"]
+    assert client.get("/comfyui/result_cache").get_json()["hits"] == hits + 1
+    assert fake_comfyui.request_counts["/prompt"] == prompts
+
+
+def test_mask_cache(client, fake_comfyui):
+    # The same person and prompt with another cloth reuses the segmentation mask
+    person = uuid.uuid4().bytes
+    for cloth in ("cloth1.png", "cloth2.png"):
+        response = client.post("/cloth_swap", data={
+            "person_image": (io.BytesIO(person), "person.png"), "cloth_image": image(cloth), "prompt": "shirt"})
+        assert response.status_code == 200
+    assert client.get("/comfyui/mask_cache").get_json()["hits"] >= 1
+    graph = list(fake_comfyui.prompts.values())[-1]["prompt"]
+    class_types = {node["class_type"] for node in graph.values()}
+    assert "LoadImageMask" in class_types
+    assert not any("SegmentAnything" in class_type for class_type in class_types)
+
+
+def test_metrics(client):
+    assert client.post("/upscale_image", data={"image": image()}).status_code == 200
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    text = response.get_data(as_text=True)
+    assert 'comfyui_api_stage_seconds_bucket{' in text
+    assert 'comfyui_api_jobs_total{' in text and 'status="succeeded"' in text
+
+
+def test_job_events(client):
+    job_id = client.post("/jobs/upscale", data={"image": image()}).get_json()["job_id"]
+    response = client.get(f"/jobs/{job_id}/events")
+    assert response.mimetype == "text/event-stream"
+    events = [block.split("\n") for block in response.get_data(as_text=True).strip().split("\n\n")]
+    names = [lines[0][len("event: "):] for lines in events if lines[0].startswith("event: ")]
+    assert names[0] == "status" and names[-1] == "done"
+    done = json.loads(events[-1][1][len("data: "):])
+    assert done["status"] == "succeeded" and done["result_url"].endswith(f"/jobs/{job_id}/result")
+
+
+def test_too_many_jobs_per_client(client, slow_comfyui, monkeypatch):
+    import jobs
+
+    monkeypatch.setattr(jobs, "MAX_JOBS_PER_CLIENT", 1)
+    headers = {"X-Client-Id": "busy"}
+    job_id = client.post("/jobs/upscale", data={"image": image()}, headers=headers).get_json()["job_id"]
+    response = client.post("/jobs/upscale", data={"image": image()}, headers=headers)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
+    other = client.post("/jobs/upscale", data={"image": image()}, headers={"X-Client-Id": "other"})
+    assert other.status_code == 202
+    for job_id in (job_id, other.get_json()["job_id"]):
+        assert client.delete(f"/jobs/{job_id}").status_code == 200
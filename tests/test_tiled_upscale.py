@@ -0,0 +1,85 @@
+import io
+
+
+def big_image(width=2500, height=700):
+    from PIL import Image
+
+    out = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 120, 40)).save(out, "PNG")
+    return io.BytesIO(out.getvalue()), "big.png"
+
+
+def test_tiled_upscale(client):
+    response = client.post("/upscale_image/tiled", data={"image": big_image()}, headers={"Accept": "image/png"})
+    assert response.status_code == 200
+    assert response.mimetype == "image/png"
+    assert response.headers["X-Tiles"] == "3x1"
+
+
+def test_tiles_share_the_request_slot(app, client, monkeypatch):
+    # The client's other request and the tiled one fill its slots; the tiles take none
+    import jobs
+
+    monkeypatch.setattr(jobs, "MAX_JOBS_PER_CLIENT", 2)
+    manager = app.extensions["job_manager"]
+    with app.test_request_context(headers={"X-Client-Id": "tiles"}):
+        other = manager.admit_request()
+    try:
+        response = client.post("/upscale_image/tiled", data={"image": big_image()}, headers={"X-Client-Id": "tiles"})
+        assert response.status_code == 200
+        response = client.post("/upscale_image/tiled", data={"image": big_image()}, headers={"X-Client-Id": "tiles"})
+        assert response.status_code == 200
+    finally:
+        manager.finish_request(other)
+
+
+def test_tile_upload_failure_is_retried(client, monkeypatch):
+    from pipelines import tiled_upscale
+
+    upload, failed = tiled_upscale.upload_image_to_comfyui, []
+
+    def flaky_upload(image_data, filename, comfyui_url):
+        if filename.endswith("_tile1.png") and not failed:
+            failed.append(filename)
+            return None
+        return upload(image_data, filename, comfyui_url)
+
+    monkeypatch.setattr(tiled_upscale, "upload_image_to_comfyui", flaky_upload)
+    response = client.post("/upscale_image/tiled", data={"image": big_image()})
+    assert response.status_code == 200
+    assert response.headers["X-Tile-Retries"] == "1"
+    assert response.get_json()["output_image_base64"]
+
+
+def test_plan_tiles():
+    from pipelines.tiled_upscale import plan_tiles, tile_starts
+
+    assert tile_starts(800, 1024, 64) == [0]
+    starts = tile_starts(2500, 1024, 64)
+    assert starts[0] == 0 and starts[-1] == 2500 - 1024
+    assert all(b - a <= 1024 - 64 for a, b in zip(starts, starts[1:]))
+    boxes, grid = plan_tiles(2500, 700)
+    assert grid == (3, 1)
+    assert boxes == [(x, 0, x + 1024, 700) for x in starts]
+
+
+def test_tile_merger():
+    from PIL import Image
+
+    from pipelines.tiled_upscale import TileMerger, plan_tiles
+
+    boxes, grid = plan_tiles(300, 200, tile=128, overlap=32)
+    merger = TileMerger(boxes, grid, 300, 200)
+
+    def tile(box):
+        out = io.BytesIO()
+        Image.new("RGB", (2 * (box[2] - box[0]), 2 * (box[3] - box[1])), (10, 200, 30)).save(out, "PNG")
+        return out.getvalue()
+
+    # Out of order tiles wait for their turn
+    for index in reversed(range(len(boxes))):
+        merger.add(index, tile(boxes[index]))
+    assert merger.merged == len(boxes)
+    with Image.open(io.BytesIO(merger.png())) as merged:
+        assert merged.size == (600, 400)
+        assert merged.getextrema() == ((10, 10), (200, 200), (30, 30))
@@ -0,0 +1,37 @@
+import json
+
+
+def test_parse_traceparent(app):
+    from tracing import parse_traceparent
+
+    trace_id, span_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+    assert parse_traceparent(f"00-{trace_id}-{span_id}-01") == (trace_id, span_id, True)
+    assert parse_traceparent(f"00-{trace_id}-{span_id}-00") == (trace_id, span_id, False)
+    for header in (None, "", "garbage", f"00-{'0' * 32}-{span_id}-01", f"00-{trace_id}-{span_id[:8]}-01",
+                   f"00-{trace_id}-zzzzzzzzzzzzzzzz-01"):
+        assert parse_traceparent(header) is None
+
+
+def test_job_spans(make_manager, monkeypatch, tmp_path):
+    import tracing
+
+    path = tmp_path / "spans.jsonl"
+    monkeypatch.setattr(tracing, "ENABLED", True)
+    monkeypatch.setattr(tracing, "_exporter", tracing.SpanExporter(path=str(path), endpoint=None))
+    manager, _ = make_manager(0.05)
+    tracing.init_app(manager.app)
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    client = manager.app.test_client()
+    response = client.post("/jobs/echo", headers={"traceparent": f"00-{trace_id}-00f067aa0ba902b7-01"})
+    assert response.status_code == 202
+    job = manager.get(response.get_json()["job_id"])
+    assert job.done.wait(10) and job.status == "succeeded"
+
+    tracing._exporter.flush()
+    spans = [span for line in path.read_text().splitlines()
+             for resource in json.loads(line)["resourceSpans"]
+             for scope in resource["scopeSpans"] for span in scope["spans"]]
+    assert {span["traceId"] for span in spans} == {trace_id}
+    names = {span["name"] for span in spans}
+    assert {"POST /jobs/echo", "job echo", "schedule", "comfyui prompt", "execute"} <= names
+    assert any(name.endswith("LoadImage") for name in names)
@@ -0,0 +1,34 @@
+import uuid
+
+
+def test_same_bytes_upload_once(app, fake_comfyui, tmp_path):
+    from comfy_client import get_client
+    from upload_cache import UploadCache
+
+    cache = UploadCache(path=str(tmp_path / "uploads.json"))
+    client = get_client(fake_comfyui.url)
+    data = uuid.uuid4().bytes
+    before = fake_comfyui.request_counts.get("/upload/image", 0)
+    name = cache.upload(client, data, "person.png")
+    assert cache.upload(client, data, "other_name.png") == name
+    assert fake_comfyui.request_counts["/upload/image"] == before + 1
+    assert cache.stats()["hits"] == 1
+
+    # Kept across restarts
+    cache.save(force=True)
+    restarted = UploadCache(path=str(tmp_path / "uploads.json"))
+    assert restarted.upload(client, data, "person.png") == name
+    assert fake_comfyui.request_counts["/upload/image"] == before + 1
+
+
+def test_uploaded_by_another_process(app, fake_comfyui, tmp_path):
+    # The content-addressed name is already on the server: nothing to upload
+    from comfy_client import get_client
+    from upload_cache import UploadCache
+
+    client = get_client(fake_comfyui.url)
+    data = uuid.uuid4().bytes
+    name = UploadCache(path=str(tmp_path / "a.json")).upload(client, data, "image.png")
+    before = fake_comfyui.request_counts["/upload/image"]
+    assert UploadCache(path=str(tmp_path / "b.json")).upload(client, data, "image.png") == name
+    assert fake_comfyui.request_counts["/upload/image"] == before
@@ -0,0 +1,239 @@
+# Optional request tracing, exported as OpenTelemetry (OTLP/JSON) spans.
+#
+# A trace ties one HTTP request to its job(s), the stages of each job (read,
+# upload, schedule, queue, wait, collect, ...) and the ComfyUI prompt: time
+# queued in ComfyUI, execution, and one span per executed node from the /ws
+# "executing" events (e.g. "4 LayerMask: SegmentAnythingUltra V2"), so the
+# slow node of a run shows up directly.
+#
+# Off unless TRACE_FILE (one OTLP/JSON document per line) or TRACE_ENDPOINT
+# (an OTLP/HTTP collector, e.g. http://localhost:4318/v1/traces; the fake
+# ComfyUI server has a stub at /v1/traces) is set. TRACE_SAMPLE is the
+# fraction of requests traced (default 1); an incoming W3C traceparent header
+# continues the caller's trace. Spans are exported in batches by a background
+# thread through a bounded queue, dropping spans when it is full.
+
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import requests
+from flask import g, has_request_context, request
+
+import logs
+
+TRACE_FILE = os.environ.get("TRACE_FILE")
+TRACE_ENDPOINT = os.environ.get("TRACE_ENDPOINT")
+TRACE_SAMPLE = float(os.environ.get("TRACE_SAMPLE", 1))
+TRACE_SERVICE_NAME = os.environ.get("TRACE_SERVICE_NAME", "comfyui-api")
+TRACE_QUEUE_SIZE = 10000
+EXPORT_BATCH_SIZE = 512
+ENABLED = bool(TRACE_FILE or TRACE_ENDPOINT)
+
+SPAN_KIND_INTERNAL = 1
+SPAN_KIND_SERVER = 2
+SPAN_KIND_CLIENT = 3
+STATUS_ERROR = 2
+
+logger = logging.getLogger(__name__)
+
+
+def wall_ns(monotonic_time):
+    # time.monotonic() reading -> Unix nanoseconds
+    return time.time_ns() - int((time.monotonic() - monotonic_time) * 1e9)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, start_ns=None, kind=SPAN_KIND_INTERNAL, **attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = {k: v for k, v in attributes.items() if v is not None}
+        self.error = None
+
+    def child(self, name, start_ns=None, kind=SPAN_KIND_INTERNAL, **attributes):
+        return Span(name, self.trace_id, self.span_id, start_ns, kind, **attributes)
+
+    def set_attribute(self, key, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def set_error(self, message):
+        self.error = str(message)
+
+    def end(self, end_ns=None):
+        if self.end_ns is None:
+            self.end_ns = end_ns or time.time_ns()
+            get_exporter().export(self)
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error is not None:
+            span["status"] = {"code": STATUS_ERROR, "message": self.error}
+        return span
+
+
+def record(parent, name, start_ns, end_ns, **attributes):
+    # A finished child span of parent (None: not traced); returns it
+    if parent is None:
+        return None
+    span = parent.child(name, start_ns, **attributes)
+    span.end(end_ns)
+    return span
+
+
+def parse_traceparent(header):
+    # (trace_id, parent span_id, sampled) from a W3C traceparent header, or None
+    parts = (header or "").strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16 or parts[1] == "0" * 32:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        flags = int(parts[3], 16)
+    except ValueError:
+        return None
+    return parts[1], parts[2], bool(flags & 1)
+
+
+def start_trace(name, traceparent=None, kind=SPAN_KIND_SERVER, **attributes):
+    # Root span of a request, or None when tracing is off or the request is not sampled
+    if not ENABLED:
+        return None
+    parent = parse_traceparent(traceparent)
+    if parent is not None:
+        trace_id, parent_id, sampled = parent
+    else:
+        trace_id, parent_id, sampled = os.urandom(16).hex(), None, random.random() < TRACE_SAMPLE
+    if not sampled:
+        return None
+    return Span(name, trace_id, parent_id, kind=kind, **attributes)
+
+
+def current_span():
+    if has_request_context():
+        return getattr(g, "trace_span", None)
+    return None
+
+
+class SpanExporter:
+    def __init__(self, path=TRACE_FILE, endpoint=TRACE_ENDPOINT):
+        self.path = path
+        self.endpoint = endpoint
+        self.dropped = 0
+        self._queue = queue.Queue(TRACE_QUEUE_SIZE)
+        self._session = requests.Session()
+        self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def export(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < EXPORT_BATCH_SIZE:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            except Exception as e:
+                logger.warning("Error exporting %d spans: %s", len(batch), e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write(self, spans):
+        document = json.dumps({"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": TRACE_SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": "comfyui-api"}, "spans": [span.to_otlp() for span in spans]}],
+        }]})
+        if self.path:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(document + "\n")
+        if self.endpoint:
+            response = self._session.post(self.endpoint, data=document, headers={"Content-Type": "application/json"},
+                                          timeout=5)
+            response.raise_for_status()
+
+    def flush(self):
+        self._queue.join()
+
+
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+def get_exporter():
+    global _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            _exporter = SpanExporter()
+    return _exporter
+
+
+def _log_context():
+    span = current_span()
+    return {"trace_id": span.trace_id} if span is not None else {}
+
+
+def init_app(app):
+    if not ENABLED:
+        return
+    logs.add_context_provider(_log_context)
+
+    @app.before_request
+    def start_request_span():
+        g.trace_span = start_trace(
+            f"{request.method} {request.url_rule.rule if request.url_rule else request.path}",
+            request.headers.get("traceparent"),
+            **{"http.method": request.method, "http.target": request.full_path.rstrip("?"),
+               "request_id": logs.request_id()},
+        )
+
+    @app.after_request
+    def end_request_span(response):
+        span = getattr(g, "trace_span", None)
+        if span is not None:
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.set_error(f"HTTP {response.status_code}")
+            span.end()
+        return response
@@ -0,0 +1,189 @@
+# Content-addressed upload cache for ComfyUI input images.
+#
+# Uploads are keyed by the SHA-256 of the image bytes. Images are stored on
+# ComfyUI under a content-derived filename, and a bounded, persistent index
+# maps (ComfyUI URL, digest) -> server filename. When the same bytes come in
+# again we confirm the file still exists with a cheap HEAD /view request
+# (at most once per VERIFY_INTERVAL) and reuse it instead of re-uploading.
+#
+# upload_many() uploads all input images of a workflow concurrently on a
+# bounded thread pool (UPLOAD_WORKERS).
+
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+UPLOAD_CACHE_PATH = os.environ.get(
+    "UPLOAD_CACHE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "cache", "uploads.json")
+)
+MAX_ENTRIES = 10000
+VERIFY_INTERVAL = 300
+SAVE_INTERVAL = 5
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", 8))
+
+logger = logging.getLogger(__name__)
+
+
+def content_digest(image_data):
+    return hashlib.sha256(image_data).hexdigest()
+
+
+def content_filename(digest, filename):
+    ext = os.path.splitext(filename)[1].lower() or ".png"
+    return f"sha256_{digest[:32]}{ext}"
+
+
+class UploadCache:
+    def __init__(self, path=UPLOAD_CACHE_PATH, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # "url|digest" -> {"name": ..., "verified_at": ...}
+        self._dirty = False
+        self._last_save = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable upload cache %s: %s", self.path, e)
+            return
+        for key, entry in data.get("entries", [])[-self.max_entries:]:
+            self._entries[key] = entry
+
+    def save(self, force=False):
+        with self._lock:
+            if not self._dirty or (not force and time.time() - self._last_save < SAVE_INTERVAL):
+                return
+            payload = {"entries": list(self._entries.items())}
+            self._dirty = False
+            self._last_save = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(payload, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error("Error saving upload cache %s: %s", self.path, e)
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _put(self, key, name, verified_at):
+        with self._lock:
+            self._entries[key] = {"name": name, "verified_at": verified_at}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._dirty = True
+
+    def _forget(self, key):
+        with self._lock:
+            if self._entries.pop(key, None) is not None:
+                self._dirty = True
+
+    def exists_on_server(self, client, name):
+        params = {"filename": name, "subfolder": "", "type": "input"}
+        try:
+            response = client.session.head(client.url("/view"), params=params, timeout=5)
+            return response.status_code == 200
+        except requests.exceptions.RequestException as e:
+            logger.warning("Error checking for %s on ComfyUI: %s", name, e)
+            return False
+
+    def upload(self, client, image_data, filename):
+        digest = content_digest(image_data)
+        key = f"{client.base_url}|{digest}"
+        now = time.time()
+
+        entry = self._get(key)
+        if entry is not None:
+            if now - entry["verified_at"] < VERIFY_INTERVAL or self.exists_on_server(client, entry["name"]):
+                if now - entry["verified_at"] >= VERIFY_INTERVAL:
+                    self._put(key, entry["name"], now)
+                self._record_hit(len(image_data))
+                return entry["name"]
+            self._forget(key)
+
+        name = content_filename(digest, filename)
+        # Another process may already have uploaded the same bytes under the same name
+        if self.exists_on_server(client, name):
+            self._put(key, name, now)
+            self._record_hit(len(image_data))
+            self.save()
+            return name
+
+        with self._lock:
+            self.misses += 1
+        uploaded_name = client.upload_image(image_data, name)
+        if uploaded_name:
+            self._put(key, uploaded_name, now)
+            self.save()
+        return uploaded_name
+
+    def upload_many(self, client, images):
+        # images: [(image_data, filename)]; returns the server filenames in the same order
+        if len(images) <= 1:
+            return [self.upload(client, data, filename) for data, filename in images]
+        futures = [_upload_pool().submit(self.upload, client, data, filename) for data, filename in images]
+        return [future.result() for future in futures]
+
+    def _record_hit(self, size):
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "bytes_saved": self.bytes_saved,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+_pool = None
+
+
+def _upload_pool():
+    global _pool
+    with _cache_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="comfyui-upload")
+    return _pool
+
+
+def get_upload_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = UploadCache()
+            atexit.register(_cache.save, force=True)
+    return _cache
+
+
+def init_app(app):
+    app.add_url_rule('/comfyui/upload_cache', 'comfyui_upload_cache', lambda: get_upload_cache().stats(), methods=['GET'])
@@ -0,0 +1,335 @@
+# Registry of the ComfyUI workflows in workflow/.
+#
+# Every *.json file (ComfyUI "Save (API format)") is indexed on first use under a
+# slug of its file name, e.g. "Cloth Swap.json" -> "cloth_swap", and validated.
+# The directory is re-scanned at most every RELOAD_INTERVAL seconds when a
+# workflow is looked up; only files whose mtime or size changed are re-read,
+# so edits apply without a restart. A file that fails validation is reported
+# and the last good version stays in use.
+#
+# POST /run/<workflow_name> runs any registered workflow: form files named
+# "<node_id>" (or "<node_id>.image") replace the image of that LoadImage node,
+# other form fields named "<node_id>.<input>" replace a literal node input.
+# The response holds every image of the workflow's output nodes.
+
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+
+from flask import jsonify, request
+from werkzeug.utils import secure_filename
+
+from backends import workflow_requirements
+from comfy_client import get_client
+from jobs import JobError, PendingPrompt, stage
+from logs import debug_sample
+from preprocess import preprocess_image
+from upload_cache import get_upload_cache
+from workflow_template import WorkflowTemplate
+
+WORKFLOW_DIR = os.environ.get(
+    "WORKFLOW_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "workflow")
+)
+RELOAD_INTERVAL = float(os.environ.get("WORKFLOW_RELOAD_INTERVAL", 2))
+
+logger = logging.getLogger(__name__)
+
+
+def workflow_slug(filename):
+    return re.sub(r"[^a-z0-9]+", "_", os.path.splitext(filename)[0].lower()).strip("_")
+
+
+def validate_workflow(graph):
+    if not isinstance(graph, dict) or not graph:
+        raise ValueError("not an API format workflow (expected a non-empty object of nodes)")
+    for node_id, node in graph.items():
+        if not isinstance(node, dict) or not isinstance(node.get("class_type"), str):
+            raise ValueError(f"node {node_id} has no class_type")
+        inputs = node.get("inputs")
+        if not isinstance(inputs, dict):
+            raise ValueError(f"node {node_id} has no inputs")
+        for input_name, value in inputs.items():
+            if is_link(value) and value[0] not in graph:
+                raise ValueError(f"node {node_id} input {input_name} links to missing node {value[0]}")
+
+
+def is_link(value):
+    return isinstance(value, list) and len(value) == 2 and isinstance(value[0], str) and isinstance(value[1], int)
+
+
+def output_nodes(graph):
+    # Nodes nothing else links to; in ComfyUI graphs these are the output nodes
+    linked = {value[0] for node in graph.values() for value in node["inputs"].values() if is_link(value)}
+    return sorted((node_id for node_id in graph if node_id not in linked), key=lambda n: (len(n), n))
+
+
+def image_limits(graph):
+    # LoadImage node -> the smallest max_megapixels declared by the nodes reading its image. An
+    # image also read by a node without a limit (e.g. CatVTON) is needed at full size and has none.
+    limits = {}
+    unlimited = set()
+    for node in graph.values():
+        max_megapixels = node["inputs"].get("max_megapixels")
+        if isinstance(max_megapixels, bool) or not isinstance(max_megapixels, (int, float)) or max_megapixels <= 0:
+            max_megapixels = None
+        for value in node["inputs"].values():
+            if is_link(value) and graph.get(value[0], {}).get("class_type") == "LoadImage":
+                if max_megapixels is None:
+                    unlimited.add(value[0])
+                else:
+                    limits[value[0]] = min(limits.get(value[0], max_megapixels), max_megapixels)
+    return {node_id: limit for node_id, limit in limits.items() if node_id not in unlimited}
+
+
+class Workflow:
+    def __init__(self, name, path, mtime, size, graph):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.graph = graph
+        self.loaded_at = time.time()
+        self.outputs = output_nodes(graph)
+        self.images = [node_id for node_id, node in graph.items()
+                       if node["class_type"] == "LoadImage" and "image" in node["inputs"]]
+        self.image_limits = image_limits(graph)
+        # Every literal input can be set through /run as "<node_id>.<input>"
+        self.template = WorkflowTemplate(graph, {
+            f"{node_id}.{input_name}": (node_id, input_name)
+            for node_id, node in graph.items()
+            for input_name, value in node["inputs"].items()
+            if not is_link(value)
+        }, name=name)
+        self.requirements = workflow_requirements(graph)
+        self._templates = {}
+        self._templates_lock = threading.Lock()
+
+    def compile(self, slots):
+        # Pipelines compile on their first request, and requests run on several threads
+        key = tuple(sorted(slots.items()))
+        with self._templates_lock:
+            template = self._templates.get(key)
+            if template is None:
+                template = self._templates[key] = WorkflowTemplate(self.graph, slots, name=self.name)
+        return template
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "file": os.path.basename(self.path),
+            "nodes": len(self.graph),
+            "images": self.images,
+            "image_limits": self.image_limits,
+            "outputs": self.outputs,
+            "loaded_at": self.loaded_at,
+        }
+
+
+class WorkflowRegistry:
+    def __init__(self, directory=WORKFLOW_DIR, reload_interval=RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._workflows = {}  # name -> Workflow
+        self._files = {}  # path -> (mtime, size) of the last version read, valid or not
+        self.errors = {}  # file name -> last validation error
+        self._last_scan = 0
+        self.reloads = 0
+        self.scan()
+
+    def scan(self):
+        with self._lock:
+            self._last_scan = time.time()
+            try:
+                entries = [e for e in os.scandir(self.directory) if e.is_file() and e.name.lower().endswith(".json")]
+            except FileNotFoundError:
+                entries = []
+
+            seen = set()
+            for entry in entries:
+                st = entry.stat()
+                seen.add(entry.path)
+                if self._files.get(entry.path) == (st.st_mtime, st.st_size):
+                    continue
+                self._files[entry.path] = (st.st_mtime, st.st_size)
+                self._load(entry.path, entry.name, st)
+
+            for path in set(self._files) - seen:
+                del self._files[path]
+                name = workflow_slug(os.path.basename(path))
+                workflow = self._workflows.get(name)
+                if workflow is not None and workflow.path == path:
+                    logger.info("Workflow %s removed", name)
+                    del self._workflows[name]
+                self.errors.pop(os.path.basename(path), None)
+
+    def _load(self, path, filename, st):
+        name = workflow_slug(filename)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                graph = json.load(f)
+            validate_workflow(graph)
+            workflow = Workflow(name, path, st.st_mtime, st.st_size, graph)
+        except (OSError, ValueError) as e:
+            logger.error("Invalid workflow %s: %s", filename, e)
+            self.errors[filename] = str(e)
+            return
+        self.errors.pop(filename, None)
+        if name in self._workflows:
+            self.reloads += 1
+            logger.info("Reloaded workflow %s from %s", name, filename)
+        self._workflows[name] = workflow
+
+    def _maybe_scan(self):
+        if time.time() - self._last_scan >= self.reload_interval:
+            self.scan()
+
+    def get(self, name):
+        self._maybe_scan()
+        with self._lock:
+            return self._workflows.get(name)
+
+    def require(self, name):
+        workflow = self.get(name)
+        if workflow is None:
+            raise KeyError(f"Unknown workflow {name}")
+        return workflow
+
+    def template(self, name, slots):
+        return self.require(name).compile(slots)
+
+    def requirements(self, name):
+        return self.require(name).requirements
+
+    def status(self):
+        self._maybe_scan()
+        with self._lock:
+            return {
+                "workflows": [w.to_dict() for w in sorted(self._workflows.values(), key=lambda w: w.name)],
+                "errors": dict(self.errors),
+                "reloads": self.reloads,
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry():
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = WorkflowRegistry()
+    return _registry
+
+
+def coerce_param(value, default):
+    # Form fields are strings; convert them to the type of the workflow's own value
+    if isinstance(default, bool):
+        if value.lower() in ("1", "true", "yes"):
+            return True
+        if value.lower() in ("0", "false", "no"):
+            return False
+        raise ValueError(f"expected a boolean, got {value!r}")
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    return value
+
+
+def run_workflow_name():
+    return request.view_args["workflow_name"]
+
+
+def run_requirements():
+    workflow = get_registry().get(run_workflow_name())
+    return workflow.requirements if workflow is not None else []
+
+
+def submit_run(comfyui_url):
+    name = run_workflow_name()
+    workflow = get_registry().get(name)
+    if workflow is None:
+        raise JobError(f"Unknown workflow {name}", 404)
+
+    params = {}
+    for field, value in request.form.items():
+        if field not in workflow.template.slots:
+            raise JobError(f"Unknown workflow parameter {field}", 400)
+        try:
+            params[field] = coerce_param(value, workflow.template.default(field))
+        except ValueError as e:
+            raise JobError(f"Invalid value for {field}: {e}", 400)
+
+    images = []
+    with stage("read"):
+        for field, image_file in request.files.items():
+            node_id = field[:-len(".image")] if field.endswith(".image") else field
+            if node_id not in workflow.images:
+                raise JobError(f"Node {node_id} of workflow {name} is not a LoadImage node", 400)
+            images.append((node_id, image_file.read(), secure_filename(image_file.filename) or "image.png"))
+
+    # Limits from the graph as built, since a max_megapixels can be one of the parameters
+    limits = image_limits(workflow.template.build(**params)) if images else {}
+    with stage("preprocess"):
+        images = [(node_id, *preprocess_image(data, filename, limits.get(node_id)))
+                  for node_id, data, filename in images]
+
+    with stage("upload"):
+        uploaded = get_upload_cache().upload_many(get_client(comfyui_url), [(data, filename) for _, data, filename in images])
+    for (node_id, _, _), uploaded_filename in zip(images, uploaded):
+        if not uploaded_filename:
+            raise JobError("Failed to upload image to ComfyUI")
+        params[f"{node_id}.image"] = uploaded_filename
+
+    # Randomize seeds the client did not set, like the dedicated pipelines do, and keep models
+    # loaded (cache_model) only while more jobs for them are coming
+    for param, (node_id, input_name) in workflow.template.slots.items():
+        if input_name in ("seed", "noise_seed") and param not in params:
+            params[param] = random.randint(0, 0xFFFFFFFFFFFFFFFF)
+
+    def build(keep_models):
+        cache_model = {param: keep_models for param, (_, input_name) in workflow.template.slots.items()
+                       if input_name == "cache_model" and param not in params}
+        graph = workflow.template.build(**params, **cache_model)
+        debug_sample(logger, "Workflow %s", name, graph=graph)
+        return graph
+
+    return PendingPrompt(build, {
+        "workflow": name,
+        "outputs": [(node_id, f"node_{node_id}", f"node_{node_id}_image_base64") for node_id in workflow.outputs],
+    })
+
+
+def collect_run(outputs, context, comfyui_url):
+    debug_sample(logger, "ComfyUI outputs", outputs=outputs)
+    payload = {"workflow": context["workflow"]}
+    node_ids = [node_id for node_id, _, _ in context["outputs"]]
+    images = get_client(comfyui_url).get_output_images(outputs, node_ids, encode=True)
+    for (node_id, name, key), node_images in zip(context["outputs"], images):
+        for i, image in enumerate(node_images):
+            if not image:
+                raise JobError(f"Failed to retrieve image data for node {node_id}.")
+            payload[key if i == 0 else f"{name}_{i}_image_base64"] = image[1]
+    if len(payload) == 1:
+        raise JobError("No output images found in ComfyUI outputs.")
+    return payload
+
+
+def init_app(app, job_manager):
+    job_manager.add_pipeline(
+        "run", submit_run, collect_run, max_wait_time=300,
+        outputs=lambda context: context["outputs"],
+        requirements=run_requirements,
+        route=False,
+    )
+    app.add_url_rule('/workflows', 'workflows', lambda: jsonify(get_registry().status()), methods=['GET'])
+    app.add_url_rule('/run/<workflow_name>', 'run_workflow',
+                     lambda workflow_name: job_manager.run_blocking("run"), methods=['POST'])
+    app.add_url_rule('/jobs/run/<workflow_name>', 'submit_run_job',
+                     lambda workflow_name: job_manager.submit_view("run"), methods=['POST'])
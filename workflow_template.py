@@ -0,0 +1,60 @@
+# Compiled ComfyUI workflow templates.
+#
+# A template owns a private copy of an API-format graph and a table of named
+# parameter slots, each pointing at one node input (node id + input key).
+# build() returns a new graph for one request: only the nodes that receive a
+# parameter are copied, every other node is shared with the template. Nothing
+# is shared between requests that any of them writes to, and there is no
+# per-request deep copy.
+#
+# Graphs returned by build() must be treated as read-only; pass every
+# per-request value through build() instead of assigning into the graph.
+
+import copy
+import json
+
+
+class WorkflowTemplate:
+    def __init__(self, graph, slots, name=None):
+        # slots: {param_name: (node_id, input_key)}
+        self.name = name
+        self._graph = copy.deepcopy(graph)
+        self.slots = {}
+        for param, (node_id, input_key) in slots.items():
+            node = self._graph.get(node_id)
+            if node is None:
+                raise ValueError(f"Workflow {name or ''} has no node {node_id} for parameter {param}")
+            if input_key not in node.get("inputs", {}):
+                raise ValueError(f"Node {node_id} of workflow {name or ''} has no input {input_key} for parameter {param}")
+            self.slots[param] = (node_id, input_key)
+
+        # node id -> [(param, input_key)], so build() copies each touched node once
+        self._nodes = {}
+        for param, (node_id, input_key) in self.slots.items():
+            self._nodes.setdefault(node_id, []).append((param, input_key))
+
+    @classmethod
+    def load(cls, path, slots, name=None):
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f), slots, name)
+
+    def default(self, param):
+        node_id, input_key = self.slots[param]
+        return self._graph[node_id]["inputs"][input_key]
+
+    def build(self, **params):
+        unknown = set(params) - set(self.slots)
+        if unknown:
+            raise TypeError(f"Unknown workflow parameters: {', '.join(sorted(unknown))}")
+
+        graph = dict(self._graph)
+        for node_id, node_slots in self._nodes.items():
+            values = [(input_key, params[param]) for param, input_key in node_slots if param in params]
+            if not values:
+                continue
+            node = dict(graph[node_id])
+            node["inputs"] = dict(node["inputs"])
+            for input_key, value in values:
+                node["inputs"][input_key] = value
+            graph[node_id] = node
+        return graph